@@ -3,6 +3,7 @@
 import argparse
 import os.path
 from medialinkfs import organize
+from medialinkfs import watch
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
@@ -10,6 +11,12 @@ logging.basicConfig(level=logging.DEBUG)
 parser = argparse.ArgumentParser(description="Organize a media library using symlinks")
 parser.add_argument('--config', '-c', action='store', dest='config', required=True)
 parser.add_argument('--ignore-cache', '-i', action='store_true', dest='ignore_cache')
+parser.add_argument('--dry-run', '-n', action='store_true', dest='dry_run', help="Only log the links that would be changed")
+parser.add_argument('--watch', '-w', action='store_true', dest='watch', help="Keep running, and organize items as they change")
+parser.add_argument('--retry-failed', action='store_true', dest='retry_failed', help="When resuming, look up the items that a parser crashed on again")
+parser.add_argument('--retry-unknown', action='store_true', dest='retry_unknown', help="When resuming, look up the items that a parser couldn't find again")
+parser.add_argument('--full-cleanup', action='store_true', dest='full_cleanup', help="Check every link of the output directories, even within the fullCleanupInterval")
+parser.add_argument('--migrate-cache', action='store_true', dest='migrate_cache', help="Import old .cache-* files into each set's cacheBackend")
 parser.add_argument('--verbose', '-v')
 parser.add_argument('set_name', nargs='?')
 options = vars(parser.parse_args())
@@ -17,4 +24,9 @@ options = vars(parser.parse_args())
 if not os.path.isfile(options['config']):
 	print("Could not open config file %s"%options['config'])
 
-organize.organize(options)
+if options['migrate_cache']:
+	organize.migrate_caches(options)
+elif options['watch']:
+	watch.watch(options)
+else:
+	organize.organize(options)
@@ -0,0 +1,320 @@
+""" Storage for the metadata cache of each set
+The cacheBackend setting picks how the cache is stored in the cacheDir:
+  sqlite - A single metadata.sqlite file, the default
+  files - One .cache-<md5> json file per item
+"""
+
+import abc
+import os
+import os.path
+import glob
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import traceback
+import json
+
+try:
+	import simplejson as json
+except:
+	pass
+
+from . import errors
+
+logger = logging.getLogger(__name__)
+
+class MetadataCache(object, metaclass=abc.ABCMeta):
+	""" Base class for the cache backends
+	Entries are dicts of metadata keyed by the item name
+	Backends store the entries with load_entry, save_entry,
+	delete_entry and names
+	"""
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		self.prefetched = {}
+		self.lock = threading.RLock()
+
+	def load(self, name):
+		""" Returns the cached data for this item, or None """
+		with self.lock:
+			if name in self.prefetched:
+				return self.prefetched.pop(name)
+		return self.load_entry(name)
+
+	def load_many(self, names):
+		""" Returns a dict of the cached data for any of these items """
+		ret = {}
+		for name in names:
+			data = self.load(name)
+			if data is not None:
+				ret[name] = data
+		return ret
+
+	def prefetch(self, names):
+		""" Loads the data for several items at once
+		The next load() for each of them won't need to read the store
+		"""
+		loaded = self.load_many(names)
+		with self.lock:
+			self.prefetched.update(loaded)
+
+	def save(self, name, data):
+		with self.lock:
+			self.prefetched.pop(name, None)
+		self.save_entry(name, data)
+
+	def save_many(self, entries):
+		for name, data in entries.items():
+			self.save(name, data)
+
+	def delete(self, name):
+		with self.lock:
+			self.prefetched.pop(name, None)
+		self.delete_entry(name)
+
+	@abc.abstractmethod
+	def names(self):
+		""" Returns the names of every cached item """
+
+	def flush(self):
+		pass
+
+	def close(self):
+		self.flush()
+
+	@abc.abstractmethod
+	def load_entry(self, name):
+		""" Reads an item's data from the store, or returns None """
+
+	@abc.abstractmethod
+	def save_entry(self, name, data):
+		""" Writes an item's data to the store, possibly buffered until flush() """
+
+	@abc.abstractmethod
+	def delete_entry(self, name):
+		""" Removes an item's data from the store """
+
+	@abc.abstractmethod
+	def commit_many(self, entries):
+		""" Writes these items' data to the store right away,
+		raising an exception if it couldn't be
+		"""
+
+class FileCache(MetadataCache):
+	""" Stores each item in its own .cache-<md5> file """
+	def get_path(self, name):
+		return os.path.join(self.cache_dir, ".cache-%s"%(get_cache_key(name),))
+
+	def load_entry(self, name):
+		cache_path = self.get_path(name)
+		try:
+			with open(cache_path) as reading:
+				return json.loads(reading.read())
+		except:
+			if os.path.isfile(cache_path):
+				msg = "Failed to open cache file for %s (%s): %s" % \
+				      (name, cache_path, traceback.format_exc())
+				logger.warning(msg)
+			return None
+
+	def save_entry(self, name, data):
+		cache_path = self.get_path(name)
+		try:
+			with open(cache_path, 'w') as writing:
+				writing.write(json.dumps(data))
+		except:
+			msg = "Failed to save cache file for %s (%s): %s" % \
+			      (name, cache_path, traceback.format_exc())
+			logger.warning(msg)
+
+	def delete_entry(self, name):
+		cache_path = self.get_path(name)
+		if os.path.isfile(cache_path):
+			os.unlink(cache_path)
+
+	def commit_many(self, entries):
+		for name, data in entries.items():
+			with self.lock:
+				self.prefetched.pop(name, None)
+			with open(self.get_path(name), 'w') as writing:
+				writing.write(json.dumps(data))
+
+	def names(self):
+		names = []
+		for path in glob.glob(os.path.join(self.cache_dir, '.cache-*')):
+			try:
+				with open(path) as reading:
+					names.append(json.loads(reading.read())['name'])
+			except:
+				pass
+		return names
+
+class SqliteCache(MetadataCache):
+	""" Stores every item in a single sqlite database
+	Saved entries are buffered and written in batches
+	"""
+	filename = 'metadata.sqlite'
+
+	def __init__(self, cache_dir, batch_size=100):
+		super(SqliteCache, self).__init__(cache_dir)
+		self.batch_size = batch_size
+		self.pending = {}
+		self.path = os.path.join(cache_dir, self.filename)
+		self.db = sqlite3.connect(self.path, check_same_thread=False)
+		with self.db:
+			self.db.execute("CREATE TABLE IF NOT EXISTS metadata "
+			                "(name TEXT PRIMARY KEY, data TEXT, updated REAL)")
+
+	def load_entry(self, name):
+		return self.load_many([name]).get(name)
+
+	def load_many(self, names):
+		ret = {}
+		missing = []
+		with self.lock:
+			for name in names:
+				if name in self.prefetched:
+					ret[name] = self.prefetched.pop(name)
+				elif name in self.pending:
+					ret[name] = dict(self.pending[name])
+				else:
+					missing.append(name)
+			# sqlite limits the number of parameters in a query
+			for start in range(0, len(missing), 500):
+				chunk = missing[start:start+500]
+				query = "SELECT name, data FROM metadata WHERE name IN (%s)" % \
+				        (','.join('?' * len(chunk)),)
+				for name, data in self.db.execute(query, chunk):
+					try:
+						ret[name] = json.loads(data)
+					except:
+						msg = "Failed to load cached data for %s: %s" % \
+						      (name, traceback.format_exc())
+						logger.warning(msg)
+		return ret
+
+	def save_entry(self, name, data):
+		with self.lock:
+			self.pending[name] = data
+			if len(self.pending) >= self.batch_size:
+				self.flush()
+
+	def save_many(self, entries):
+		with self.lock:
+			self.pending.update(entries)
+			self.flush()
+
+	def delete_entry(self, name):
+		with self.lock:
+			self.pending.pop(name, None)
+			with self.db:
+				self.db.execute("DELETE FROM metadata WHERE name = ?", (name,))
+
+	def names(self):
+		with self.lock:
+			names = set(self.pending.keys())
+			names.update([row[0] for row in self.db.execute("SELECT name FROM metadata")])
+		return sorted(names)
+
+	def commit_many(self, entries):
+		with self.lock:
+			for name in entries:
+				self.prefetched.pop(name, None)
+				self.pending.pop(name, None)
+			self.write_rows(entries)
+
+	def write_rows(self, entries):
+		now = time.time()
+		rows = [(name, json.dumps(data), now) for name, data in entries.items()]
+		with self.db:
+			self.db.executemany("INSERT OR REPLACE INTO metadata "
+			                    "(name, data, updated) VALUES (?, ?, ?)", rows)
+
+	def flush(self):
+		with self.lock:
+			if len(self.pending) == 0:
+				return
+			try:
+				self.write_rows(self.pending)
+			except:
+				msg = "Failed to save cached data to %s: %s" % \
+				      (self.path, traceback.format_exc())
+				logger.warning(msg)
+			self.pending = {}
+
+	def close(self):
+		with self.lock:
+			self.flush()
+			self.db.close()
+
+backends = {
+	'sqlite': SqliteCache,
+	'files': FileCache
+}
+
+# open caches, keyed by cacheDir
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache_key(name):
+	h = hashlib.new('md5')
+	h.update(name.encode('utf-8'))
+	return h.hexdigest()
+
+def open_cache(cache_dir, backend='sqlite'):
+	if backend not in backends:
+		raise errors.SetError("Unknown cacheBackend %s"%(backend,))
+	return backends[backend](cache_dir)
+
+def get_cache(settings):
+	""" Returns the open cache for this set, opening it if needed """
+	with _caches_lock:
+		cache_dir = settings['cacheDir']
+		if cache_dir not in _caches:
+			_caches[cache_dir] = open_cache(cache_dir, settings.get('cacheBackend', 'sqlite'))
+		return _caches[cache_dir]
+
+def close_cache(settings):
+	with _caches_lock:
+		cache = _caches.pop(settings['cacheDir'], None)
+	if cache:
+		cache.close()
+
+def migrate_file_cache(cache_dir, cache, remove=True):
+	""" Imports any .cache-<md5> files into another cache backend
+	Each batch of files is only removed once it has been stored
+	Returns how many entries were imported
+	"""
+	if isinstance(cache, FileCache):
+		return 0
+	imported = 0
+	paths = glob.glob(os.path.join(cache_dir, '.cache-*'))
+	for start in range(0, len(paths), 500):
+		entries = {}
+		read_paths = []
+		for path in paths[start:start+500]:
+			try:
+				with open(path) as reading:
+					data = json.loads(reading.read())
+				entries[data['name']] = data
+				read_paths.append(path)
+			except:
+				msg = "Failed to import cache file %s: %s" % \
+				      (path, traceback.format_exc())
+				logger.warning(msg)
+		if len(entries) == 0:
+			continue
+		try:
+			cache.commit_many(entries)
+		except Exception:
+			msg = "Failed to import %s cache files, keeping them: %s" % \
+			      (len(read_paths), traceback.format_exc())
+			logger.warning(msg)
+			continue
+		imported += len(entries)
+		if remove:
+			for path in read_paths:
+				os.unlink(path)
+	return imported
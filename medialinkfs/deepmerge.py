@@ -23,7 +23,28 @@ def deep_merge_dict(target, update):
 			target[skey] = update[skey]
 
 def deep_merge_list(target, update):
+	""" Appends the items of update that aren't in target yet, in order
+	Hashable items are looked up in a set, instead of searching the list
+	"""
+	if hasattr(update, '__len__') and len(update) <= 4:
+		# searching for a few items is quicker than building the set
+		for item in update:
+			if item not in target:
+				target.append(item)
+		return
+	seen = set()
+	for item in target:
+		try:
+			seen.add(item)
+		except TypeError:
+			pass
 	for item in update:
-		if item not in target:
-			target.append(item)
-
+		try:
+			if item in seen:
+				continue
+			seen.add(item)
+		except TypeError:
+			# unhashable, such as a dict, so search for it the slow way
+			if item in target:
+				continue
+		target.append(item)
@@ -12,3 +12,6 @@ class MissingSourceDir(SetError):
 
 class MissingDestDir(SetError):
 	pass
+
+class QuotaExceeded(MediaLinkFSError):
+	pass
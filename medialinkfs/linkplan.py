@@ -0,0 +1,326 @@
+""" Plans the links of a set and applies them to the output directories
+A LinkPlan holds every link that a set wants, and reconcile() compares
+it with what is already in each output directory, so that only the
+missing links are made and only the extra ones are removed.
+Each directory is read once with os.scandir, and where the platform
+allows it, changed relative to an open handle of the directory, so
+that each change doesn't have to look up the whole path again.
+"""
+
+import os
+import os.path
+import glob
+import logging
+import stat
+import traceback
+
+from .toc import load_toc, TocWriter
+
+logger = logging.getLogger(__name__)
+
+class LinkPlan(object):
+	def __init__(self):
+		# dest -> value -> item name -> link target
+		self.dests = {}
+		# the (destdir, itempath) and path between them of the last link,
+		# because an item is usually added to several groups in a row
+		self.last_relpath = (None, None)
+
+	def add(self, destdir, value, itemname, itempath):
+		values = self.dests.setdefault(destdir, {})
+		items = values.setdefault(value, {})
+		items[link_name(itemname)] = self.get_target(destdir, value, itempath)
+
+	def get_target(self, destdir, value, itempath):
+		""" Returns the relative path from the group directory to the item """
+		if value in ['', os.curdir, os.pardir] or os.sep in value:
+			return os.path.relpath(itempath, os.path.join(destdir, value))
+		key, relpath = self.last_relpath
+		if key != (destdir, itempath):
+			relpath = os.path.relpath(itempath, destdir)
+			self.last_relpath = ((destdir, itempath), relpath)
+		if relpath == value:
+			return os.curdir
+		if relpath.startswith(value + os.sep):
+			return relpath[len(value)+1:]
+		return os.path.join(os.pardir, relpath)
+
+	def add_links(self, itemname, itempath, links):
+		""" Adds the [dest, value] links that an item had before """
+		for destdir, value in links:
+			self.add(destdir, value, itemname, itempath)
+
+	def values(self, destdir):
+		return self.dests.get(destdir, {})
+
+	def __len__(self):
+		return sum([len(items) for values in self.dests.values() for items in values.values()])
+
+def link_name(itemname):
+	""" Returns the name of an item's links
+	Items found by the recursive scanMode are named by their path,
+	such as Artist/Album, which has to be flattened into a single name
+	"""
+	return itemname.replace('/', '／')
+
+# whether directories can be changed through an open handle
+use_dir_fd = hasattr(os, 'O_DIRECTORY') and \
+             set([os.open, os.mkdir, os.readlink, os.stat, os.symlink, os.unlink]) <= os.supports_dir_fd and \
+             os.scandir in os.supports_fd
+
+def open_dir(path, dir_fd=None):
+	""" Returns a handle of a directory to make changes relative to,
+	or None if it isn't supported or the directory doesn't exist
+	"""
+	if not use_dir_fd:
+		return None
+	try:
+		return os.open(path, os.O_RDONLY | os.O_DIRECTORY, dir_fd=dir_fd)
+	except OSError:
+		return None
+
+def close_dir(dir_fd):
+	if dir_fd is not None:
+		os.close(dir_fd)
+
+def relative_to(dir_fd, name, path):
+	""" The path to pass to a function along with the dir_fd """
+	if dir_fd is None:
+		return path
+	return name
+
+class Reconciler(object):
+	""" Makes the output directories of a set match a LinkPlan
+	clean - remove any links that aren't in the plan
+	dry_run - only log what would be changed
+	fake_clean - only log what would be removed
+	write_tocs - record the plan in each directory's .toc.done file
+	"""
+	def __init__(self, settings, clean=True, dry_run=False, fake_clean=False, write_tocs=True):
+		self.settings = settings
+		self.setname = settings['name']
+		self.clean = clean
+		self.dry_run = dry_run
+		self.tocs = None
+		if write_tocs:
+			self.tocs = TocWriter(self.setname, dry_run)
+		self.fake_clean = fake_clean or dry_run
+		self.operations = []
+		# any other directories we need, and should not delete
+		self.keep_paths = set([settings['sourceDir'], settings['cacheDir']])
+		self.keep_paths.update([o['dest'] for o in settings['output']])
+
+	def log_operation(self, operation, path, removal=False):
+		self.operations.append((operation, path))
+		if self.dry_run or (removal and self.fake_clean):
+			logger.debug("Would %s %s"%(operation, path))
+			return False
+		logger.debug("%s %s"%(operation.capitalize(), path))
+		return True
+
+	def reconcile(self, plan):
+		""" Returns the list of (operation, path) changes """
+		dests = []
+		for output in self.settings['output']:
+			if output['dest'] not in dests:
+				dests.append(output['dest'])
+		for destdir in dests:
+			values = plan.values(destdir)
+			if len(values) == 0:
+				# such as when the sourceDir is an unmounted share,
+				# which shouldn't be taken as every item being gone
+				if self.clean:
+					logger.warning("Set %s has nothing for %s, not cleaning it"%(self.setname, destdir))
+				continue
+			self.reconcile_dest(destdir, values)
+			# checkpoint the tocs of each finished output directory
+			if self.tocs:
+				self.tocs.flush()
+		return self.operations
+
+	def reconcile_dest(self, destdir, values):
+		dest_fd = open_dir(destdir)
+		try:
+			if self.clean:
+				entries = scan_dir(destdir, dir_fd=dest_fd)
+			else:
+				# only the planned group directories need to be looked at
+				entries = stat_names(destdir, values.keys(), dir_fd=dest_fd)
+			for value, items in sorted(values.items()):
+				valueDir = os.path.join(destdir, value)
+				kind = entries.get(value)
+				if kind == 'file':
+					logger.warning("Can't create group directory %s, a file is in the way"%(valueDir,))
+					continue
+				if kind is None and \
+				   self.log_operation('mkdir', valueDir):
+					os.mkdir(relative_to(dest_fd, value, valueDir), dir_fd=dest_fd)
+				value_fd = None
+				if dest_fd is not None:
+					value_fd = open_dir(value, dest_fd)
+				try:
+					self.reconcile_value_dir(valueDir, items, value_fd)
+				finally:
+					close_dir(value_fd)
+			if self.clean:
+				self.remove_extra(destdir, entries, values, dest_fd)
+		finally:
+			close_dir(dest_fd)
+		self.write_toc(destdir, values.keys())
+
+	def reconcile_value_dir(self, valueDir, items, dir_fd=None):
+		""" Makes all of the changes to a single group directory """
+		entries = scan_dir(valueDir, read_links=True, dir_fd=dir_fd)
+		for itemname, target in sorted(items.items()):
+			destpath = os.path.join(valueDir, itemname)
+			existing = entries.get(itemname)
+			if existing == ('link', target):
+				continue
+			if existing is not None and existing[0] != 'link':
+				logger.warning("Can't link %s, something else is in the way"%(destpath,))
+				continue
+			if existing is not None:
+				if not self.log_operation('relink', destpath):
+					continue
+				os.unlink(relative_to(dir_fd, itemname, destpath), dir_fd=dir_fd)
+			elif not self.log_operation('link', destpath):
+				continue
+			os.symlink(target, relative_to(dir_fd, itemname, destpath), dir_fd=dir_fd)
+		if self.clean:
+			kinds = dict([(name, kind[0]) for name, kind in entries.items()])
+			self.remove_extra(valueDir, kinds, items, dir_fd)
+		self.write_toc(valueDir, items.keys())
+
+	def remove_extra(self, path, entries, wanted, dir_fd=None):
+		""" Removes anything in this directory that isn't wanted,
+		isn't mentioned in .toc.extra, and doesn't belong to another set
+		"""
+		protected = None
+		for name, kind in sorted(entries.items()):
+			if name in wanted:
+				continue
+			if protected is None:
+				protected = load_protected(path, self.setname)
+			if name in protected:
+				continue
+			subpath = os.path.join(path, name)
+			if subpath in self.keep_paths:
+				continue
+			if kind == 'dir':
+				if self.log_operation('remove extra dir', subpath, removal=True):
+					safe_delete_dir(subpath)
+			elif kind == 'link':
+				if self.log_operation('remove extra link', subpath, removal=True):
+					os.unlink(relative_to(dir_fd, name, subpath), dir_fd=dir_fd)
+			else:
+				logger.debug("Not removing extra file %s"%(subpath,))
+
+	def write_toc(self, path, names):
+		""" Records which names this set has in the directory """
+		if self.tocs:
+			self.tocs.set(path, names)
+
+def scan_dir(path, read_links=False, dir_fd=None):
+	""" Returns a dict of the name of everything in this directory,
+	except for .toc files, to its kind: link, dir or file
+	If read_links is set, each kind is a (kind, link target) tuple
+	With a dir_fd of the directory, it is read through that instead
+	"""
+	entries = {}
+	try:
+		iterator = os.scandir(path if dir_fd is None else dir_fd)
+	except OSError:
+		return entries
+	with iterator:
+		for entry in iterator:
+			if entry.name[:4] == '.toc':
+				continue
+			if entry.is_symlink():
+				kind = 'link'
+			elif entry.is_dir():
+				kind = 'dir'
+			else:
+				kind = 'file'
+			if read_links:
+				target = None
+				if kind == 'link':
+					target = os.readlink(relative_to(dir_fd, entry.name, entry.path), dir_fd=dir_fd)
+				kind = (kind, target)
+			entries[entry.name] = kind
+	return entries
+
+def stat_names(path, names, dir_fd=None):
+	""" Returns the kind of each of these names that is in the directory,
+	like scan_dir but without reading the rest of it
+	"""
+	entries = {}
+	for name in names:
+		try:
+			mode = os.stat(relative_to(dir_fd, name, os.path.join(path, name)),
+			               dir_fd=dir_fd, follow_symlinks=False).st_mode
+		except OSError:
+			continue
+		if stat.S_ISLNK(mode):
+			entries[name] = 'link'
+		elif stat.S_ISDIR(mode):
+			entries[name] = 'dir'
+		else:
+			entries[name] = 'file'
+	return entries
+
+def load_protected(path, setname):
+	""" Returns the names in this directory that should never be removed
+	These are listed in .toc.extra, or in the .toc.done of another set
+	"""
+	protected = load_toc(os.path.join(path, '.toc.extra'))
+	own = os.path.join(path, '.toc.done-%s'%(setname,))
+	for alttoc in glob.glob(os.path.join(glob.escape(path), '.toc.done*')):
+		if alttoc != own:
+			protected.update(load_toc(alttoc))
+	return protected
+
+def safe_delete_dir(path):
+	# Extra files that we are allowed to delete
+	allowed_deletions_patterns = ['.toc', '.toc-*', '.toc.*']
+	allowed_deletions = []
+	for pattern in allowed_deletions_patterns:
+		found_deletions = glob.glob(os.path.join(glob.escape(path), pattern))
+		trimmed_deletions = [x[len(path)+1:] for x in found_deletions]
+		allowed_deletions.extend(trimmed_deletions)
+	if '.toc.extra' in allowed_deletions:
+		allowed_deletions.remove('.toc.extra')
+
+	# load up the list of extra things that we should not delete
+	extra_contents = load_toc(os.path.join(path,'.toc.extra'))
+
+	# start unlinking things
+	for name in os.listdir(path):
+		if name in extra_contents:
+			continue
+		spath = os.path.join(path, name)
+		try:
+			if not os.path.islink(spath) and \
+			   os.path.isdir(spath):
+				safe_delete_dir(spath)
+			if not os.path.islink(spath) and \
+			   os.path.isfile(spath):
+				if name in allowed_deletions:
+					os.unlink(spath)
+			if os.path.islink(spath):
+				os.unlink(spath)
+		except:
+			raise
+			msg = "An error happened while safely cleaning %s: %s" % \
+			      (spath, traceback.format_exc())
+			logger.warning(msg)
+
+	if len(os.listdir(path)) == 0:
+		os.rmdir(path)
+
+def apply_links(settings, plan):
+	""" Makes any of the links in the plan that are missing,
+	without removing anything else
+	Only the group directories in the plan are looked at, so this is
+	quick for a plan of a few items
+	"""
+	return Reconciler(settings, clean=False, write_tocs=False).reconcile(plan)
@@ -1,7 +1,16 @@
 from .config import import_config
 from .parsers import load_parser
+from .parsers import httpcache
+from .parsers import ratelimit
 from .deepmerge import deep_merge
+from . import cache
+from . import linkplan
+from . import toc
+from . import progress
 from . import errors
+from . import workers
+from . import parsergraph
+from . import scanner
 import os
 import os.path
 import logging
@@ -9,9 +18,13 @@ import sys
 import traceback
 import shutil
 import hashlib
+import copy
 import json
-import glob
 import re
+import collections
+import concurrent.futures
+import threading
+import time
 
 try:
 	import simplejson as json
@@ -20,7 +33,7 @@ except:
 
 logger = logging.getLogger(__name__)
 
-def organize(options):
+def load_sets(options):
 	config = import_config(options['config'])
 	default_settings = config.get('default_settings', {})
 	override_settings = config.get('override_settings', {})
@@ -29,141 +42,569 @@ def organize(options):
 		deep_merge(comb_settings, settings)
 		deep_merge(comb_settings, override_settings)
 		if options['set_name'] == None or options['set_name'] == settings['name']:
-			organize_set(options, comb_settings)
+			yield comb_settings
+
+def organize(options):
+	for settings in load_sets(options):
+		organize_set(options, settings)
+
+def migrate_caches(options):
+	for settings in load_sets(options):
+		if 'cacheDir' not in settings:
+			settings['cacheDir'] = os.path.join(settings['sourceDir'], '.cache')
+		if not os.path.isdir(settings['cacheDir']):
+			continue
+		try:
+			imported = cache.migrate_file_cache(settings['cacheDir'], cache.get_cache(settings))
+			logger.info("Imported %s cached items for %s"%(imported, settings['name']))
+		finally:
+			cache.close_cache(settings)
 
 def organize_set(options, settings):
 	logger.info("Beginning to organize %s"%(settings['name'],))
 	prepare_for_organization(settings)
-	processed_files = load_progress(settings)
-	if len(processed_files) == 0:
+	workers.start_pool(settings)
+	try:
+		ignore_cache = 'ignore_cache' in options and options['ignore_cache']
+		httpcache.use_cache(settings, revalidate=ignore_cache)
+		ratelimit.load_usage(settings['cacheDir'])
+		start_parsers(settings)
+		try:
+			organize_set_items(options, settings)
+		finally:
+			finish_parsers(settings)
+			ratelimit.save_usage(settings['cacheDir'])
+			cache.close_cache(settings)
+			httpcache.close_cache(settings)
+	finally:
+		workers.stop_pool(settings)
+
+def organize_set_items(options, settings):
+	journal = open_progress(settings)
+	statuses = journal.load()
+	if len(statuses) == 0:
 		start_progress(settings)
 	else:
-		logger.info("Resuming progress after %s items"%(len(processed_files)))
+		logger.info("Resuming progress after %s items"%(len(statuses)))
+	retry = get_retry_statuses(options)
+	processed_files = set([name for name, status in statuses.items()
+	                       if status not in retry])
 
 	regex = None
 	if 'regex' in settings:
 		regex = re.compile(settings['regex'])
 	omitted_dirs = generate_omitted_dirs(settings)
-	files = os.listdir(settings['sourceDir'])
-	files = sorted(files)
-	if settings['scanMode'] in ['directories', 'files', 'toplevel']:
-		for name in files:
-			if name in processed_files:
-				continue
-			path = os.path.join(settings['sourceDir'], name)
-			if path in omitted_dirs:
-				continue
-			if settings['scanMode'] != 'toplevel':
-				if settings['scanMode'] == 'directories' and \
-				   not os.path.isdir(path):
-					continue
-				if settings['scanMode'] == 'files' and \
-				   not os.path.isfile(path):
-					continue
-			if regex and not regex.search(path):
+	incremental = 'incremental' in settings and settings['incremental']
+	dry_run = 'dry_run' in options and options['dry_run']
+	# only update the links of the items that changed, instead of
+	# reconciling every output directory with the whole set
+	partial = len(statuses) == 0 and use_partial_cleanup(options, settings)
+	seen_items = set()
+	plan = None if partial else linkplan.LinkPlan()
+	if settings['scanMode'] in ['directories', 'files', 'toplevel', 'recursive']:
+		def wanted_items():
+			for name in scanner.scan_items(settings, regex, omitted_dirs):
+				if incremental or partial:
+					seen_items.add(name)
+				yield name
+		# even with ignore_cache, the links recorded for each item are kept
+		items = prefetch_cached_metadata(settings, wanted_items())
+		states = {}
+		items = planned_items(options, settings, items, processed_files, plan, states)
+		# metadata is fetched concurrently, but the plan and the
+		# progress file are only written from this thread, in order
+		try:
+			if partial:
+				for name, status in relink_items(options, settings, items):
+					states.pop(name)
+					journal.record(name, status)
+			else:
+				for name, metadata, status in fetch_metadata(options, settings, items):
+					links = do_output(options, settings, metadata, plan)
+					state = states.pop(name)
+					# a dry run doesn't make the links, so it can't record them
+					if not dry_run:
+						save_item_links(settings, name, state, links, status)
+					journal.record(name, status)
+		finally:
+			journal.close()
+	if (incremental or partial) and not dry_run:
+		if len(seen_items) == 0:
+			# such as an unmounted share, which shouldn't remove everything
+			logger.warning("Set %s found no items, not forgetting any"%(settings['name'],))
+		else:
+			forget_removed_items(settings, seen_items, retract=partial)
+	finish_progress(options, settings, plan, journal)
+
+def is_wanted_item(settings, name, regex=None, omitted_dirs=()):
+	""" Whether this name in the sourceDir is an item of the set """
+	path = os.path.join(settings['sourceDir'], name)
+	return scanner.is_wanted(settings, path, regex, omitted_dirs)
+
+def planned_items(options, settings, names, processed_files, plan, states):
+	""" Passes through the items that need their metadata loaded
+	Items that were already organized earlier in an interrupted run, or
+	that haven't changed since the last incremental run, are added to
+	the plan with the links that were recorded for them instead, unless
+	the plan is None because their links are already in place, in which
+	case unchanged items are skipped even without the incremental setting
+	The state of each passed item is recorded in states
+	"""
+	incremental = 'incremental' in settings and settings['incremental']
+	ignore_cache = 'ignore_cache' in options and options['ignore_cache']
+	metadata_cache = cache.get_cache(settings)
+	for name in names:
+		state = get_item_state(settings, name)
+		if name in processed_files or incremental or plan is None:
+			entry = metadata_cache.load(name) or {}
+			if 'links' in entry and \
+			   (name in processed_files or
+			    (not ignore_cache and entry.get('state') == state)):
+				logger.debug("Keeping the links of unchanged item %s"%(name,))
+				if plan is not None:
+					plan.add_links(name, os.path.join(settings['sourceDir'], name), entry['links'])
 				continue
-			organize_item(options, settings, name)
-			add_progress(settings, name)
-	finish_progress(settings)
+		states[name] = state
+		yield name
+
+def update_items(options, settings, names):
+	""" Looks up these items again and updates their links right away,
+	removing any links that they no longer need
+	Yields each item name once it is done
+	"""
+	for name, status in relink_items(options, settings, names):
+		yield name
+
+def relink_items(options, settings, names):
+	""" Updates the links of each item, using the links that the cache
+	remembers for it to remove only its own old links
+	Yields the (name, progress status) of each item once it is done
+	"""
+	metadata_cache = cache.get_cache(settings)
+	tocs = toc.TocWriter(settings['name'])
+	changes = {}
+	def tracked_items():
+		for name in names:
+			entry = metadata_cache.load(name) or {}
+			changes[name] = (get_item_state(settings, name), entry.get('links', []))
+			yield name
+	try:
+		for name, metadata, status in fetch_metadata(options, settings, tracked_items()):
+			state, old_links = changes.pop(name)
+			plan = linkplan.LinkPlan()
+			links = do_output(options, settings, metadata, plan)
+			linkplan.apply_links(settings, plan)
+			for destdir, value in links:
+				tocs.add(destdir, value)
+				tocs.add(os.path.join(destdir, value), linkplan.link_name(name))
+			wanted = set([tuple(link) for link in links])
+			retract_links(settings, name, [link for link in old_links if tuple(link) not in wanted], tocs)
+			save_item_links(settings, name, state, links, status)
+			yield (name, status)
+	finally:
+		tocs.flush()
 
 def organize_item(options, settings, name):
-	metadata = load_item_metadata(options, settings, name)
-	do_output(options, settings, metadata)
+	for name in update_items(options, settings, [name]):
+		pass
+
+# Incremental organization
+def get_item_state(settings, name):
+	""" Returns a fingerprint of the item in the sourceDir
+	Any change to its mtime, inode or size will change the fingerprint
+	"""
+	try:
+		stat = os.stat(os.path.join(settings['sourceDir'], name))
+		return [stat.st_mtime_ns, stat.st_ino, stat.st_size]
+	except OSError:
+		return None
+
+def save_item_links(settings, name, state, links, status=progress.OK):
+	""" Remembers the item's links, to reuse them if it doesn't change
+	Unless its metadata was loaded, its state isn't remembered, so that
+	the next run looks it up again
+	"""
+	metadata_cache = cache.get_cache(settings)
+	entry = metadata_cache.load(name) or {'name': name}
+	if status != progress.OK:
+		state = None
+	entry['state'] = state
+	entry['links'] = links
+	metadata_cache.save(name, entry)
+
+def forget_removed_items(settings, seen_items, retract=False):
+	""" Drops the cached data of items that are gone
+	With retract, their links are removed right away, otherwise they
+	are removed along with any other extra links
+	"""
+	metadata_cache = cache.get_cache(settings)
+	for name in list(metadata_cache.names()):
+		if name not in seen_items:
+			if retract:
+				logger.info("Removing %s from %s"%(name, settings['name']))
+				remove_item(settings, name)
+			else:
+				metadata_cache.delete(name)
+
+def remove_item(settings, name):
+	""" Removes the links and cached data of an item that is gone """
+	metadata_cache = cache.get_cache(settings)
+	entry = metadata_cache.load(name) or {}
+	if 'links' in entry:
+		logger.debug("Removing links to missing item %s"%(name,))
+		tocs = toc.TocWriter(settings['name'])
+		retract_links(settings, name, entry['links'], tocs)
+		tocs.flush()
+	metadata_cache.delete(name)
+
+def retract_links(settings, name, links, tocs):
+	for destdir, value in links:
+		valueDir = os.path.join(destdir, value)
+		destpath = os.path.join(valueDir, linkplan.link_name(name))
+		if os.path.islink(destpath):
+			logger.debug("Removing old link %s"%(destpath,))
+			os.unlink(destpath)
+		tocs.remove(valueDir, linkplan.link_name(name))
+		if remove_unused_dir(valueDir):
+			tocs.forget(valueDir)
+			tocs.remove(destdir, value)
+
+def remove_unused_dir(path):
+	""" Removes a group directory that has nothing but .toc files left
+	Returns whether it was removed
+	"""
+	try:
+		names = os.listdir(path)
+	except OSError:
+		return False
+	if '.toc.extra' in names or \
+	   len([x for x in names if x[:4] != '.toc']) > 0:
+		return False
+	logger.debug("Removing empty dir %s"%(path,))
+	for name in names:
+		os.unlink(os.path.join(path, name))
+	os.rmdir(path)
+	return True
+
+def get_concurrency(settings):
+	try:
+		return max(1, int(settings.get('concurrency', 1)))
+	except (TypeError, ValueError):
+		logger.warning("Set %s has an invalid concurrency %s"%(settings['name'], settings['concurrency']))
+		return 1
+
+def fetch_metadata(options, settings, names):
+	""" Loads the metadata for each of the given item names
+	Yields (name, metadata, status) tuples in the same order as the names,
+	while up to the set's concurrency setting are loaded at once
+	"""
+	concurrency = get_concurrency(settings)
+	if concurrency == 1:
+		for name in names:
+			yield (name,) + load_item_metadata(options, settings, name)
+		return
+
+	# keep a bounded window of pending lookups, so that a huge set
+	# doesn't queue up every item at once
+	window = concurrency * 2
+	pending = collections.deque()
+	executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+	try:
+		for name in names:
+			pending.append((name, executor.submit(load_item_metadata, options, settings, name)))
+			while len(pending) >= window:
+				name, future = pending.popleft()
+				yield (name,) + future.result()
+		while len(pending) > 0:
+			name, future = pending.popleft()
+			yield (name,) + future.result()
+	finally:
+		for name, future in pending:
+			future.cancel()
+		executor.shutdown(wait=True)
+
+def get_parser_concurrency(settings):
+	try:
+		return max(1, int(settings.get('parserConcurrency', 1)))
+	except (TypeError, ValueError):
+		logger.warning("Set %s has an invalid parserConcurrency %s"%(settings['name'], settings['parserConcurrency']))
+		return 1
 
 def load_item_metadata(options, settings, name):
+	""" Returns the item's merged metadata and its progress status
+	Parsers that don't depend on each other may run at the same time,
+	up to the set's parserConcurrency setting, but their results are
+	always merged in the order of the set's parsers. With the set's
+	stopWhenSatisfied setting, each parser waits for the ones before it,
+	and is skipped if they already found every key that the output needs
+	"""
 	logger.debug("Loading metadata for %s"%(name,))
 	path = os.path.join(settings['sourceDir'], name)
+	# loaded once, for its cached results and to keep its links when saving
+	entry = cache.get_cache(settings).load(name) or {}
+	cached_results = {}
 	if not ('ignore_cache' in options and options['ignore_cache']):
-		cached_metadata = load_cached_metadata(settings, name)
-	if 'name' in cached_metadata:	# valid cached data
-		if 'preferCachedData' in settings and \
-		   settings['preferCachedData']:
-			logger.debug("Preferring cached data for %s"%(name,))
-			return cached_metadata
+		cached_results = load_cached_metadata(settings, entry)
+	if len(cached_results) > 0:
+		logger.debug("Loaded cached data for %s from %s"%(name, ', '.join(sorted(cached_results.keys()))))
+	graph = parsergraph.ParserGraph(settings['parsers'])
+	required_keys = None
+	if 'stopWhenSatisfied' in settings and settings['stopWhenSatisfied']:
+		required_keys = get_required_keys(settings) or None
+	parser_results = {}
+	skipped_results = {}
+	statuses = []
+
+	def merge_results(parser_names):
+		metadata = {"name":name, "path":path}
+		for parser_name in parser_names:
+			if parser_name in parser_results:
+				deep_merge(metadata, copy.deepcopy(parser_results[parser_name]))
+		return metadata
+
+	def load(parser_name):
+		return load_parser_result(settings, parser_name, name,
+		                          merge_results(graph.inputs(parser_name)),
+		                          cached_results.get(parser_name))
+
+	def is_satisfied(parser_name):
+		""" Whether the parsers before this one found every required key """
+		earlier = merge_results(graph.order[:graph.order.index(parser_name)])
+		for key in required_keys:
+			if not has_value(earlier, key):
+				return False
+		logger.debug("Skipping %s for %s, which already has %s"%(parser_name, name, ', '.join(required_keys)))
+		# keep its previous results for later runs
+		if parser_name in cached_results:
+			skipped_results[parser_name] = cached_results[parser_name]
+		return True
+
+	def finish(parser_name, result):
+		item_metadata, status = result
+		if status is not None:
+			statuses.append(status)
+		if item_metadata is not None:
+			parser_results[parser_name] = item_metadata
+
+	concurrency = get_parser_concurrency(settings)
+	if concurrency == 1:
+		for parser_name in graph.order:
+			if required_keys is not None and is_satisfied(parser_name):
+				continue
+			finish(parser_name, load(parser_name)())
+	else:
+		finished = set()
+		running = {}
+		with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+			while len(finished) < len(graph.order):
+				started = set(running.values())
+				for parser_name in graph.ready(finished):
+					if parser_name in started:
+						continue
+					if required_keys is not None:
+						earlier = graph.order[:graph.order.index(parser_name)]
+						if not finished.issuperset(earlier):
+							continue
+						if is_satisfied(parser_name):
+							finished.add(parser_name)
+							continue
+					running[executor.submit(load(parser_name))] = parser_name
+				if len(running) == 0:
+					continue
+				done, not_done = concurrent.futures.wait(list(running.keys()),
+				                 return_when=concurrent.futures.FIRST_COMPLETED)
+				for future in done:
+					parser_name = running.pop(future)
+					finish(parser_name, future.result())
+					finished.add(parser_name)
+
+	new_metadata = merge_results(graph.order)
+	saved_results = dict(skipped_results)
+	saved_results.update(parser_results)
+	save_cached_metadata(settings, name, saved_results, entry)
+	return (new_metadata, progress.worst_status(statuses))
+
+def get_required_keys(settings):
+	""" Returns the metadata keys that the set's output groups by """
+	keys = []
+	for group in settings['output']:
+		if isinstance(group['groupBy'], str):
+			groupsBy = [group['groupBy']]
 		else:
-			logger.debug("Loaded cached data for %s"%(name,))
-	new_metadata = {"name":name, "path":path}
+			groupsBy = group['groupBy']
+		for groupBy in groupsBy:
+			if groupBy not in keys:
+				keys.append(groupBy)
+	return keys
+
+def has_value(metadata, key):
+	return key in metadata and metadata[key] not in [None, '', []]
+
+def load_parser_result(settings, parser_name, name, metadata, cached_result):
+	""" Returns a function that loads a single parser's result for an item,
+	as a (metadata, status) pair, falling back to its cached result
+	The status is None if the cached result was used without running it
+	"""
+	prefer_cache = 'preferCachedData' in settings and \
+	               settings['preferCachedData']
+	def load():
+		if prefer_cache and cached_result is not None:
+			logger.debug("Preferring cached %s data for %s"%(parser_name, name))
+			return (cached_result, None)
+		item_metadata, status = run_parser(settings, parser_name, name, metadata)
+		if item_metadata is None:
+			# fall back to this parser's previous results
+			return (cached_result, status)
+		if cached_result is not None:
+			merged = cached_result
+			merged.update(item_metadata)
+			item_metadata = merged
+		return (item_metadata, status)
+	return load
+
+def start_parsers(settings):
+	""" Lets each parser prepare for the set, such as loading its own caches
+	Parsers may have a start_set(cache_dir, parser_options) function,
+	and a finish_set(cache_dir) function that is called afterwards
+	"""
+	for parser_name in settings['parsers']:
+		parser = load_parser(parser_name)
+		if hasattr(parser, 'start_set'):
+			parser.start_set(settings['cacheDir'], get_parser_options(settings, parser_name))
+
+def finish_parsers(settings):
 	for parser_name in settings['parsers']:
 		parser = load_parser(parser_name)
-		if 'parser_options' in settings and \
-		   parser_name in settings['parser_options']:
-			parser_options = settings['parser_options'][parser_name]
+		if hasattr(parser, 'finish_set'):
+			try:
+				parser.finish_set(settings['cacheDir'])
+			except:
+				msg = "%s failed to finish %s: %s" % \
+				      (parser_name, settings['name'], traceback.format_exc())
+				logger.warning(msg)
+
+def get_parser_options(settings, parser_name):
+	if 'parser_options' in settings and \
+	   parser_name in settings['parser_options']:
+		return settings['parser_options'][parser_name]
+	return {}
+
+def run_parser(settings, parser_name, name, metadata):
+	""" Runs a single parser against an item's metadata so far
+	Returns a (metadata, status) pair, with metadata of None if the
+	parser was skipped, couldn't find the item or crashed
+	"""
+	parser = load_parser(parser_name)
+	parser_options = get_parser_options(settings, parser_name)
+	limiter = ratelimit.get_limiter(parser_name, parser_options)
+	if limiter.is_exhausted():
+		# skipped until tomorrow, and looked up again by the next run
+		return (None, progress.FAILED)
+	try:
+		if 'regex' in parser_options:
+			regex = re.compile(parser_options['regex'])
+			if not regex.search(metadata['path']):
+				return (None, progress.OK)
+		if workers.is_cpu_bound(parser) and workers.get_pool(settings):
+			item_metadata = workers.run_parser(settings, parser_name, dict(metadata))
 		else:
-			parser_options = {}
-		try:
-			if 'regex' in parser_options:
-				regex = re.compile(parser_options['regex'])
-				if not regex.search(new_metadata['path']):
-					continue
-			item_metadata = parser.get_metadata(dict(new_metadata), parser_options)
-			if item_metadata == None:
-				log_unknown_item(settings['cacheDir'], parser_name, name)
-				continue
-		except KeyboardInterrupt:
-			raise
-		except:
-			log_crashed_parser(settings['cacheDir'], parser_name, name)
-			continue
-		deep_merge(new_metadata, item_metadata)
-	
-	metadata = cached_metadata
-	metadata.update(new_metadata)
-	save_cached_metadata(settings, metadata)
-	return metadata
+			item_metadata = parser.get_metadata(dict(metadata), parser_options)
+		if item_metadata == None:
+			log_unknown_item(settings['cacheDir'], parser_name, name)
+			return (None, progress.UNKNOWN)
+		return (item_metadata, progress.OK)
+	except KeyboardInterrupt:
+		raise
+	except errors.QuotaExceeded as e:
+		if limiter.should_warn():
+			logger.warning("%s has used up its daily quota, skipping it for the rest of %s: %s" % \
+			               (parser_name, settings['name'], e))
+		return (None, progress.FAILED)
+	except:
+		log_crashed_parser(settings['cacheDir'], parser_name, name)
+		return (None, progress.FAILED)
 
 # Cache system
-def get_cache_key(name):
-	h = hashlib.new('md5')
-	h.update(name.encode('utf-8'))
+def prefetch_cached_metadata(settings, names, chunk_size=100):
+	""" Passes through the item names, loading their cached data in chunks """
+	metadata_cache = cache.get_cache(settings)
+	chunk = []
+	for name in names:
+		chunk.append(name)
+		if len(chunk) >= chunk_size:
+			metadata_cache.prefetch(chunk)
+			for name in chunk:
+				yield name
+			chunk = []
+	metadata_cache.prefetch(chunk)
+	for name in chunk:
+		yield name
+
+def get_parser_digest(parser_options):
+	""" Returns a stable fingerprint of a parser's options """
+	h = hashlib.new('sha1')
+	h.update(json.dumps(parser_options, sort_keys=True).encode('utf-8'))
 	return h.hexdigest()
 
-def get_cache_path(settings, name):
-	cache_key = get_cache_key(name)
-	cache_dir = settings['cacheDir']
-	cache_path = "%s/.cache-%s"%(cache_dir, cache_key)
-	return cache_path
-
-def load_cached_metadata(settings, name):
-	""" Loads up any previously cached dat
+def get_parser_digests(settings):
+	return dict([(parser_name, get_parser_digest(get_parser_options(settings, parser_name)))
+	             for parser_name in settings['parsers']])
+
+def load_cached_metadata(settings, data):
+	""" Returns the previously cached data of an item's cache entry,
+	keyed by parser name
+	A parser's data is only returned if it was loaded with the same
+	parser_options, so changing one parser's options won't discard the
+	cached data of the others
+	Entries cached before results were kept per parser are used as the
+	cached data of every parser, if the set's parser_options haven't changed
 	Returns {} if no data could be loaded
 	"""
-	cache_path = get_cache_path(settings, name)
-	if 'parser_options' in settings:
-		parser_options = json.dumps(settings['parser_options'])
-	else:
-		parser_options = None
-	try:
-		with open(cache_path) as reading:
-			data = reading.read()
-			parsed_data = json.loads(data)
-			# check that th cache's parser_options are the same
-			if 'parser_options' in parsed_data and \
-			   parsed_data['parser_options'] != parser_options:
-				return {}
-			if 'parser_options' in parsed_data:
-				del parsed_data['parser_options']
-			return parsed_data
-	except:
-		if os.path.isfile(cache_path):
-			msg = "Failed to open cache file for %s (%s): %s" % \
-			      (name, cache_path)
-			logger.warning(msg)
+	if not data:
+		return {}
+	if 'parsers' not in data:
+		return load_legacy_metadata(settings, data)
+	digests = settings['parser_digests']
+	results = {}
+	for parser_name, result in data['parsers'].items():
+		if parser_name in digests and \
+		   result.get('options') == digests[parser_name]:
+			results[parser_name] = result['metadata']
+	return results
+
+def load_legacy_metadata(settings, data):
+	""" Returns a flat cache entry, from before results were kept per parser,
+	as the cached result of each parser
+	"""
+	if data.get('parser_options') != settings.get('parser_options'):
+		return {}
+	metadata = dict([(key, value) for key, value in data.items()
+	                 if key not in ['name', 'path', 'parser_options']])
+	if len(metadata) == 0:
 		return {}
+	return dict([(parser_name, copy.deepcopy(metadata))
+	             for parser_name in settings['parsers']])
 
-def save_cached_metadata(settings, data):
-	cache_path = get_cache_path(settings, data['name'])
-	if 'parser_options' in settings:
-		data['parser_options'] = settings['parser_options']
-	try:
-		with open(cache_path, 'w') as writing:
-			writing.write(json.dumps(data))
-	except:
-		msg = "Failed to save cache file for %s (%s): %s" % \
-		      (data['name'], cache_path, traceback.format_exc())
-		logger.warning(msg)
+def save_cached_metadata(settings, name, parser_results, old_entry={}):
+	""" Saves each parser's results, keeping the recorded links of the
+	item's previous cache entry
+	"""
+	digests = settings['parser_digests']
+	parsers = {}
+	for parser_name, metadata in parser_results.items():
+		parsers[parser_name] = {'options': digests[parser_name], 'metadata': metadata}
+	entry = {'name': name, 'parsers': parsers}
+	for key in ['state', 'links']:
+		if key in old_entry:
+			entry[key] = old_entry[key]
+	cache.get_cache(settings).save(name, entry)
 
 # Actual organizing
-def do_output(options, settings, metadata):
+def do_output(options, settings, metadata, plan):
+	""" Adds the item to the plan for each of the set's output directories
+	Returns the [dest, value] pair of every group that it was added to
+	"""
+	links = []
 	for group in settings['output']:
 		destdir = group['dest']
 		if isinstance(group['groupBy'], str):
@@ -173,40 +614,33 @@ def do_output(options, settings, metadata):
 		for groupBy in groupsBy:
 			if not groupBy in metadata:
 				continue
-			do_output_group(settings['name'], destdir, metadata, groupBy)
+			for value in do_output_group(destdir, metadata, groupBy, plan):
+				if [destdir, value] not in links:
+					links.append([destdir, value])
+	return links
 
-def do_output_group(setname, destdir, metadata, groupBy):
+def do_output_group(destdir, metadata, groupBy, plan):
 	logger.debug("Sorting %s by %s"%(metadata['name'],groupBy))
 	value = metadata[groupBy]
 	if isinstance(value,str):
 		values = [value]
 	else:
 		values = value
+	added = []
 	for value in sorted(set(values)):
 		if value == None:
 			continue
 		value = value.replace('/','／')
-		do_output_single(destdir, setname, metadata['path'], metadata['name'], value)
+		do_output_single(destdir, metadata['path'], metadata['name'], value, plan)
+		added.append(value)
+	return added
 
-def do_output_single(destdir, setname, itempath, itemname, value):
+def do_output_single(destdir, itempath, itemname, value, plan):
 	""" Adds an item from the set into the collection named value
 	Adds FF8 from Albums into collection named Nobuo Uematsu
 	"""
 	logger.debug("Putting %s into %s"%(itemname,value))
-	valueDir = os.path.join(destdir, value)
-	if not os.path.isdir(valueDir):
-		os.mkdir(valueDir)
-	with open(os.path.join(destdir, '.toc-%s'%(setname,)), 'a') as toc:
-		toc.write("%s\n"%(value,))
-	destpath = os.path.join(valueDir, itemname)
-	link = os.path.relpath(itempath, valueDir)
-	if os.path.islink(destpath) and \
-	   os.readlink(destpath) != link:
-		os.unlink(destpath)
-	if not os.path.islink(destpath):
-		os.symlink(link, destpath)
-	with open(os.path.join(valueDir, '.toc-%s'%(setname,)), 'a') as toc:
-		toc.write("%s\n"%(itemname,))
+	plan.add(destdir, value, itemname, itempath)
 
 # Preparation
 def prepare_for_organization(settings):
@@ -214,11 +648,14 @@ def prepare_for_organization(settings):
 		parser = load_parser(parser_name)
 		if not parser:
 			raise errors.MissingParser("Set %s can't load parser %s"%(settings['name'], parser_name))
+	settings['parser_digests'] = get_parser_digests(settings)
 	if not os.path.isdir(settings['sourceDir']):
 		raise errors.MissingSourceDir("Set %s has an invalid sourceDir %s"%(settings['name'], settings['sourceDir']))
 	if 'cacheDir' not in settings:
 		settings['cacheDir'] = os.path.join(settings['sourceDir'], '.cache')
 	prepare_cache_dir(settings['cacheDir'])
+	if settings.get('cacheBackend', 'sqlite') not in cache.backends:
+		raise errors.SetError("Set %s has an unknown cacheBackend %s"%(settings['name'], settings['cacheBackend']))
 
 	if 'output' in settings:
 		for output_dir in settings['output']:
@@ -233,18 +670,31 @@ def prepare_cache_dir(cache_dir):
 			os.mkdir(d)
 
 def generate_omitted_dirs(settings):
-	dirs = []
-	dirs.append(os.path.join(settings['cacheDir']))
-	dirs.extend([o['dest'] for o in settings['output']])
+	dirs = set()
+	dirs.add(os.path.join(settings['cacheDir']))
+	dirs.update([o['dest'] for o in settings['output']])
 	return dirs
 
 # Progress tracking
-def load_progress(settings):
+def open_progress(settings):
 	progress_filename = os.path.join(settings['cacheDir'], 'progress')
-	if os.path.isfile(progress_filename):
-		progress_file = open(progress_filename,'r')
-		return [x.strip() for x in progress_file.readlines() if x.strip()!='']
-	return []
+	try:
+		batch_size = int(settings.get('progressBatchSize', 50))
+		interval = float(settings.get('progressInterval', 5))
+	except (TypeError, ValueError):
+		logger.warning("Set %s has invalid progress settings, using the defaults"%(settings['name'],))
+		batch_size, interval = 50, 5
+	durability = settings.get('progressDurability', 'batch')
+	return progress.ProgressJournal(progress_filename, batch_size, interval, durability)
+
+def get_retry_statuses(options):
+	""" Which statuses of a resumed run should be looked up again """
+	retry = set()
+	if 'retry_failed' in options and options['retry_failed']:
+		retry.add(progress.FAILED)
+	if 'retry_unknown' in options and options['retry_unknown']:
+		retry.add(progress.UNKNOWN)
+	return retry
 
 def start_progress(settings):
 	failed = os.path.join(settings['cacheDir'], 'failed.log')
@@ -254,150 +704,69 @@ def start_progress(settings):
 	if os.path.isfile(unknown):
 		os.unlink(unknown)
 
-def add_progress(settings, name):
-	progress_filename = os.path.join(settings['cacheDir'], 'progress')
-	with open(progress_filename,'a') as progress_file:
-		progress_file.write("%s\n"%(name,))
-
-def finish_progress(settings):
-	if not ('noclean' in settings and settings['noclean']):
-		cleanup_extra_output(settings)
-	progress_filename = os.path.join(settings['cacheDir'], 'progress')
-	if os.path.isfile(progress_filename):
-		os.unlink(progress_filename)
-
-# Finishing up and cleaning
-def cleanup_extra_output(settings):
-	logger.info("Cleaning up old files")
-	for output in settings['output']:
-		cleanup_extra_toc(settings, output['dest'], recurse_levels=1)
-
-def safe_delete_dir(path):
-	# Extra files that we are allowed to delete
-	allowed_deletions_patterns = ['.toc', '.toc-*', '.toc.*']
-	allowed_deletions = []
-	for pattern in allowed_deletions_patterns:
-		found_deletions = glob.glob(os.path.join(path, pattern))
-		trimmed_deletions = [x[len(path)+1:] for x in found_deletions]
-		allowed_deletions.extend(trimmed_deletions)
-	if '.toc.extra' in allowed_deletions:
-		allowed_deletions.remove('.toc.extra')
-
-	# load up the list of extra things that we should not delete
-	nameextra = os.path.join(path,'.toc.extra')
-	extra_contents = []
-	try:
-		with open(nameextra) as extra:
-			extra_contents = [x.strip() for x in extra.readlines()
-			                  if x.strip()!='']
-	except:
-		pass
-
-	# start unlinking things
-	for name in os.listdir(path):
-		if name in extra_contents:
-			continue
-		spath = os.path.join(path, name)
-		try:
-			if not os.path.islink(spath) and \
-			   os.path.isdir(spath):
-				safe_delete_dir(spath)
-			if not os.path.islink(spath) and \
-			   os.path.isfile(spath):
-				if name in allowed_deletions:
-					os.unlink(spath)
-			if os.path.islink(spath):
-				os.unlink(spath)
-		except:
-			raise
-			msg = "An error happened while safely cleaning %s: %s" % \
-			      (spath, traceback.format_exc())
-			logger.warning(msg)
-
-	if len(os.listdir(path)) == 0:
-		os.rmdir(path)
-
-def cleanup_extra_toc(settings, path, recurse_levels = 1):
-	nametoc = os.path.join(path,'.toc-%s'%(settings['name'],))
-	namedone = os.path.join(path,'.toc.done-%s'%(settings['name'],))
-	nameold = os.path.join(path,'.toc.old-%s'%(settings['name'],))
-	nameextra = os.path.join(path,'.toc.extra')
-	if not os.path.isfile(nametoc):
+def finish_progress(options, settings, plan, journal):
+	""" Reconciles the output directories with the plan, unless it is
+	None because only the changed items were updated
+	"""
+	if plan is None:
+		logger.info("Updated the changed items of %s, skipping the full cleanup"%(settings['name'],))
+		journal.remove()
 		return
-
-	# move around the old toc
-	if os.path.isfile(nameold):
-		os.unlink(nameold)
-	if os.path.isfile(namedone):
-		os.rename(namedone, nameold)
-
-	# any other elements that are manually excepted
-	extra_contents = []
+	clean = not ('noclean' in settings and settings['noclean'])
+	fake_clean = 'fakeclean' in settings and settings['fakeclean']
+	dry_run = 'dry_run' in options and options['dry_run']
+	logger.info("Linking %s items"%(len(plan),))
+	reconciler = linkplan.Reconciler(settings, clean=clean, dry_run=dry_run, fake_clean=fake_clean)
+	reconciler.reconcile(plan)
+	if clean and not fake_clean and not dry_run:
+		save_last_cleanup(settings)
+	journal.remove()
+
+# Partial cleanup
+def use_partial_cleanup(options, settings):
+	""" Whether a run can skip the full cleanup of the output directories
+	The set's fullCleanupInterval is how many seconds the full cleanup
+	can be skipped for, after which it checks every link again
+	"""
 	try:
-		with open(nameextra, 'r') as extra:
-			extra_contents = [x.strip() for x in extra.readlines()
-			                  if x.strip()!='']
-	except:
-		pass
-
-	# any other directories we need, and should not delete
-	extra_paths = []
-	extra_paths.append(settings['sourceDir'])
-	extra_paths.append(settings['cacheDir'])
-	extra_paths.extend([o['dest'] for o in settings['output']])
-
-	# load the list of proper files in this dir
-	proper_contents = []
-	for alttoc in glob.glob(os.path.join(path, '.toc.done*')):
-		with open(alttoc, 'r') as toc:
-			proper_contents.extend([x.strip() for x in toc.readlines() if x.strip()!=''])
-	with open(nametoc, 'r') as toc:
-		proper_contents.extend([x.strip() for x in toc.readlines() if x.strip()!=''])
-
-	# start deleting stuff
-	for name in os.listdir(path):
-		if name[:4] == '.toc':
-			continue
-		subpath = os.path.join(path,name)
-		if subpath not in extra_paths and \
-		   name not in proper_contents and \
-		   name not in extra_contents:
-			if not ('fakeclean' in settings and
-				settings['fakeclean']):
-				if not os.path.islink(subpath) and \
-				   os.path.isdir(subpath):
-					logger.debug("Removing extra dir %s"%(subpath,))
-					safe_delete_dir(subpath)
-				elif os.path.islink(subpath):
-					logger.debug("Removing extra link %s"%(subpath,))
-					os.unlink(subpath)
-				else:
-					logger.debug("Not removing extra file %s"%(subpath,))
-			else:
-				if not os.path.islink(subpath) and \
-				   os.path.isdir(subpath):
-					logger.debug("Would remove extra dir %s"%(subpath,))
-				elif os.path.islink(subpath):
-					logger.debug("Would remove extra file %s"%(subpath,))
-				else:
-					logger.debug("Would not remove extra file %s"%(subpath,))
-		else:
-			if os.path.isdir(subpath) and recurse_levels > 0:
-				cleanup_extra_toc(settings, subpath, recurse_levels - 1)
-			else:
-				pass
+		interval = float(settings.get('fullCleanupInterval', 0))
+	except (TypeError, ValueError):
+		logger.warning("Set %s has an invalid fullCleanupInterval %s"%(settings['name'], settings['fullCleanupInterval']))
+		return False
+	if interval <= 0:
+		return False
+	if ('full_cleanup' in options and options['full_cleanup']) or \
+	   ('dry_run' in options and options['dry_run']) or \
+	   ('noclean' in settings and settings['noclean']) or \
+	   ('fakeclean' in settings and settings['fakeclean']):
+		return False
+	last_cleanup = load_last_cleanup(settings)
+	return last_cleanup is not None and time.time() - last_cleanup < interval
+
+def load_last_cleanup(settings):
+	try:
+		with open(os.path.join(settings['cacheDir'], 'last-cleanup')) as input:
+			return float(input.read().strip())
+	except (OSError, ValueError):
+		return None
 
-	# declare this toc done
-	os.rename(nametoc, namedone)
+def save_last_cleanup(settings):
+	with open(os.path.join(settings['cacheDir'], 'last-cleanup'), 'w') as output:
+		output.write("%s\n"%(time.time(),))
 
 # Logging
+# metadata may be loaded from several threads at once
+_log_lock = threading.Lock()
+
 def log_unknown_item(cache_dir, parser_name, item_name):
 	logger.warning("%s couldn't locate %s"%(parser_name, item_name))
-	with open(os.path.join(cache_dir, "unknown.log"), 'a') as log:
-		log.write("%s couldn't locate %s\n"%(parser_name, item_name))
+	with _log_lock:
+		with open(os.path.join(cache_dir, "unknown.log"), 'a') as log:
+			log.write("%s couldn't locate %s\n"%(parser_name, item_name))
 
 def log_crashed_parser(cache_dir, parser_name, item_name):
 	message = "%s crashed while parsing %s:\n%s"%(parser_name, item_name, traceback.format_exc())
 	logger.error(message)
-	with open(os.path.join(cache_dir, "failed.log"), 'a') as log:
-		log.write(message+"\n")
+	with _log_lock:
+		with open(os.path.join(cache_dir, "failed.log"), 'a') as log:
+			log.write(message+"\n")
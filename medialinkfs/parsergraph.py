@@ -0,0 +1,63 @@
+""" Works out which parsers of a set depend on each other
+A parser module may declare the metadata keys that it reads, besides
+name and path, with a consumes list, and the keys that it returns with a
+produces list. A parser only depends on the parsers before it in the
+set's list that produce something it consumes, so the others can run
+at the same time. A parser that doesn't declare consumes depends on
+every parser before it, and one that doesn't declare produces may feed
+any parser after it that consumes anything, as they always have.
+"""
+
+import logging
+
+from .parsers import load_parser
+
+logger = logging.getLogger(__name__)
+
+class ParserGraph(object):
+	def __init__(self, parser_names, load=load_parser):
+		self.order = []
+		for name in parser_names:
+			if name not in self.order:
+				self.order.append(name)
+		# parser name -> the earlier parsers that it directly depends on
+		self.dependencies = {}
+		# parser name -> every earlier parser that its input comes from
+		self.ancestors = {}
+		declarations = [(name, load(name)) for name in self.order]
+		for index, (name, parser) in enumerate(declarations):
+			earlier = declarations[:index]
+			consumes = getattr(parser, 'consumes', None)
+			if consumes is None:
+				dependencies = [other for other, other_parser in earlier]
+			else:
+				dependencies = [other for other, other_parser in earlier
+				                if feeds(other_parser, consumes)]
+			self.dependencies[name] = set(dependencies)
+			ancestors = set(dependencies)
+			for dependency in dependencies:
+				ancestors.update(self.ancestors[dependency])
+			self.ancestors[name] = ancestors
+
+	def inputs(self, parser_name):
+		""" Returns the parsers whose results make up this parser's input,
+		in the set's order
+		"""
+		ancestors = self.ancestors[parser_name]
+		return [name for name in self.order if name in ancestors]
+
+	def ready(self, finished):
+		""" Returns the parsers that haven't finished but can start now,
+		given the names of the finished ones
+		"""
+		return [name for name in self.order
+		        if name not in finished and self.dependencies[name] <= finished]
+
+def feeds(parser, consumes):
+	""" Whether a parser may produce any of these keys """
+	if len(consumes) == 0:
+		return False
+	produces = getattr(parser, 'produces', None)
+	if produces is None:
+		return True
+	return len(set(produces) & set(consumes)) > 0
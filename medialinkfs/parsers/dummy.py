@@ -3,6 +3,9 @@ Fill in the data variable keyed on the basename
 """
 data = {}
 
+# only reads the path, see medialinkfs.parsergraph
+consumes = []
+
 import os.path
 
 def get_metadata(metadata, settings={}):
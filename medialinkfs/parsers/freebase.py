@@ -1,22 +1,33 @@
-API_BASE = 'https://www.googleapis.com/freebase/v1/mqlread'
+API_ROOT = 'https://www.googleapis.com'
+API_BASE = API_ROOT + '/freebase/v1/mqlread'
+BATCH_URL = API_ROOT + '/batch'
 
 import os.path
 import urllib
-import urllib.request
 import urllib.parse
 import json
 import logging
 import re
-import difflib
 import time
-import html.parser
-HTMLParser = html.parser.HTMLParser()
+import html
+import collections
+import concurrent.futures
+import email.parser
+import threading
+import uuid
+
+from medialinkfs.parsers import httpclient
+from medialinkfs.parsers import fuzzy
+from medialinkfs.parsers import httpcache
 
 logger = logging.getLogger(__name__)
 
+# the metadata keys that it reads and returns, see medialinkfs.parsergraph
+consumes = []
+
 splitter = re.compile('\s*,\s*')
 yearfinder = re.compile('\(([12][0-9]{3})(-[12][0-9]{3})?\)')
-notislettermatcher = re.compile('[^\w¢]', re.UNICODE)
+contentidmatcher = re.compile('<response-q([0-9]+)>')
 MATCH_THRESHOLD = 0.8
 
 # Rename an mql key to a shorter metadata key
@@ -129,29 +140,16 @@ def get_metadata(metadata, settings={}):
 		logger.debug("Found no metadata for %s"%name)
 	return result
 
-def squash(s):
-	# normalize some weird characters first
-	replacements = {'ː':':'}
-	for f,t in replacements.items():
-		s = s.replace(f,t)
-	return re.sub(notislettermatcher, ' ', s.lower())
+squash = fuzzy.squash
 
 def find_best_match(needle, results):
-	best = 0
-	bestresult = None
+	candidates = []
 	for result in results:
-		names = []
 		if 'name' in result:
-			names.append(result['name'])
+			candidates.append((result['name'], result))
 		if '/common/topic/alias' in result:
-			names.extend(result['/common/topic/alias'])
-		for name in names:
-			s = difflib.SequenceMatcher(None, squash(needle), squash(name))
-			score = s.ratio()
-			#logger.debug("Search result %s (%s) scored %s"%(name, result['mid'], score))
-			if score > best and score > MATCH_THRESHOLD:
-				best = score
-				bestresult = result
+			candidates.extend([(name, result) for name in result['/common/topic/alias']])
+	bestresult, score = fuzzy.find_best(needle, candidates, MATCH_THRESHOLD)
 	return bestresult
 
 def expand_search(search, info):
@@ -238,7 +236,7 @@ def unescape_html_dict(info):
 		if isinstance(value, list):
 			unescape_html_list(value)
 		if isinstance(value, str):
-			info[key] = HTMLParser.unescape(value)
+			info[key] = html.unescape(value)
 	return info
 def unescape_html_list(info):
 	index = 0
@@ -249,7 +247,7 @@ def unescape_html_list(info):
 		if isinstance(value, list):
 			unescape_html_list(value)
 		if isinstance(value, str):
-			info[index] = HTMLParser.unescape(value)
+			info[index] = html.unescape(value)
 		index += 1
 	return info
 
@@ -316,30 +314,186 @@ def search_title(name, year=None, settings={}):
 	return result
 
 def run_mql_queries(queries, settings={}):
+	""" Runs several queries, in a single batch request if possible """
 	results = []
-	for query in queries:
-		data = run_mql_query(query, settings)
-		results.extend(data)
+	for data in fetch_mql([get_mql_url(query, settings) for query in queries], settings):
+		results.extend(parse_mql_response(data))
 	return results
-	
+
 def run_mql_query(query, settings):
+	return run_mql_queries([query], settings)
+
+def get_mql_url(query, settings):
+	params = {'query': json.dumps(query)}
+	if "api_key" in settings:
+		params['key'] = settings['api_key']
+	return API_BASE + '?' + urllib.parse.urlencode(params)
+
+def parse_mql_response(data):
 	results = []
-	try:
-		headers = {'Content-Type': 'application/json'}
-		params = {'query': json.dumps(query)}
-		if "api_key" in settings:
-			params['key'] = settings['api_key']
-		url = API_BASE + '?' + urllib.parse.urlencode(params)
-		logger.debug("Searching from %s"%url)
-		resource = urllib.request.urlopen(url)
-		raw_data = resource.read()
-		text_data = raw_data.decode('utf-8')
-		data = json.loads(text_data)
-		if 'result' in data:
-			results = data['result']
-		unescape_html_list(results)
-	except:
-		raise
-		logger.warning("Error occurred while fetching search results")
+	if 'result' in data:
+		results = data['result']
+	unescape_html_list(results)
 	return results
 
+def fetch_mql(urls, settings={}):
+	""" Returns the decoded response of each mqlread url """
+	for url in urls:
+		logger.debug("Searching from %s"%url)
+	if 'batch' in settings and not settings['batch']:
+		return [httpclient.get_json('freebase', url, settings) for url in urls]
+	return _batcher.run(urls, settings)
+
+class MQLBatch(object):
+	def __init__(self):
+		# url -> futures waiting for its response
+		self.futures = collections.OrderedDict()
+		self.full = threading.Event()
+
+	def add(self, url):
+		future = concurrent.futures.Future()
+		self.futures.setdefault(url, []).append(future)
+		return future
+
+	def __len__(self):
+		return len(self.futures)
+
+	def set_result(self, url, data):
+		for future in self.futures[url]:
+			future.set_result(data)
+
+	def set_exception(self, url, exception):
+		for future in self.futures[url]:
+			future.set_exception(exception)
+
+	def abandon(self):
+		""" Cancels any futures that weren't resolved, so nobody waits forever """
+		for futures in self.futures.values():
+			for future in futures:
+				future.cancel()
+
+class MQLBatcher(object):
+	""" Combines the queries of every item being looked up at once
+	into batch requests, and hands each item its own responses
+	The first thread to ask for a query waits up to batch_delay seconds
+	for other threads to add theirs, then sends them all together
+	"""
+	def __init__(self):
+		self.open_batch = None
+		self.callers = 0
+		self.lock = threading.Lock()
+
+	def run(self, urls, settings={}):
+		batch_size = int(settings.get('batch_size', 20))
+		delay = float(settings.get('batch_delay', 0.05))
+		with self.lock:
+			self.callers += 1
+			batch = self.open_batch
+			leader = batch is None
+			if leader:
+				batch = self.open_batch = MQLBatch()
+			futures = [batch.add(url) for url in urls]
+			if len(batch) >= batch_size:
+				self.open_batch = None
+				batch.full.set()
+			others = self.callers > 1
+		try:
+			if leader:
+				# nobody else can add to the batch if we're alone
+				if others:
+					batch.full.wait(delay)
+				with self.lock:
+					if self.open_batch is batch:
+						self.open_batch = None
+				try:
+					send_batch(batch, settings)
+				finally:
+					batch.abandon()
+			return [future.result() for future in futures]
+		finally:
+			with self.lock:
+				self.callers -= 1
+
+def send_batch(batch, settings={}):
+	""" Fetches every url of the batch, and resolves its futures """
+	urls = []
+	response_cache = httpcache.get_active()
+	for url in batch.futures.keys():
+		response = response_cache.get_fresh(url) if response_cache else None
+		if response is not None:
+			batch.set_result(url, response.json())
+		else:
+			urls.append(url)
+	if len(urls) == 1:
+		try:
+			batch.set_result(urls[0], httpclient.get_json('freebase', urls[0], settings))
+		except Exception as e:
+			batch.set_exception(urls[0], e)
+		return
+	if len(urls) == 0:
+		return
+	logger.debug("Sending a batch of %s queries"%(len(urls),))
+	try:
+		boundary = 'batch_%s'%(uuid.uuid4().hex,)
+		body = encode_batch(urls, boundary)
+		# each query of the batch counts against the quota
+		response = httpclient.post('freebase', BATCH_URL, body,
+		                           'multipart/mixed; boundary=%s'%(boundary,), settings,
+		                           count=len(urls))
+		responses = decode_batch(response.headers.get('Content-Type'), response.body)
+	except Exception as e:
+		for url in urls:
+			batch.set_exception(url, e)
+		return
+	for index, url in enumerate(urls):
+		if index not in responses:
+			batch.set_exception(url, IOError("No batch response for %s"%(url,)))
+			continue
+		part = responses[index]
+		if part.status != 200:
+			batch.set_exception(url, httpclient.HTTPError(url, part.status, 'in batch'))
+			continue
+		if response_cache:
+			response_cache.store(url, part)
+		try:
+			batch.set_result(url, part.json())
+		except Exception as e:
+			batch.set_exception(url, e)
+
+def encode_batch(urls, boundary):
+	""" Wraps a GET request of each url into a multipart batch request """
+	parts = []
+	for index, url in enumerate(urls):
+		path = url[len(API_ROOT):]
+		parts.append("--%s\r\n"
+		             "Content-Type: application/http\r\n"
+		             "Content-ID: <q%s>\r\n\r\n"
+		             "GET %s\r\n\r\n"%(boundary, index, path))
+	parts.append("--%s--\r\n"%(boundary,))
+	return ''.join(parts).encode('utf-8')
+
+def decode_batch(content_type, body):
+	""" Returns a dict of the index of each query to its Response """
+	message = email.parser.BytesParser().parsebytes(
+	            ('Content-Type: %s\r\n\r\n'%(content_type,)).encode('utf-8') + body)
+	responses = {}
+	if not message.is_multipart():
+		return responses
+	for part in message.get_payload():
+		match = contentidmatcher.search(part.get('Content-ID', ''))
+		if not match:
+			continue
+		payload = part.get_payload(decode=True)
+		head, sep, part_body = payload.partition(b'\r\n\r\n')
+		if not sep:
+			head, sep, part_body = payload.partition(b'\n\n')
+		lines = head.decode('utf-8').splitlines()
+		status = int(lines[0].split()[1])
+		headers = {}
+		for line in lines[1:]:
+			key, sep, value = line.partition(':')
+			headers[key.strip()] = value.strip()
+		responses[int(match.group(1))] = httpclient.Response(None, status, headers, part_body)
+	return responses
+
+_batcher = MQLBatcher()
@@ -0,0 +1,77 @@
+""" Fuzzy matching of search results against an item's name
+Scores are the same difflib ratios that the parsers have always used,
+but the name is only normalized once, and candidates are first checked
+against cheap upper bounds of their ratio, so that the full comparison
+only runs on candidates that could still become the best match.
+"""
+
+import collections
+import difflib
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+notislettermatcher = re.compile('[^\w¢]', re.UNICODE)
+
+def squash(s):
+	# normalize some weird characters first
+	replacements = {'ː':':'}
+	for f,t in replacements.items():
+		s = s.replace(f,t)
+	return re.sub(notislettermatcher, ' ', s.lower())
+
+class Matcher(object):
+	""" Scores candidates against a single needle """
+	def __init__(self, needle, squash=squash):
+		self.squash = squash
+		self.needle = squash(needle)
+		self.needle_counts = collections.Counter(self.needle)
+		self.matcher = difflib.SequenceMatcher(None)
+		self.matcher.set_seq1(self.needle)
+
+	def score(self, candidate, minimum=None):
+		""" Returns the ratio of the needle and the candidate,
+		or None if it can't be higher than minimum
+		"""
+		candidate = self.squash(candidate)
+		if minimum is not None:
+			length = len(self.needle) + len(candidate)
+			if length == 0:
+				return 1.0 if minimum < 1.0 else None
+			# the same bounds as real_quick_ratio and quick_ratio
+			if 2.0 * min(len(self.needle), len(candidate)) / length <= minimum:
+				return None
+			matches = sum((self.needle_counts & collections.Counter(candidate)).values())
+			if 2.0 * matches / length <= minimum:
+				return None
+		self.matcher.set_seq2(candidate)
+		return self.matcher.ratio()
+
+def find_best(needle, candidates, threshold=0, squash=squash):
+	""" Returns the (result, score) of the candidate that best matches
+	the needle, with a score over the threshold, or (None, 0)
+	candidates is a list of (name, result) pairs, and the first of any
+	equally good names wins
+	"""
+	matcher = Matcher(needle, squash)
+	best = 0
+	bestresult = None
+	for name, result in candidates:
+		score = matcher.score(name, max(best, threshold))
+		if score is None:
+			continue
+		if score > best and score > threshold:
+			best = score
+			bestresult = result
+	return (bestresult, best)
+
+def best_score(needle, names, squash=squash):
+	""" Returns the highest score of any of the names """
+	matcher = Matcher(needle, squash)
+	best = 0
+	for name in names:
+		score = matcher.score(name, best)
+		if score is not None:
+			best = max(best, score)
+	return best
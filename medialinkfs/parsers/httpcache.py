@@ -0,0 +1,188 @@
+""" Cache of the HTTP responses that the network parsers have fetched
+Responses are kept in an http.sqlite file in the cacheDir of the set
+being organized, keyed by their url, and the most recently used ones
+are also kept in memory. These set settings configure it:
+  httpCache - whether to cache responses at all, defaults to true
+  httpCacheTTL - how many seconds a response is used without asking
+    the server again, defaults to 86400
+  httpCacheMemory - how many responses to keep in memory, defaults to 256
+Once a response is older than the TTL, it is revalidated with its ETag
+or Last-Modified header, so an unchanged response isn't downloaded again.
+"""
+
+import collections
+import json
+import logging
+import os.path
+import sqlite3
+import threading
+import time
+import traceback
+
+from medialinkfs.parsers import httpclient
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache(object):
+	filename = 'http.sqlite'
+
+	def __init__(self, cache_dir, ttl=86400, memory_size=256, clock=time.time):
+		self.path = os.path.join(cache_dir, self.filename)
+		self.ttl = ttl
+		self.memory_size = memory_size
+		self.clock = clock
+		# when revalidating, responses fetched before then are checked again
+		self.started = clock()
+		self.revalidate = False
+		self.memory = collections.OrderedDict()
+		# url -> event that is set when another thread has fetched it
+		self.inflight = {}
+		self.lock = threading.RLock()
+		self.db = sqlite3.connect(self.path, check_same_thread=False)
+		with self.db:
+			self.db.execute("CREATE TABLE IF NOT EXISTS responses "
+			                "(url TEXT PRIMARY KEY, headers TEXT, body BLOB, fetched REAL)")
+
+	def load(self, url):
+		with self.lock:
+			if url in self.memory:
+				self.memory.move_to_end(url)
+				return self.memory[url]
+			row = self.db.execute("SELECT headers, body, fetched FROM responses "
+			                      "WHERE url = ?", (url,)).fetchone()
+			if row is None:
+				return None
+			try:
+				entry = {'headers': json.loads(row[0]), 'body': bytes(row[1]), 'fetched': row[2]}
+			except:
+				msg = "Failed to load cached response for %s: %s" % \
+				      (url, traceback.format_exc())
+				logger.warning(msg)
+				return None
+			self.remember(url, entry)
+			return entry
+
+	def remember(self, url, entry):
+		with self.lock:
+			self.memory[url] = entry
+			self.memory.move_to_end(url)
+			while len(self.memory) > self.memory_size:
+				self.memory.popitem(last=False)
+
+	def save(self, url, entry):
+		with self.lock:
+			self.remember(url, entry)
+			try:
+				with self.db:
+					self.db.execute("INSERT OR REPLACE INTO responses "
+					                "(url, headers, body, fetched) VALUES (?, ?, ?, ?)",
+					                (url, json.dumps(entry['headers']), entry['body'], entry['fetched']))
+			except:
+				msg = "Failed to save cached response to %s: %s" % \
+				      (self.path, traceback.format_exc())
+				logger.warning(msg)
+
+	def is_fresh(self, entry, now):
+		if self.revalidate and entry['fetched'] < self.started:
+			return False
+		return now - entry['fetched'] < self.ttl
+
+	def get_fresh(self, url):
+		""" Returns the cached response for this url if it is still fresh, or None """
+		entry = self.load(url)
+		if entry is not None and self.is_fresh(entry, self.clock()):
+			return self.make_response(url, entry)
+		return None
+
+	def store(self, url, response):
+		""" Caches a successful response that was fetched some other way """
+		if response.status != 200:
+			return
+		saved_headers = {}
+		for key in ['ETag', 'Last-Modified', 'Content-Type']:
+			if response.headers.get(key):
+				saved_headers[key] = response.headers.get(key)
+		self.save(url, {'headers': saved_headers, 'body': response.body, 'fetched': self.clock()})
+
+	def get(self, url, fetch):
+		""" Returns the response for this url, from the cache if possible
+		fetch is called with any conditional request headers, and returns
+		the server's Response. Threads asking for the same url at once
+		wait for a single fetch
+		"""
+		while True:
+			with self.lock:
+				event = self.inflight.get(url)
+				if event is None:
+					self.inflight[url] = threading.Event()
+					break
+			event.wait()
+		try:
+			return self.get_uncontended(url, fetch)
+		finally:
+			with self.lock:
+				self.inflight.pop(url).set()
+
+	def get_uncontended(self, url, fetch):
+		now = self.clock()
+		entry = self.load(url)
+		if entry is not None and self.is_fresh(entry, now):
+			return self.make_response(url, entry)
+		headers = {}
+		if entry is not None:
+			if 'ETag' in entry['headers']:
+				headers['If-None-Match'] = entry['headers']['ETag']
+			if 'Last-Modified' in entry['headers']:
+				headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+		response = fetch(headers)
+		if response.status == 304 and entry is not None:
+			logger.debug("Cached response for %s is still valid"%(url,))
+			entry = dict(entry)
+			entry['fetched'] = now
+			self.save(url, entry)
+			return self.make_response(url, entry)
+		self.store(url, response)
+		return response
+
+	def make_response(self, url, entry):
+		return httpclient.Response(url, 200, entry['headers'], entry['body'])
+
+	def close(self):
+		with self.lock:
+			self.db.close()
+
+# open caches, keyed by cacheDir, and the one of the set being organized
+_caches = {}
+_active = None
+_caches_lock = threading.Lock()
+
+def use_cache(settings, revalidate=False):
+	""" Opens the response cache of this set, for the parsers to use
+	With revalidate, cached responses are checked with the server once
+	"""
+	global _active
+	with _caches_lock:
+		if 'httpCache' in settings and not settings['httpCache']:
+			_active = None
+			return None
+		cache_dir = settings['cacheDir']
+		if cache_dir not in _caches:
+			_caches[cache_dir] = ResponseCache(cache_dir,
+			                                   float(settings.get('httpCacheTTL', 86400)),
+			                                   int(settings.get('httpCacheMemory', 256)))
+		_active = _caches[cache_dir]
+		if revalidate:
+			_active.revalidate = True
+		return _active
+
+def get_active():
+	return _active
+
+def close_cache(settings):
+	global _active
+	with _caches_lock:
+		cache = _caches.pop(settings['cacheDir'], None)
+		if cache is _active:
+			_active = None
+	if cache:
+		cache.close()
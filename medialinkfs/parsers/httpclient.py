@@ -0,0 +1,201 @@
+""" HTTP client shared by the network parsers
+Connections are kept alive in a pool for each host, so that the many
+requests of a set don't each need a new TCP and TLS handshake.
+Responses are requested with gzip, and failed requests are retried.
+Each parser can configure its requests with these parser_options:
+  timeout - seconds to wait for the server, defaults to 30
+  retries - how many times to retry a failed request, defaults to 3
+  retry_backoff - seconds to wait before the first retry, doubling
+    with every retry after that, defaults to 1
+"""
+
+import gzip
+import http.client
+import json
+import logging
+import threading
+import time
+import urllib.parse
+
+from medialinkfs.parsers import ratelimit
+from medialinkfs.parsers import httpcache
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'medialinkfs'
+# statuses that are worth trying again later
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+REDIRECT_STATUSES = [301, 302, 303, 307, 308]
+MAX_REDIRECTS = 5
+
+class HTTPError(IOError):
+	def __init__(self, url, status, reason):
+		IOError.__init__(self, "HTTP %s %s from %s"%(status, reason, url))
+		self.url = url
+		self.status = status
+
+class Response(object):
+	def __init__(self, url, status, headers, body):
+		self.url = url
+		self.status = status
+		self.headers = headers
+		self.body = body
+
+	def text(self):
+		return self.body.decode('utf-8')
+
+	def json(self):
+		return json.loads(self.text())
+
+class ConnectionPool(object):
+	""" Idle keep-alive connections to a single host """
+	def __init__(self, scheme, host, max_idle=4):
+		self.scheme = scheme
+		self.host = host
+		self.max_idle = max_idle
+		self.idle = []
+		self.lock = threading.Lock()
+
+	def get(self, timeout):
+		""" Returns an idle connection, or a new one, and whether it was reused """
+		with self.lock:
+			if len(self.idle) > 0:
+				conn = self.idle.pop()
+				conn.timeout = timeout
+				return (conn, True)
+		if self.scheme == 'https':
+			return (http.client.HTTPSConnection(self.host, timeout=timeout), False)
+		return (http.client.HTTPConnection(self.host, timeout=timeout), False)
+
+	def put(self, conn):
+		with self.lock:
+			if len(self.idle) < self.max_idle:
+				self.idle.append(conn)
+				return
+		conn.close()
+
+	def close(self):
+		with self.lock:
+			idle = self.idle
+			self.idle = []
+		for conn in idle:
+			conn.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(scheme, host):
+	with _pools_lock:
+		key = (scheme, host)
+		if key not in _pools:
+			_pools[key] = ConnectionPool(scheme, host)
+		return _pools[key]
+
+def close_pools():
+	with _pools_lock:
+		pools = list(_pools.values())
+		_pools.clear()
+	for pool in pools:
+		pool.close()
+
+def send(pool, method, path, headers, body, timeout):
+	""" Makes a single request, reusing an idle connection if possible
+	A reused connection may have been closed by the server in the
+	meantime, so that failure is retried once on a new connection
+	"""
+	while True:
+		conn, reused = pool.get(timeout)
+		try:
+			if conn.sock is not None:
+				conn.sock.settimeout(timeout)
+			conn.request(method, path, body=body, headers=headers)
+			response = conn.getresponse()
+			response_body = response.read()
+		except (OSError, http.client.HTTPException):
+			conn.close()
+			if reused:
+				continue
+			raise
+		if response.will_close:
+			conn.close()
+		else:
+			pool.put(conn)
+		if response.getheader('Content-Encoding', '').lower() == 'gzip':
+			response_body = gzip.decompress(response_body)
+		return (response.status, response.reason, response.msg, response_body)
+
+def request(url, headers={}, timeout=30, retries=3, retry_backoff=1,
+            limiter=None, sleep=time.sleep, method='GET', body=None, count=1):
+	""" Fetches a url, following any redirects
+	Returns a Response, or raises HTTPError for unsuccessful statuses
+	Connection failures and temporary server errors are retried
+	count is how many requests it is to the limiter's daily quota
+	"""
+	all_headers = {'Accept-Encoding': 'gzip', 'User-Agent': USER_AGENT}
+	all_headers.update(headers)
+	redirects = 0
+	attempt = 0
+	while True:
+		parts = urllib.parse.urlsplit(url)
+		path = parts.path or '/'
+		if parts.query:
+			path += '?' + parts.query
+		pool = get_pool(parts.scheme, parts.netloc)
+		if limiter:
+			limiter.acquire(count)
+		try:
+			status, reason, response_headers, response_body = send(pool, method, path, all_headers, body, timeout)
+		except (OSError, http.client.HTTPException) as e:
+			if attempt >= retries:
+				raise
+			status, reason = None, str(e)
+		if status in REDIRECT_STATUSES and 'Location' in response_headers and \
+		   redirects < MAX_REDIRECTS:
+			redirects += 1
+			url = urllib.parse.urljoin(url, response_headers['Location'])
+			continue
+		if status is not None and status not in RETRY_STATUSES:
+			if status >= 400 or status in REDIRECT_STATUSES:
+				raise HTTPError(url, status, reason)
+			return Response(url, status, response_headers, response_body)
+		if attempt >= retries:
+			raise HTTPError(url, status, reason)
+		delay = retry_backoff * (2 ** attempt)
+		logger.debug("Retrying %s in %s seconds after %s"%(url, delay, reason))
+		attempt += 1
+		sleep(delay)
+
+def load_options(settings={}):
+	return {
+		'timeout': float(settings.get('timeout', 30)),
+		'retries': int(settings.get('retries', 3)),
+		'retry_backoff': float(settings.get('retry_backoff', 1))
+	}
+
+def get(parser_name, url, settings={}, headers={}):
+	""" Fetches a url for a parser, within its rate limits and options
+	Uses the response cache of the set being organized, if there is one
+	"""
+	limiter = ratelimit.get_limiter(parser_name, settings)
+	options = load_options(settings)
+	def fetch(extra_headers):
+		all_headers = dict(headers)
+		all_headers.update(extra_headers)
+		return request(url, all_headers, limiter=limiter, **options)
+	response_cache = httpcache.get_active()
+	if response_cache is None:
+		return fetch({})
+	return response_cache.get(url, fetch)
+
+def get_json(parser_name, url, settings={}):
+	return get(parser_name, url, settings).json()
+
+def post(parser_name, url, body, content_type, settings={}, count=1):
+	""" Sends a request body for a parser, which is never cached
+	count is how many requests the server counts it as, such as the
+	number of queries in a batch
+	"""
+	limiter = ratelimit.get_limiter(parser_name, settings)
+	headers = {'Content-Type': content_type}
+	return request(url, headers, limiter=limiter, method='POST', body=body, count=count,
+	               **load_options(settings))
@@ -1,15 +1,57 @@
+""" Reads the ID3v2 tags of a song, or of every song in an album directory
+Only files that start with an ID3v2 header are parsed, and only the
+tag itself is read from each file. The songs of an album are parsed by
+several threads at once, set with the workers parser_option (default 4).
+The tags of each file are kept in an id3.sqlite file in the cacheDir,
+and only read again once the file's size or mtime changes, unless the
+tag_cache parser_option is false.
+Parsing the tags is CPU-bound, so a set's processes setting runs it in
+separate worker processes.
+"""
+
 import os
 import os.path
-import difflib
-import re
+import io
 import logging
+import concurrent.futures
+import json
+import sqlite3
+import threading
+import traceback
 import stagger
 from numbers import Number
 
-from medialinkfs.deepmerge import deep_merge
-
 logger = logging.getLogger(__name__)
 
+# spends its time parsing, see medialinkfs.workers
+workload = 'cpu'
+
+# files that never hold an ID3 tag, which don't need to be opened
+skipped_extensions = set(['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.cue',
+                          '.log', '.txt', '.nfo', '.m3u', '.m3u8', '.pls',
+                          '.pdf', '.sfv', '.md5', '.accurip', '.db', '.ini'])
+
+keys = ['album', 'album_artist', 'artist', 'composer', 'genre',
+        'sort_album', 'sort_album_artist', 'sort_artist',
+        'sort_composer', 'sort_title', 'title',
+        'track_total', 'date'
+]
+multikeys = {
+   'album': 'albums',
+   'album_artist': 'artists',
+   'artist': 'artists',
+   'composer': 'composers',
+   'genre': 'genres',
+   'sort_album': 'albums',
+   'sort_album_artist': 'artists',
+   'sort_artist': 'artists',
+   'sort_composer': 'composers'
+}
+
+# the metadata keys that it reads and returns, see medialinkfs.parsergraph
+consumes = []
+produces = keys + sorted(set(multikeys.values()))
+
 def get_metadata(metadata, settings={}):
 	path = metadata['path']
 	name = os.path.basename(path)
@@ -17,7 +59,7 @@ def get_metadata(metadata, settings={}):
 
 	data = {}
 	if os.path.isdir(path):
-		data = load_dir(path)
+		data = load_dir(path, int(settings.get('workers', 4)))
 	if os.path.isfile(path):
 		data = load_id3(path)
 	if data == {}:
@@ -26,35 +68,121 @@ def get_metadata(metadata, settings={}):
 
 	return data
 
-def load_dir(path):
-	data = {}
-	for name in os.listdir(path):
-		subpath = os.path.join(path, name)
-		if os.path.isdir(subpath):
-			deep_merge(data, load_dir(subpath))
-		if os.path.isfile(subpath):
-			deep_merge(data, load_id3(subpath))
-	return data
+def find_songs(path):
+	""" Returns the files in this directory that may have tags,
+	in the same order that they are found walking through it
+	"""
+	songs = []
+	try:
+		iterator = os.scandir(path)
+	except OSError:
+		return songs
+	with iterator:
+		entries = list(iterator)
+	for entry in entries:
+		if entry.is_dir():
+			songs.extend(find_songs(entry.path))
+		elif entry.is_file():
+			if os.path.splitext(entry.name)[1].lower() not in skipped_extensions:
+				songs.append(entry.path)
+	return songs
+
+def load_dir(path, workers=4):
+	songs = find_songs(path)
+	tag_cache = _tag_cache
+	results = {}
+	stats = {}
+	if tag_cache:
+		for song in songs:
+			try:
+				stats[song] = os.stat(song)
+			except OSError:
+				pass
+		results = tag_cache.load_many(stats)
+	missing = [song for song in songs if song not in results]
+	if workers > 1 and len(missing) > 1:
+		with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+			parsed = list(executor.map(load_song, missing))
+	else:
+		parsed = [load_song(song) for song in missing]
+	for song, data in zip(missing, parsed):
+		results[song] = data
+		if tag_cache and song in stats and data is not None:
+			tag_cache.save(song, stats[song], data)
+	merged = TagAccumulator()
+	for song in songs:
+		merged.add(results[song] or {})
+	return merged.data
+
+def load_song(path):
+	""" Loads the tags of a song in an album, or None if they are broken """
+	try:
+		return read_id3(path)
+	except Exception as e:
+		logger.warning("Couldn't read the tags of %s: %s"%(path, e))
+		return None
+
+class TagAccumulator(object):
+	""" Merges the tags of many songs, like deep_merge but without
+	searching through each list for duplicates
+	"""
+	def __init__(self):
+		self.data = {}
+		self.seen = {}
+
+	def add(self, update):
+		for key, value in update.items():
+			if isinstance(value, list):
+				values = self.data.setdefault(key, [])
+				seen = self.seen.setdefault(key, set())
+				for item in value:
+					if item not in seen:
+						seen.add(item)
+						values.append(item)
+			else:
+				self.data[key] = value
+
+def syncsafe(data):
+	""" Decodes a syncsafe integer, which uses 7 bits of each byte """
+	value = 0
+	for byte in data:
+		value = (value << 7) | (byte & 0x7f)
+	return value
+
+def read_tag_region(path):
+	""" Returns the bytes of the ID3v2 tag at the start of the file,
+	or None if the file doesn't start with one
+	"""
+	with open(path, 'rb') as song:
+		header = song.read(10)
+		if len(header) < 10 or header[:3] != b'ID3':
+			return None
+		size = syncsafe(header[6:10])
+		# ID3v2.4 tags may have a footer after the frames
+		if header[3] == 4 and header[5] & 0x10:
+			size += 10
+		return header + song.read(size)
 
 def load_id3(path):
+	""" Returns the tags of a song, from the tag cache if it hasn't changed """
+	tag_cache = _tag_cache
+	if tag_cache is None:
+		return read_id3(path)
+	stat = os.stat(path)
+	data = tag_cache.load_many({path: stat}).get(path)
+	if data is None:
+		data = read_id3(path)
+		tag_cache.save(path, stat, data)
+	return data
+
+def read_id3(path):
+	region = read_tag_region(path)
+	if region is None:
+		return {}
+	return parse_tag(stagger.read_tag(io.BytesIO(region)))
+
+def parse_tag(tag):
 	data = {}
-	keys = ['album', 'album_artist', 'artist', 'composer', 'genre',
-	        'sort_album', 'sort_album_artist', 'sort_artist',
-	        'sort_composer', 'sort_title', 'title',
-	        'track_total', 'date'
-	]
-	multikeys = {
-	   'album': 'albums',
-	   'album_artist': 'artists',
-	   'artist': 'artists',
-	   'composer': 'composers',
-	   'genre': 'genres',
-	   'sort_album': 'albums',
-	   'sort_album_artist': 'artists',
-	   'sort_artist': 'artists',
-	   'sort_composer': 'composers'
-	}
-	tag = stagger.read_tag(path)
 	for key in keys:
 		if not hasattr(tag, key):
 			continue
@@ -70,3 +198,83 @@ def load_id3(path):
 				if obj not in data[mkey]:
 					data[mkey].append(obj)
 	return data
+
+class TagCache(object):
+	""" The tags of each file, keyed by its path, size and mtime """
+	filename = 'id3.sqlite'
+
+	def __init__(self, cache_dir, batch_size=100):
+		self.path = os.path.join(cache_dir, self.filename)
+		self.batch_size = batch_size
+		self.pending = {}
+		self.lock = threading.RLock()
+		self.db = sqlite3.connect(self.path, check_same_thread=False)
+		with self.db:
+			self.db.execute("CREATE TABLE IF NOT EXISTS tags "
+			                "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT)")
+
+	def load_many(self, stats):
+		""" Returns the cached tags of any of these files that haven't changed
+		stats is a dict of each file's path to its os.stat result
+		"""
+		ret = {}
+		paths = list(stats.keys())
+		with self.lock:
+			rows = []
+			for path in paths:
+				if path in self.pending:
+					rows.append((path,) + self.pending[path])
+			# sqlite limits the number of parameters in a query
+			for start in range(0, len(paths), 500):
+				chunk = [path for path in paths[start:start+500] if path not in self.pending]
+				if len(chunk) == 0:
+					continue
+				query = "SELECT path, size, mtime_ns, data FROM tags WHERE path IN (%s)" % \
+				        (','.join('?' * len(chunk)),)
+				rows.extend(self.db.execute(query, chunk).fetchall())
+		for path, size, mtime_ns, data in rows:
+			stat = stats[path]
+			if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+				ret[path] = json.loads(data)
+		return ret
+
+	def save(self, path, stat, data):
+		with self.lock:
+			self.pending[path] = (stat.st_size, stat.st_mtime_ns, json.dumps(data))
+			if len(self.pending) >= self.batch_size:
+				self.flush()
+
+	def flush(self):
+		with self.lock:
+			if len(self.pending) == 0:
+				return
+			rows = [(path,) + row for path, row in self.pending.items()]
+			try:
+				with self.db:
+					self.db.executemany("INSERT OR REPLACE INTO tags "
+					                    "(path, size, mtime_ns, data) VALUES (?, ?, ?, ?)", rows)
+			except:
+				msg = "Failed to save cached tags to %s: %s" % \
+				      (self.path, traceback.format_exc())
+				logger.warning(msg)
+			self.pending = {}
+
+	def close(self):
+		self.flush()
+		with self.lock:
+			self.db.close()
+
+_tag_cache = None
+
+def start_set(cache_dir, settings={}):
+	global _tag_cache
+	if 'tag_cache' in settings and not settings['tag_cache']:
+		return
+	_tag_cache = TagCache(cache_dir)
+
+def finish_set(cache_dir):
+	global _tag_cache
+	tag_cache = _tag_cache
+	_tag_cache = None
+	if tag_cache:
+		tag_cache.close()
@@ -2,23 +2,23 @@ API_BASE = 'http://mymovieapi.com/'
 
 import os.path
 import urllib
-import urllib.request
 import urllib.parse
-import json
 import logging
 import re
-import difflib
-import time
+
+from medialinkfs.parsers import httpclient
+from medialinkfs.parsers import fuzzy
 
 logger = logging.getLogger(__name__)
 
+# the metadata keys that it reads and returns, see medialinkfs.parsergraph
+consumes = []
+produces = ['genres', 'actors', 'year', 'rated']
+
 splitter = re.compile('\s*,\s*')
 yearfinder = re.compile('\(([12][0-9]{3})(-[12][0-9]{3})?\)')
-notislettermatcher = re.compile('[^\w¢]', re.UNICODE)
 MATCH_THRESHOLD = 0.8
 
-_last_time = 0	# enforce a sleep of 2 seconds between calls
-
 def get_metadata(metadata, settings={}):
 	path = metadata['path']
 	name = os.path.basename(path)
@@ -33,12 +33,7 @@ def get_metadata(metadata, settings={}):
 		logger.debug("Found no metadata for %s"%name)
 	return result
 
-def squash(s):
-	# normalize some weird characters first
-	replacements = {'ː':':'}
-	for f,t in replacements.items():
-		s = s.replace(f,t)
-	return re.sub(notislettermatcher, ' ', s.lower())
+squash = fuzzy.squash
 
 def api_type_str(type):
 	types = {
@@ -53,15 +48,9 @@ def api_type_str(type):
 	return 'none'
 
 def find_best_match(name, results):
-	best = 0
-	bestresult = None
-	for result in results:
-		s = difflib.SequenceMatcher(None, squash(name), squash(result['title']))
-		score = s.ratio()
-		logger.debug("Search result %s (%s) scored %s"%(result['title'], result['imdb_id'], score))
-		if score > best and score > MATCH_THRESHOLD:
-			best = score
-			bestresult = result
+	bestresult, score = fuzzy.find_best(name, [(x['title'], x) for x in results], MATCH_THRESHOLD)
+	if bestresult:
+		logger.debug("Search result %s (%s) scored %s"%(bestresult['title'], bestresult['imdb_id'], score))
 	return bestresult
 
 def search_title(name, year=None, settings={}):
@@ -73,16 +62,8 @@ def search_title(name, year=None, settings={}):
 
 	logger.debug("Searching from %s"%url)
 
-	# api rate limit
-	global _last_time
-	delay = _last_time + 2 - time.time()
-	if delay > 0: time.sleep(delay)
-	_last_time = time.time()
-
-	resource = urllib.request.urlopen(url)
-	raw_data = resource.read()
-	text_data = raw_data.decode('utf-8')
-	data = json.loads(text_data)
+	# rate limited to one call every 2 seconds by default
+	data = httpclient.get_json('mymovieapi', url, settings)
 	if isinstance(data, list):	# results
 		result = find_best_match(name, data)
 		if result:
@@ -0,0 +1,224 @@
+""" Looks up movies and shows in a local dump of titles, instead of a website
+The dataset parser_option is the path to either a tab separated file
+with a header row, like the IMDb title dumps, or a file of JSON objects,
+one per line. Either way, the fields may be named like omdbapi's
+(Title, Year, Genre, Actors, Director, Writer, Rated) or like IMDb's
+(primaryTitle, originalTitle, startYear, genres), in any case, and the
+people and genres may be lists or comma separated.
+The first time that it is used, and whenever the dataset changes, it is
+imported into an indexed sqlite database, which is kept next to the
+dataset unless the database parser_option says otherwise. Titles are
+looked up by their squashed name and year, the same way as omdbapi.
+"""
+
+import json
+import logging
+import os
+import os.path
+import re
+import sqlite3
+import threading
+import traceback
+
+from medialinkfs.parsers import fuzzy
+from medialinkfs.parsers import omdbapi
+
+logger = logging.getLogger(__name__)
+
+# the metadata keys that it reads and returns, see medialinkfs.parsergraph
+consumes = []
+produces = ['genres', 'writers', 'directors', 'actors', 'rated', 'year']
+
+# field name in the dataset -> metadata key
+fields = {
+	'title': 'title',
+	'primarytitle': 'title',
+	'originaltitle': 'original_title',
+	'year': 'year',
+	'startyear': 'year',
+	'genre': 'genres',
+	'genres': 'genres',
+	'actors': 'actors',
+	'director': 'directors',
+	'directors': 'directors',
+	'writer': 'writers',
+	'writers': 'writers',
+	'rated': 'rated'
+}
+listkeys = ['genres', 'actors', 'directors', 'writers']
+missingvalues = ['', '\\N', 'N/A']
+yearmatcher = re.compile('[12][0-9]{3}')
+
+def get_metadata(metadata, settings={}):
+	path = metadata['path']
+	name = os.path.basename(path)
+	yearfound = omdbapi.yearfinder.search(name)
+	year = None
+	if yearfound:
+		name = omdbapi.yearfinder.sub('',name).strip()
+		year = int(yearfound.group(1))
+	logger.debug("Loading metadata for %s"%name)
+	result = get_store(settings).lookup(name, year)
+	if result is None:
+		logger.debug("Found no metadata for %s"%name)
+		return None
+	return result
+
+def make_key(title):
+	return ' '.join(fuzzy.squash(title).split())
+
+def parse_record(record):
+	""" Returns the metadata of a record of the dataset,
+	and the titles that it should be found by
+	"""
+	data = {}
+	for field, value in record.items():
+		key = fields.get(str(field).lower())
+		if key is None or value is None:
+			continue
+		if isinstance(value, str):
+			value = value.strip()
+			if value in missingvalues:
+				continue
+		if key in listkeys:
+			if isinstance(value, str):
+				value = omdbapi.splitter.split(value)
+			value = [str(x) for x in value if x not in missingvalues]
+			if len(value) == 0:
+				continue
+		elif key == 'year':
+			yearfound = yearmatcher.search(str(value))
+			if not yearfound:
+				continue
+			value = int(yearfound.group(0))
+		data[key] = value
+	titles = []
+	for key in ['title', 'original_title']:
+		if key in data:
+			title = data.pop(key)
+			if title not in titles:
+				titles.append(title)
+	return (data, titles)
+
+def read_records(path):
+	""" Yields each record of a dataset file, as a dict """
+	with open(path, 'r', encoding='utf-8') as dataset:
+		if path.endswith('.jsonl') or path.endswith('.json'):
+			for line in dataset:
+				line = line.strip()
+				if len(line) > 0:
+					yield json.loads(line)
+		else:
+			header = dataset.readline().rstrip('\r\n').split('\t')
+			for line in dataset:
+				yield dict(zip(header, line.rstrip('\r\n').split('\t')))
+
+class TitleStore(object):
+	""" An indexed copy of a dataset, keyed by squashed title and year """
+	def __init__(self, path, batch_size=1000):
+		self.path = path
+		self.batch_size = batch_size
+		self.lock = threading.RLock()
+		self.db = sqlite3.connect(self.path, check_same_thread=False)
+		with self.db:
+			self.db.execute("CREATE TABLE IF NOT EXISTS titles "
+			                "(key TEXT, year INTEGER, title TEXT, data TEXT)")
+			self.db.execute("CREATE INDEX IF NOT EXISTS titles_key ON titles (key, year)")
+			self.db.execute("CREATE TABLE IF NOT EXISTS source "
+			                "(path TEXT, size INTEGER, mtime_ns INTEGER)")
+
+	def is_current(self, dataset):
+		stat = os.stat(dataset)
+		with self.lock:
+			row = self.db.execute("SELECT path, size, mtime_ns FROM source").fetchone()
+		return row == (os.path.abspath(dataset), stat.st_size, stat.st_mtime_ns)
+
+	def import_dataset(self, dataset):
+		""" Replaces the titles with the ones in the dataset file
+		Returns how many records were imported
+		"""
+		stat = os.stat(dataset)
+		logger.info("Importing titles from %s into %s"%(dataset, self.path))
+		count = 0
+		with self.lock:
+			with self.db:
+				self.db.execute("DELETE FROM titles")
+				self.db.execute("DELETE FROM source")
+				rows = []
+				for record in read_records(dataset):
+					data, titles = parse_record(record)
+					if len(titles) == 0:
+						continue
+					count += 1
+					encoded = json.dumps(data)
+					for title in titles:
+						rows.append((make_key(title), data.get('year'), title, encoded))
+					if len(rows) >= self.batch_size:
+						self.db.executemany("INSERT INTO titles (key, year, title, data) "
+						                    "VALUES (?, ?, ?, ?)", rows)
+						rows = []
+				self.db.executemany("INSERT INTO titles (key, year, title, data) "
+				                    "VALUES (?, ?, ?, ?)", rows)
+				self.db.execute("INSERT INTO source (path, size, mtime_ns) VALUES (?, ?, ?)",
+				                (os.path.abspath(dataset), stat.st_size, stat.st_mtime_ns))
+		logger.info("Imported %s titles from %s"%(count, dataset))
+		return count
+
+	def lookup(self, name, year=None):
+		""" Returns the metadata of the first title in the dataset
+		with this name, and this year if it is given, or None
+		"""
+		query = "SELECT title, data FROM titles WHERE key = ?"
+		params = [make_key(name)]
+		if year is not None:
+			query += " AND year = ?"
+			params.append(int(year))
+		query += " ORDER BY rowid LIMIT 1"
+		with self.lock:
+			row = self.db.execute(query, params).fetchone()
+		if row is None:
+			return None
+		logger.debug("Found %s"%(row[0],))
+		return json.loads(row[1])
+
+	def close(self):
+		with self.lock:
+			self.db.close()
+
+# open stores, keyed by the path of their database
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_database_path(settings):
+	if 'database' in settings and settings['database']:
+		return settings['database']
+	return settings['dataset'] + '.sqlite'
+
+def get_store(settings):
+	""" Opens the store of this dataset, importing it first if needed """
+	path = get_database_path(settings)
+	with _stores_lock:
+		if path not in _stores:
+			store = TitleStore(path)
+			try:
+				if not store.is_current(settings['dataset']):
+					store.import_dataset(settings['dataset'])
+			except:
+				store.close()
+				raise
+			_stores[path] = store
+		return _stores[path]
+
+def start_set(cache_dir, settings={}):
+	# import the dataset now, instead of during the first lookup
+	get_store(settings)
+
+def finish_set(cache_dir):
+	with _stores_lock:
+		stores = list(_stores.values())
+		_stores.clear()
+	for store in stores:
+		try:
+			store.close()
+		except:
+			logger.warning("Failed to close %s: %s"%(store.path, traceback.format_exc()))
@@ -2,18 +2,21 @@ API_BASE = 'http://omdbapi.com/'
 
 import os.path
 import urllib
-import urllib.request
 import urllib.parse
-import json
 import logging
 import re
-import difflib
+
+from medialinkfs.parsers import httpclient
+from medialinkfs.parsers import fuzzy
 
 logger = logging.getLogger(__name__)
 
+# the metadata keys that it reads and returns, see medialinkfs.parsergraph
+consumes = []
+produces = ['genres', 'writers', 'directors', 'actors', 'rated', 'year']
+
 splitter = re.compile('\s*,\s*')
 yearfinder = re.compile('\(([12][0-9]{3})(-[12][0-9]{3})?\)')
-notislettermatcher = re.compile('[^\w¢]', re.UNICODE)
 MATCH_THRESHOLD = 0.8
 def get_metadata(metadata, settings={}):
 	path = metadata['path']
@@ -24,69 +27,49 @@ def get_metadata(metadata, settings={}):
 		name = yearfinder.sub('',name).strip()
 		year = yearfound.group(1)
 	logger.debug("Loading metadata for %s"%name)
-	result = load_title(name, year)
+	result = load_title(name, year, settings)
 	if not result:
-		result = search_title(name, year)
+		result = search_title(name, year, settings)
 		if not result:
 			logger.debug("Found no metadata for %s"%name)
 	return result
 
-def load_by_id(tt):
+def load_by_id(tt, settings={}):
 	url = API_BASE+"?f=json&i="+urllib.parse.quote(tt)
-	resource = urllib.request.urlopen(url)
-	raw_data = resource.read()
-	text_data = raw_data.decode('utf-8')
-	data = json.loads(text_data)
+	data = httpclient.get_json('omdbapi', url, settings)
 	return data
 
-def load_title(name, year=None):
+def load_title(name, year=None, settings={}):
 	url = API_BASE+"?f=json&t="+urllib.parse.quote(name)
 	if year:
 		url += "&y="+year
 	logger.debug("Loading metadata from %s"%url)
-	resource = urllib.request.urlopen(url)
-	raw_data = resource.read()
-	text_data = raw_data.decode('utf-8')
-	data = json.loads(text_data)
+	data = httpclient.get_json('omdbapi', url, settings)
 	if 'Response' in data and data['Response']=='True':
 		return parse_response(data)
 	else:
 		result = None
 	return result
 
-def squash(s):
-	# normalize some weird characters first
-	replacements = {'ː':':'}
-	for f,t in replacements.items():
-		s = s.replace(f,t)
-	return re.sub(notislettermatcher, ' ', s.lower())
+squash = fuzzy.squash
 
 def find_best_match(name, results):
-	best = 0
-	bestresult = None
-	for result in results:
-		s = difflib.SequenceMatcher(None, squash(name), squash(result['Title']))
-		score = s.ratio()
-		logger.debug("Search result %s (%s) scored %s"%(result['Title'], result['imdbID'], score))
-		if score > best and score > MATCH_THRESHOLD:
-			best = score
-			bestresult = result
+	bestresult, score = fuzzy.find_best(name, [(x['Title'], x) for x in results], MATCH_THRESHOLD)
+	if bestresult:
+		logger.debug("Search result %s (%s) scored %s"%(bestresult['Title'], bestresult['imdbID'], score))
 	return bestresult
 
-def search_title(name, year=None):
+def search_title(name, year=None, settings={}):
 	url = API_BASE+"?f=json&s="+urllib.parse.quote(squash(name))
 	if year:
 		url += "&y="+year
 	logger.debug("Searching from %s"%url)
-	resource = urllib.request.urlopen(url)
-	raw_data = resource.read()
-	text_data = raw_data.decode('utf-8')
-	data = json.loads(text_data)
+	data = httpclient.get_json('omdbapi', url, settings)
 	if not "Response" in data or data['Response']!="False":
 		result = find_best_match(name, data['Search'])
 		if result:
 			id = result['imdbID']
-			return parse_response(load_by_id(id))
+			return parse_response(load_by_id(id, settings))
 	return None
 	
 def parse_response(data):
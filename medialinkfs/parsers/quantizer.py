@@ -2,6 +2,10 @@
 Creates a decade metadata based on year
 """
 
+# the metadata keys that it reads and returns, see medialinkfs.parsergraph
+consumes = ['release_date', 'year', 'Year']
+produces = ['year', 'decade', 'decades']
+
 def get_metadata(metadata, settings={}):
 	cur_metadata = dict(metadata)
 	new_metadata = {}
@@ -0,0 +1,187 @@
+""" Rate limiting shared by the network parsers
+Each parser gets one token bucket, shared by every thread that is
+loading metadata, which is configured by these parser_options:
+  rate_limit - requests per second, unlimited if unset
+  burst - how many requests may be made at once before slowing down
+  daily_quota - how many requests may be made per (UTC) day
+Each run is a new process, so the requests counted against the daily
+quotas are saved in a ratelimit.json file in the set's cacheDir, and
+counted on from there by the next run on the same day.
+"""
+
+import json
+import os
+import os.path
+import time
+import threading
+import logging
+
+from medialinkfs import errors
+
+logger = logging.getLogger(__name__)
+
+# Limits that each parser uses if its parser_options don't say otherwise
+default_limits = {
+	'mymovieapi': {'rate_limit': 0.5, 'burst': 1},
+	'freebase': {'daily_quota': 100000}
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# parser name -> (day, count) of its requests from a previous run
+_saved_usage = {}
+usage_filename = 'ratelimit.json'
+
+class TokenBucket(object):
+	def __init__(self, rate=None, burst=1, daily_quota=None,
+	             clock=time.time, sleep=time.sleep):
+		self.rate = rate
+		self.burst = max(1, burst)
+		self.daily_quota = daily_quota
+		self.clock = clock
+		self.sleep = sleep
+		self.tokens = self.burst
+		self.last_refill = clock()
+		self.day = None
+		self.day_count = 0
+		# the day that running out of the quota was last reported
+		self.warned_day = None
+		self.lock = threading.Lock()
+
+	def acquire(self, count=1):
+		""" Blocks until a request may be made
+		count is how many requests it counts as against the daily quota,
+		such as for a batch request of several queries
+		Raises QuotaExceeded if today's quota doesn't have room for it
+		"""
+		with self.lock:
+			now = self.clock()
+			if self.daily_quota is not None:
+				day = time.strftime('%Y-%m-%d', time.gmtime(now))
+				if day != self.day:
+					self.day = day
+					self.day_count = 0
+				if self.day_count + count > self.daily_quota:
+					raise errors.QuotaExceeded("Daily quota of %s requests is used up"%(self.daily_quota,))
+				self.day_count += count
+			if not self.rate:
+				return
+			self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+			self.last_refill = now
+			# reserve a token now, possibly borrowing from the future,
+			# so that concurrent callers are spaced out fairly
+			self.tokens -= 1
+			delay = 0
+			if self.tokens < 0:
+				delay = -self.tokens / self.rate
+		if delay > 0:
+			self.sleep(delay)
+
+	def is_exhausted(self):
+		""" Whether today's quota is used up """
+		with self.lock:
+			if self.daily_quota is None:
+				return False
+			day = time.strftime('%Y-%m-%d', time.gmtime(self.clock()))
+			return day == self.day and self.day_count >= self.daily_quota
+
+	def should_warn(self):
+		""" Returns True the first time each day that it's asked,
+		so that running out of the quota is only reported once
+		"""
+		with self.lock:
+			if self.warned_day == self.day:
+				return False
+			self.warned_day = self.day
+			return True
+
+	def restore(self, day, count):
+		""" Counts on from requests made on this day by another run """
+		with self.lock:
+			if day == self.day:
+				self.day_count = max(self.day_count, count)
+			elif self.day is None or day > self.day:
+				self.day = day
+				self.day_count = count
+
+	def usage(self):
+		""" Returns the (day, count) of the requests counted so far """
+		with self.lock:
+			return (self.day, self.day_count)
+
+def load_limits(parser_name, settings={}):
+	limits = {'rate_limit': None, 'burst': 1, 'daily_quota': None}
+	limits.update(default_limits.get(parser_name, {}))
+	for key in limits:
+		if key in settings:
+			limits[key] = settings[key]
+	return limits
+
+def get_limiter(parser_name, settings={}):
+	""" Returns the token bucket for this parser
+	The same bucket is returned until the parser's limits change
+	"""
+	limits = load_limits(parser_name, settings)
+	key = (limits['rate_limit'], limits['burst'], limits['daily_quota'])
+	with _limiters_lock:
+		if parser_name in _limiters and \
+		   _limiters[parser_name][0] == key:
+			return _limiters[parser_name][1]
+		logger.debug("Limiting %s to %s requests per second, burst of %s, daily quota of %s"%((parser_name,) + key))
+		rate = limits['rate_limit']
+		limiter = TokenBucket(float(rate) if rate else None,
+		                      int(limits['burst']),
+		                      int(limits['daily_quota']) if limits['daily_quota'] is not None else None)
+		if parser_name in _limiters:
+			limiter.restore(*_limiters[parser_name][1].usage())
+		if parser_name in _saved_usage:
+			limiter.restore(*_saved_usage[parser_name])
+		_limiters[parser_name] = (key, limiter)
+		return limiter
+
+def wait(parser_name, settings={}):
+	""" Waits until this parser may make another request """
+	get_limiter(parser_name, settings).acquire()
+
+def read_usage_file(path):
+	try:
+		with open(path) as reading:
+			data = json.loads(reading.read())
+	except FileNotFoundError:
+		return {}
+	except (IOError, ValueError) as e:
+		logger.warning("Couldn't read the request counts in %s: %s"%(path, e))
+		return {}
+	return dict([(parser_name, (usage[0], int(usage[1])))
+	             for parser_name, usage in data.items()])
+
+def load_usage(cache_dir):
+	""" Counts on from the requests that earlier runs of a set made today """
+	saved = read_usage_file(os.path.join(cache_dir, usage_filename))
+	with _limiters_lock:
+		_saved_usage.update(saved)
+		for parser_name, usage in saved.items():
+			if parser_name in _limiters:
+				_limiters[parser_name][1].restore(*usage)
+
+def save_usage(cache_dir):
+	""" Saves how many requests each parser with a daily quota has made today """
+	path = os.path.join(cache_dir, usage_filename)
+	with _limiters_lock:
+		limiters = [(parser_name, limiter) for parser_name, (key, limiter) in _limiters.items()
+		            if limiter.daily_quota is not None]
+	if len(limiters) == 0:
+		return
+	data = read_usage_file(path)
+	for parser_name, limiter in limiters:
+		day, count = limiter.usage()
+		if day is not None:
+			data[parser_name] = (day, count)
+	tmpname = path + '.tmp'
+	try:
+		with open(tmpname, 'w') as writing:
+			writing.write(json.dumps(data))
+		os.replace(tmpname, path)
+	except IOError as e:
+		logger.warning("Couldn't save the request counts to %s: %s"%(path, e))
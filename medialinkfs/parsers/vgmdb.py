@@ -1,29 +1,39 @@
 API_BASE = 'http://vgmdb.info/'
 MATCH_THRESHOLD = 0.7
 
+import os
 import os.path
 import urllib
-import urllib.request
 import urllib.parse
-import json
-import difflib
 import re
 import logging
+import json
+import threading
+import time
+import concurrent.futures
+
+from medialinkfs.parsers import httpclient
+from medialinkfs.parsers import fuzzy
 
 logger = logging.getLogger(__name__)
 
+# the metadata keys that it reads and returns, see medialinkfs.parsergraph
+consumes = []
+produces = ['arrangers', 'composers', 'lyricists', 'performers', 'games',
+            'artists', 'artist', 'franchise', 'franchises']
+
 islettermatcher = re.compile('[A-Za-z0-9]')
 notislettermatcher = re.compile('[^A-Za-z0-9]')
 def get_metadata(metadata, settings={}):
 	path = metadata['path']
 	name = os.path.basename(path)
 	logger.debug("Loading metadata for %s"%name)
-	result = search_for_album(name)
+	result = search_for_album(name, settings)
 	if not result:
 		logger.debug("Found no metadata for %s"%name)
 		return None	# couldn't find a match
-	album_data = load_json_data(result['link'])
-	franchises = load_album_franchises(album_data)
+	album_data = load_json_data(result['link'], settings)
+	franchises = load_album_franchises(album_data, settings)
 	data = {}
 	for type in ['arrangers', 'composers', 'lyricists', 'performers']:
 		if type in album_data:
@@ -34,18 +44,15 @@ def get_metadata(metadata, settings={}):
 		data['artists'] = [x['names']['en'] for x in album_data['composers']]
 		data['artist'] = data['artists'][0]
 	if len(franchises) > 0:
-		data['franchise'] = franchises[0]['name']
-		data['franchises'] = [x['name'] for x in franchises]
+		data['franchise'] = franchises[0]
+		data['franchises'] = franchises
 	return data
 
-def search_for_album(name):
+def search_for_album(name, settings={}):
 	name = squash(name)
 	url = API_BASE+"search/albums/"+urllib.parse.quote(name)+"?format=json"
 	logger.debug("Searching for album at %s"%(url,))
-	resource = urllib.request.urlopen(url)
-	raw_data = resource.read()
-	text_data = raw_data.decode('utf-8')
-	data = json.loads(text_data)
+	data = httpclient.get_json('vgmdb', url, settings)
 	results = data['results']['albums']
 	result = find_match(name, results)
 	return result
@@ -53,52 +60,153 @@ def search_for_album(name):
 def squash(s):
 	return re.sub(notislettermatcher, ' ', s.lower())
 
+def squash_stripped(s):
+	return squash(s).strip()
+
 def find_match(name, results):
-	best = 0
-	bestresult = None
-	for result in results:
-		score = score_best_match(name, result['titles'].values())
-		logger.debug("Search result %s scored %s"%(result['titles']['en'], score))
-		if score > best and score > MATCH_THRESHOLD:
-			best = score
-			bestresult = result
+	candidates = [(title, result) for result in results for title in result['titles'].values()]
+	bestresult, score = fuzzy.find_best(name, candidates, MATCH_THRESHOLD, squash_stripped)
+	if bestresult:
+		logger.debug("Search result %s scored %s"%(bestresult['titles']['en'], score))
 	return bestresult
 
 def score_best_match(name, matches):
-	best = 0
-	name = squash(name)
-	for match in matches:
-		match = squash(match)
-		s = difflib.SequenceMatcher(None, name.strip(), match.strip())
-		best = max(best, s.ratio())
-	return best
+	return fuzzy.best_score(name, matches, squash_stripped)
 
-def load_json_data(link):
+def load_json_data(link, settings={}):
 	if link[0] == '/':
 		link = link[1:]
 	url = API_BASE+link
-	resource = urllib.request.urlopen(url)
-	raw_data = resource.read()
-	text_data = raw_data.decode('utf-8')
-	data = json.loads(text_data)
+	data = httpclient.get_json('vgmdb', url, settings)
 	return data
 
-def load_album_franchises(album_data):
-	franchises_data = []
-	if 'products' in album_data:
-		for product in album_data['products']:
-			franchises_data.extend(load_product_franchises(product))
-	return franchises_data
-
-def load_product_franchises(product):
-	franchises_data = []
-	if 'link' not in product:
-		return franchises_data
-	product_data = load_json_data(product['link'])
-	if 'franchises' in product_data:
-		for franchise in product_data['franchises']:
-			franchises_data.append(load_json_data(franchise['link']))
-	if 'products' in product_data:
-		for product in product_data['products']:
-			franchises_data.extend(load_product_franchises(product))
-	return franchises_data
+def load_album_franchises(album_data, settings={}):
+	""" Returns the names of the franchises of the album's products """
+	links = [x['link'] for x in album_data.get('products', []) if 'link' in x]
+	return _resolver.resolve(links, settings)
+
+class FranchiseResolver(object):
+	""" Walks the graph of vgmdb products and franchises
+	Each product's links are remembered, for the whole run and between
+	runs if a path is given, so an album of a big series doesn't load
+	every product of the series again. The products at each step of the
+	walk are loaded at the same time, and each is only visited once,
+	even if products link back to each other
+	"""
+	def __init__(self, path=None, ttl=30*86400, workers=4, load=None, clock=time.time):
+		self.path = path
+		self.ttl = ttl
+		self.workers = workers
+		self.load = load or load_json_data
+		self.clock = clock
+		# product link -> {'franchises': [links], 'products': [links], 'fetched': time}
+		self.products = {}
+		# franchise link -> {'name': name, 'fetched': time}
+		self.franchises = {}
+		self.changed = False
+		self.lock = threading.Lock()
+		if path:
+			self.load_file()
+
+	def load_file(self):
+		try:
+			with open(self.path) as reading:
+				data = json.loads(reading.read())
+		except (IOError, ValueError):
+			return
+		now = self.clock()
+		for key in ['products', 'franchises']:
+			getattr(self, key).update([(link, node) for link, node in data.get(key, {}).items()
+			                           if now - node['fetched'] < self.ttl])
+
+	def save_file(self):
+		with self.lock:
+			if not self.path or not self.changed:
+				return
+			data = json.dumps({'products': self.products, 'franchises': self.franchises})
+			self.changed = False
+		tmpname = self.path + '.tmp'
+		with open(tmpname, 'w') as writing:
+			writing.write(data)
+		os.replace(tmpname, self.path)
+
+	def fetch_all(self, links, settings):
+		""" Returns the loaded data of each link, in the same order """
+		if len(links) < 2 or self.workers < 2:
+			return [self.load(link, settings) for link in links]
+		workers = min(self.workers, len(links))
+		with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+			return list(executor.map(lambda link: self.load(link, settings), links))
+
+	def explore(self, links, settings):
+		""" Loads every product reachable from these links that isn't known yet """
+		seen = set()
+		frontier = links
+		while len(frontier) > 0:
+			frontier = [link for link in unique(frontier) if link not in seen]
+			seen.update(frontier)
+			with self.lock:
+				missing = [link for link in frontier if link not in self.products]
+			now = self.clock()
+			for link, data in zip(missing, self.fetch_all(missing, settings)):
+				node = {'franchises': [x['link'] for x in data.get('franchises', []) if 'link' in x],
+				        'products': [x['link'] for x in data.get('products', []) if 'link' in x],
+				        'fetched': now}
+				with self.lock:
+					self.products[link] = node
+					self.changed = True
+			with self.lock:
+				nodes = [self.products[link] for link in frontier]
+				missing = unique([franchise for node in nodes for franchise in node['franchises']
+				                  if franchise not in self.franchises])
+			for link, data in zip(missing, self.fetch_all(missing, settings)):
+				with self.lock:
+					self.franchises[link] = {'name': data['name'], 'fetched': now}
+					self.changed = True
+			frontier = [product for node in nodes for product in node['products']]
+
+	def resolve(self, links, settings={}):
+		""" Returns the names of the franchises of these products,
+		and of any products that they link to, in the order found
+		"""
+		self.explore(links, settings)
+		names = []
+		visited = set()
+		stack = list(reversed(links))
+		with self.lock:
+			while len(stack) > 0:
+				link = stack.pop()
+				if link in visited:
+					continue
+				visited.add(link)
+				node = self.products[link]
+				for franchise in node['franchises']:
+					name = self.franchises[franchise]['name']
+					if name not in names:
+						names.append(name)
+				stack.extend(reversed(node['products']))
+		return names
+
+def unique(items):
+	""" Removes duplicates, keeping the order """
+	seen = set()
+	ret = []
+	for item in items:
+		if item not in seen:
+			seen.add(item)
+			ret.append(item)
+	return ret
+
+_resolver = FranchiseResolver()
+
+def start_set(cache_dir, settings={}):
+	""" Remembers the franchises of products in the set's cacheDir """
+	global _resolver
+	_resolver = FranchiseResolver(os.path.join(cache_dir, 'vgmdb-franchises.json'),
+	                              float(settings.get('franchise_cache_ttl', 30*86400)),
+	                              int(settings.get('franchise_workers', 4)))
+
+def finish_set(cache_dir):
+	global _resolver
+	_resolver.save_file()
+	_resolver = FranchiseResolver()
@@ -0,0 +1,96 @@
+""" Journal of the items that a set has processed so far
+Each line holds an item name and how it went, separated by a tab:
+  ok - the metadata was loaded
+  unknown - a parser couldn't find the item
+  failed - a parser crashed while loading the item
+Lines are buffered and committed in groups, according to the
+progressDurability setting of the set:
+  none - commit every progressBatchSize items or progressInterval seconds
+  batch - the same, but also fsync each commit, the default
+  item - commit and fsync every item
+"""
+
+import os
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+OK = 'ok'
+UNKNOWN = 'unknown'
+FAILED = 'failed'
+
+# how bad each status is, when combining the results of several parsers
+_severity = {OK: 0, UNKNOWN: 1, FAILED: 2}
+
+def worst_status(statuses):
+	worst = OK
+	for status in statuses:
+		if _severity[status] > _severity[worst]:
+			worst = status
+	return worst
+
+class ProgressJournal(object):
+	def __init__(self, filename, batch_size=50, interval=5, durability='batch',
+	             clock=time.time):
+		if durability not in ['none', 'batch', 'item']:
+			logger.warning("Unknown progressDurability %s, using batch"%(durability,))
+			durability = 'batch'
+		self.filename = filename
+		self.batch_size = max(1, batch_size)
+		self.interval = interval
+		self.durability = durability
+		self.clock = clock
+		self.pending = []
+		self.last_commit = clock()
+		self.lock = threading.RLock()
+
+	def load(self):
+		""" Returns a dict of every recorded item name to its status """
+		statuses = {}
+		try:
+			with open(self.filename, 'r') as journal:
+				for line in journal:
+					line = line.rstrip('\n')
+					if line.strip() == '':
+						continue
+					# the status never has a tab in it, but the name might
+					name, sep, status = line.rpartition('\t')
+					if status not in _severity:
+						# a line of an old progress file, with only the name
+						name, status = line, OK
+					statuses[name] = status
+		except IOError:
+			pass
+		return statuses
+
+	def record(self, name, status=OK):
+		with self.lock:
+			self.pending.append("%s\t%s\n"%(name, status))
+			if self.durability == 'item' or \
+			   len(self.pending) >= self.batch_size or \
+			   self.clock() - self.last_commit >= self.interval:
+				self.commit()
+
+	def commit(self):
+		""" Appends any buffered lines to the journal """
+		with self.lock:
+			self.last_commit = self.clock()
+			if len(self.pending) == 0:
+				return
+			with open(self.filename, 'a') as journal:
+				journal.write(''.join(self.pending))
+				if self.durability != 'none':
+					journal.flush()
+					os.fsync(journal.fileno())
+			self.pending = []
+
+	def close(self):
+		self.commit()
+
+	def remove(self):
+		with self.lock:
+			self.pending = []
+			if os.path.isfile(self.filename):
+				os.unlink(self.filename)
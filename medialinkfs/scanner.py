@@ -0,0 +1,210 @@
+""" Finds the items of a set in its sourceDir
+The sourceDir is read with os.scandir, whose entries already know
+whether they are files or directories on most filesystems, so the items
+don't need to be stat'ed one at a time. By default the items are sorted
+by name, which means holding all of their names at once. A set with a
+scanOrder setting of directory instead gets its items streamed in the
+order that the directory lists them. Each name is handed on as soon as
+it is read, without keeping any list of them.
+The recursive scanMode finds items in nested directories, such as
+Artist/Album, naming each one by its path under the sourceDir. Each
+level of the tree is read by several threads at once, and the cacheDir
+and output directories are never descended into.
+"""
+
+import os
+import os.path
+import logging
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+orders = ['sorted', 'directory']
+item_rules = ['media', 'depth', 'files']
+# files that make their directory an item, with the media itemRule
+media_extensions = ['.mp3', '.flac', '.ogg', '.oga', '.opus', '.m4a', '.aac',
+                    '.wma', '.wav', '.ape', '.mpc', '.wv',
+                    '.mkv', '.avi', '.mp4', '.m4v', '.wmv', '.mov', '.mpg',
+                    '.mpeg', '.ogm', '.webm', '.iso']
+
+def get_scan_order(settings):
+	order = settings.get('scanOrder', 'sorted')
+	if order not in orders:
+		logger.warning("Set %s has an unknown scanOrder %s"%(settings['name'], order))
+		return 'sorted'
+	return order
+
+def is_wanted(settings, path, regex=None, omitted_dirs=(), entry=None):
+	""" Whether this path in the sourceDir is an item of the set
+	With the os.DirEntry of the path, its type doesn't need a stat
+	"""
+	if path in omitted_dirs:
+		return False
+	if settings['scanMode'] == 'recursive':
+		return is_wanted_recursive(settings, path, regex, omitted_dirs)
+	if settings['scanMode'] == 'directories':
+		if not (entry.is_dir() if entry else os.path.isdir(path)):
+			return False
+	if settings['scanMode'] == 'files':
+		if not (entry.is_file() if entry else os.path.isfile(path)):
+			return False
+	if regex and not regex.search(path):
+		return False
+	return True
+
+def scan_items(settings, regex=None, omitted_dirs=()):
+	""" Yields the name of each item in the sourceDir """
+	names = stream_items(settings, regex, omitted_dirs)
+	if get_scan_order(settings) == 'sorted':
+		names = sorted(names)
+	for name in names:
+		yield name
+
+def stream_items(settings, regex=None, omitted_dirs=()):
+	""" Yields the name of each item in the order of the directory """
+	if settings['scanMode'] == 'recursive':
+		for name in walk_items(settings, regex, omitted_dirs):
+			yield name
+		return
+	with os.scandir(settings['sourceDir']) as entries:
+		for entry in entries:
+			if is_wanted(settings, entry.path, regex, omitted_dirs, entry):
+				yield entry.name
+
+# Recursive scanning
+def get_recursive_options(settings):
+	""" Returns the (depth, itemRule, extensions, workers) of a recursive set """
+	try:
+		depth = max(1, int(settings.get('scanDepth', 8)))
+		workers = max(1, int(settings.get('scanWorkers', 4)))
+	except (TypeError, ValueError):
+		logger.warning("Set %s has invalid recursive scan settings, using the defaults"%(settings['name'],))
+		depth, workers = 8, 4
+	rule = settings.get('itemRule', 'media')
+	if rule not in item_rules:
+		logger.warning("Set %s has an unknown itemRule %s"%(settings['name'], rule))
+		rule = 'media'
+	extensions = set([extension.lower() for extension in
+	                  settings.get('itemExtensions', media_extensions)])
+	return (depth, rule, extensions, workers)
+
+def has_extension(name, extensions):
+	return os.path.splitext(name)[1].lower() in extensions
+
+def list_dir(path, omitted_dirs):
+	""" Returns the (files, dirs) entries of a directory, skipping omitted dirs
+	Links to directories count as files, so that they aren't followed
+	"""
+	files = []
+	dirs = []
+	try:
+		iterator = os.scandir(path)
+	except OSError as e:
+		logger.warning("Couldn't scan %s: %s"%(path, e))
+		return (files, dirs)
+	with iterator:
+		for entry in iterator:
+			if entry.path in omitted_dirs:
+				continue
+			if entry.is_dir(follow_symlinks=False):
+				dirs.append(entry)
+			else:
+				files.append(entry)
+	return (files, dirs)
+
+def walk_items(settings, regex=None, omitted_dirs=(), top=None):
+	""" Yields the relative path of each item under the sourceDir,
+	or under the top path in it, one level of the tree at a time
+	With the media itemRule, a directory with a media file in it is an
+	item and isn't looked into any further, as is a media file directly
+	in the sourceDir. With depth, everything scanDepth levels down is an
+	item, and with files, every file is
+	"""
+	source_dir = settings['sourceDir']
+	depth, rule, extensions, workers = get_recursive_options(settings)
+	def found(path):
+		if not regex or regex.search(path):
+			return [os.path.relpath(path, source_dir)]
+		return []
+
+	# the directories to list next, and how deep each one is
+	frontier = [(source_dir, 0)]
+	if top is not None:
+		top_path = os.path.join(source_dir, top)
+		level = top.count('/') + 1
+		if top_path in omitted_dirs or level > depth:
+			return
+		if not os.path.isdir(top_path) or os.path.islink(top_path):
+			if is_wanted_recursive(settings, top_path, regex, omitted_dirs):
+				yield top
+			return
+		if rule == 'depth' and level == depth:
+			for name in found(top_path):
+				yield name
+			return
+		frontier = [(top_path, level)]
+
+	def list_level(directory):
+		path, level = directory
+		return (path, level) + list_dir(path, omitted_dirs)
+
+	executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+	try:
+		while len(frontier) > 0:
+			next_frontier = []
+			for path, level, files, dirs in executor.map(list_level, frontier):
+				if rule == 'media':
+					media = [entry for entry in files if has_extension(entry.name, extensions)]
+					if level > 0:
+						if len(media) > 0:
+							for name in found(path):
+								yield name
+							continue
+					else:
+						for entry in media:
+							for name in found(entry.path):
+								yield name
+				elif rule == 'files':
+					for entry in files:
+						for name in found(entry.path):
+							yield name
+				elif level + 1 == depth:
+					for entry in files + dirs:
+						for name in found(entry.path):
+							yield name
+					continue
+				# media directories may be as deep as scanDepth,
+				# other items have to be found while listing their parent
+				if level + 1 < depth or (rule == 'media' and level + 1 == depth):
+					next_frontier.extend([(entry.path, level + 1) for entry in dirs])
+			frontier = next_frontier
+	finally:
+		executor.shutdown(wait=True)
+
+def is_media_dir(path, extensions, omitted_dirs=()):
+	files, dirs = list_dir(path, omitted_dirs)
+	for entry in files:
+		if has_extension(entry.name, extensions):
+			return True
+	return False
+
+def is_wanted_recursive(settings, path, regex=None, omitted_dirs=()):
+	""" Whether this path, such as an item noticed by --watch, is an item """
+	depth, rule, extensions, workers = get_recursive_options(settings)
+	name = os.path.relpath(path, settings['sourceDir'])
+	level = name.count('/') + 1
+	if level > depth:
+		return False
+	if rule == 'depth' and level != depth:
+		return False
+	if rule == 'files' and not os.path.isfile(path):
+		return False
+	if rule == 'media':
+		if os.path.isdir(path) and not os.path.islink(path):
+			if not is_media_dir(path, extensions, omitted_dirs):
+				return False
+		elif not has_extension(path, extensions):
+			return False
+	if regex and not regex.search(path):
+		return False
+	return True
@@ -0,0 +1,87 @@
+""" The .toc files that record what each set has put in a directory
+Changes are buffered per directory and written out when flushed, each
+file in a single atomic rename, so an interrupted run never leaves a
+half-written .toc file behind.
+"""
+
+import os
+import os.path
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+def load_toc(filename):
+	try:
+		with open(filename, 'r') as toc:
+			return set([x.strip() for x in toc.readlines() if x.strip()!=''])
+	except IOError:
+		return set()
+
+def write_atomic(filename, contents):
+	""" Replaces the file with these contents in a single rename """
+	dirname, basename = os.path.split(filename)
+	tmpname = os.path.join(dirname, '.toc.tmp-%s'%(basename,))
+	with open(tmpname, 'w') as output:
+		output.write(contents)
+		output.flush()
+		os.fsync(output.fileno())
+	os.replace(tmpname, filename)
+
+class TocWriter(object):
+	""" Buffers the .toc.done-<set> contents of many directories """
+	def __init__(self, setname, dry_run=False):
+		self.setname = setname
+		self.dry_run = dry_run
+		# directory -> set of names, as on disk and as wanted
+		self.original = {}
+		self.contents = {}
+
+	def get_filename(self, path):
+		return os.path.join(path, '.toc.done-%s'%(self.setname,))
+
+	def load(self, path):
+		if path not in self.contents:
+			names = load_toc(self.get_filename(path))
+			self.original[path] = names
+			self.contents[path] = set(names)
+		return self.contents[path]
+
+	def set(self, path, names):
+		""" Replaces the names that this set has in the directory """
+		self.load(path)
+		self.contents[path] = set(names)
+
+	def add(self, path, name):
+		self.load(path).add(name)
+
+	def remove(self, path, name):
+		self.load(path).discard(name)
+
+	def forget(self, path):
+		""" Drops any buffered changes for a directory that was removed """
+		self.original.pop(path, None)
+		self.contents.pop(path, None)
+
+	def flush(self):
+		""" Writes out every directory whose names have changed """
+		for path, names in sorted(self.contents.items()):
+			if names == self.original[path]:
+				continue
+			if self.dry_run or not os.path.isdir(path):
+				continue
+			contents = ''.join(["%s\n"%(name,) for name in sorted(names)])
+			try:
+				write_atomic(self.get_filename(path), contents)
+			except:
+				msg = "Failed to write the toc for %s: %s" % \
+				      (path, traceback.format_exc())
+				logger.warning(msg)
+				continue
+			# leftovers from older versions
+			for old in ['.toc-%s', '.toc.old-%s']:
+				oldpath = os.path.join(path, old%(self.setname,))
+				if os.path.isfile(oldpath):
+					os.unlink(oldpath)
+		self.original = {}
+		self.contents = {}
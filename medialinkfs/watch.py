@@ -0,0 +1,257 @@
+""" Watches the sourceDir of each set with Linux inotify
+New, changed or renamed items are organized as they arrive, and the
+links of deleted items are removed. Events are collected for each item
+until it has been quiet for the set's watchDelay, so that copying in a
+whole album only looks up its metadata once.
+"""
+
+import os
+import os.path
+import ctypes
+import ctypes.util
+import errno
+import logging
+import re
+import select
+import struct
+import time
+
+from . import organize
+from . import cache
+from . import scanner
+from .parsers import httpcache
+from .parsers import ratelimit
+
+logger = logging.getLogger(__name__)
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | \
+             IN_CLOSE_WRITE | IN_ATTRIB | IN_DELETE_SELF
+_event_header = struct.Struct('iIII')
+
+_libc = None
+
+def load_libc():
+	global _libc
+	if _libc is None:
+		libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+		libc.inotify_init1.argtypes = [ctypes.c_int]
+		libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+		libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+		_libc = libc
+	return _libc
+
+def available():
+	""" Whether this system supports inotify """
+	try:
+		return hasattr(load_libc(), 'inotify_init1')
+	except OSError:
+		return False
+
+class Inotify(object):
+	def __init__(self):
+		self.libc = load_libc()
+		self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			self.raise_error("inotify_init1")
+
+	def raise_error(self, call):
+		code = ctypes.get_errno()
+		raise OSError(code, "%s: %s"%(call, os.strerror(code)))
+
+	def add_watch(self, path, mask=WATCH_MASK):
+		wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+		if wd < 0:
+			self.raise_error("inotify_add_watch")
+		return wd
+
+	def rm_watch(self, wd):
+		self.libc.inotify_rm_watch(self.fd, wd)
+
+	def read_events(self, timeout=None):
+		""" Returns a list of (wd, mask, cookie, name) events
+		Waits up to timeout seconds for any events to arrive
+		"""
+		readable, _, _ = select.select([self.fd], [], [], timeout)
+		if not readable:
+			return []
+		try:
+			data = os.read(self.fd, 65536)
+		except OSError as e:
+			if e.errno == errno.EAGAIN:
+				return []
+			raise
+		events = []
+		offset = 0
+		while offset + _event_header.size <= len(data):
+			wd, mask, cookie, length = _event_header.unpack_from(data, offset)
+			offset += _event_header.size
+			name = data[offset:offset+length].rstrip(b'\0')
+			offset += length
+			events.append((wd, mask, cookie, os.fsdecode(name)))
+		return events
+
+	def close(self):
+		os.close(self.fd)
+
+class EventBatcher(object):
+	""" Collects events about items until they have been quiet for delay seconds """
+	def __init__(self, delay):
+		self.delay = delay
+		self.last_event = {}
+
+	def touch(self, name, now):
+		self.last_event[name] = now
+
+	def pending(self):
+		return len(self.last_event)
+
+	def ready(self, now):
+		""" Returns and forgets the items that have been quiet long enough """
+		names = sorted([name for name, last in self.last_event.items()
+		                if now - last >= self.delay])
+		for name in names:
+			del self.last_event[name]
+		return names
+
+class SetWatcher(object):
+	""" Watches the sourceDir of a single set """
+	def __init__(self, options, settings, inotify):
+		self.options = options
+		self.settings = settings
+		self.inotify = inotify
+		self.batcher = EventBatcher(float(settings.get('watchDelay', 5)))
+		self.regex = None
+		if 'regex' in settings:
+			self.regex = re.compile(settings['regex'])
+		self.omitted_dirs = organize.generate_omitted_dirs(settings)
+		# watch descriptor to the (item, path) that it is watching,
+		# the sourceDir itself has an item of None
+		self.watches = {}
+		wd = inotify.add_watch(settings['sourceDir'], WATCH_MASK | IN_ONLYDIR)
+		self.watches[wd] = (None, settings['sourceDir'])
+
+	def handle_event(self, wd, mask, name, now):
+		if wd not in self.watches:
+			return
+		item, dirpath = self.watches[wd]
+		if mask & IN_IGNORED:
+			del self.watches[wd]
+			return
+		if item is None:
+			if mask & IN_DELETE_SELF:
+				logger.warning("The sourceDir %s of %s was removed"%(dirpath, self.settings['name']))
+			if name == '':
+				return
+			item = name
+		if os.path.join(self.settings['sourceDir'], item) in self.omitted_dirs:
+			return
+		if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+			# keep watching a new directory until it has settled down
+			try:
+				path = os.path.join(dirpath, name)
+				self.watches[self.inotify.add_watch(path, WATCH_MASK | IN_ONLYDIR)] = (item, path)
+			except OSError:
+				pass
+		self.batcher.touch(item, now)
+
+	def process_ready(self, now):
+		names = self.batcher.ready(now)
+		if len(names) == 0:
+			return
+		self.stop_watching(names)
+		httpcache.use_cache(self.settings)
+		changed = []
+		if self.settings['scanMode'] == 'recursive':
+			names = self.expand_items(names)
+		for name in names:
+			path = os.path.join(self.settings['sourceDir'], name)
+			if os.path.lexists(path):
+				if organize.is_wanted_item(self.settings, name, self.regex, self.omitted_dirs):
+					changed.append(name)
+			else:
+				logger.info("Removing %s from %s"%(name, self.settings['name']))
+				organize.remove_item(self.settings, name)
+		if len(changed) > 0:
+			organize.start_parsers(self.settings)
+			try:
+				for name in organize.update_items(self.options, self.settings, changed):
+					logger.info("Organized %s into %s"%(name, self.settings['name']))
+			finally:
+				organize.finish_parsers(self.settings)
+				ratelimit.save_usage(self.settings['cacheDir'])
+		cache.get_cache(self.settings).flush()
+
+	def expand_items(self, names):
+		""" Returns the items of a recursive set under these top level names,
+		along with any items that were under them before
+		"""
+		items = []
+		for name in names:
+			items.extend(scanner.walk_items(self.settings, self.regex, self.omitted_dirs, top=name))
+		prefixes = tuple([name + '/' for name in names])
+		for name in cache.get_cache(self.settings).names():
+			if (name in names or name.startswith(prefixes)) and name not in items:
+				items.append(name)
+		return items
+
+	def stop_watching(self, names):
+		for wd, (item, path) in list(self.watches.items()):
+			if item in names:
+				self.inotify.rm_watch(wd)
+				del self.watches[wd]
+
+	def close(self):
+		cache.close_cache(self.settings)
+		httpcache.close_cache(self.settings)
+
+def prepare_watch_settings(settings):
+	settings = dict(settings)
+	# the links of each item need to be remembered to remove them later
+	settings['incremental'] = True
+	return settings
+
+def watch(options):
+	""" Organizes each set, then keeps organizing items as they change """
+	inotify = Inotify()
+	watchers = []
+	try:
+		for settings in organize.load_sets(options):
+			settings = prepare_watch_settings(settings)
+			# catch up on anything that changed while not watching
+			organize.organize_set(options, settings)
+			watchers.append(SetWatcher(options, settings, inotify))
+			logger.info("Watching %s for changes"%(settings['sourceDir'],))
+		while True:
+			events = inotify.read_events(timeout=0.5)
+			now = time.time()
+			for wd, mask, cookie, name in events:
+				if mask & IN_Q_OVERFLOW:
+					logger.warning("Missed some changes, organizing everything again")
+					for watcher in watchers:
+						watcher.close()
+						organize.organize_set(options, watcher.settings)
+					continue
+				for watcher in watchers:
+					watcher.handle_event(wd, mask, name, now)
+			for watcher in watchers:
+				watcher.process_ready(now)
+	finally:
+		for watcher in watchers:
+			watcher.close()
+		inotify.close()
@@ -0,0 +1,102 @@
+""" Runs CPU-bound parsers in a pool of worker processes
+Threads can't run python code at the same time, so parsers that spend
+their time parsing rather than waiting on the network or the disk, such
+as id3, don't get any faster with the concurrency setting. A parser
+declares this with a module-level workload = 'cpu', and the processes
+setting of a set starts that many worker processes for these parsers.
+Each worker loads the set's settings and parsers once, when it starts.
+"""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import multiprocessing.util
+import threading
+import traceback
+
+from .parsers import load_parser
+
+logger = logging.getLogger(__name__)
+
+# set name -> its process pool
+_pools = {}
+_pools_lock = threading.Lock()
+
+# the settings of the set that a worker process is working for
+_worker_settings = None
+
+def is_cpu_bound(parser):
+	return getattr(parser, 'workload', 'io') == 'cpu'
+
+def get_processes(settings):
+	try:
+		return max(0, int(settings.get('processes', 0)))
+	except (TypeError, ValueError):
+		logger.warning("Set %s has an invalid processes setting %s"%(settings['name'], settings['processes']))
+		return 0
+
+def start_pool(settings):
+	""" Starts the worker processes of a set, if it wants any
+	and it has any CPU-bound parsers
+	"""
+	processes = get_processes(settings)
+	if processes == 0:
+		return None
+	if len(cpu_parsers(settings)) == 0:
+		return None
+	# the workers are forked right away, before any threads or caches
+	# are started, and don't need to import the main script again
+	context = multiprocessing.get_context('fork')
+	pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=context,
+	                                              initializer=init_worker, initargs=(settings,))
+	pool.submit(int).result()
+	with _pools_lock:
+		_pools[settings['name']] = pool
+	logger.debug("Started %s worker processes for %s"%(processes, settings['name']))
+	return pool
+
+def get_pool(settings):
+	with _pools_lock:
+		return _pools.get(settings['name'])
+
+def stop_pool(settings):
+	with _pools_lock:
+		pool = _pools.pop(settings['name'], None)
+	if pool:
+		pool.shutdown(wait=True)
+
+def run_parser(settings, parser_name, metadata):
+	""" Runs a parser in the set's worker processes """
+	return get_pool(settings).submit(run_worker_parser, parser_name, metadata).result()
+
+# Inside the worker processes
+def cpu_parsers(settings):
+	return [name for name in settings['parsers'] if is_cpu_bound(load_parser(name))]
+
+def init_worker(settings):
+	""" Prepares a new worker process, loading its parsers just once """
+	global _worker_settings
+	_worker_settings = settings
+	from . import organize
+	for parser_name in cpu_parsers(settings):
+		parser = load_parser(parser_name)
+		if hasattr(parser, 'start_set'):
+			parser.start_set(settings['cacheDir'], organize.get_parser_options(settings, parser_name))
+	multiprocessing.util.Finalize(None, finish_worker, exitpriority=10)
+
+def finish_worker():
+	settings = _worker_settings
+	for parser_name in cpu_parsers(settings):
+		parser = load_parser(parser_name)
+		if hasattr(parser, 'finish_set'):
+			try:
+				parser.finish_set(settings['cacheDir'])
+			except:
+				logger.warning("%s failed to finish %s in a worker process: %s" % \
+				               (parser_name, settings['name'], traceback.format_exc()))
+
+def run_worker_parser(parser_name, metadata):
+	from . import organize
+	parser = load_parser(parser_name)
+	parser_options = organize.get_parser_options(_worker_settings, parser_name)
+	return parser.get_metadata(metadata, parser_options)
@@ -0,0 +1,43 @@
+# -*- coding: UTF-8 -*-
+""" Compares the speed of deep_merge against the old way of merging lists
+Run with python3 -m tests._bench_deepmerge
+"""
+import copy
+import random
+import timeit
+
+import medialinkfs.deepmerge as deepmerge
+
+def legacy_deep_merge_list(target, update):
+	for item in update:
+		if item not in target:
+			target.append(item)
+
+def main():
+	rand = random.Random(42)
+	# many small updates, which still search the list instead of building a set
+	artists = ['Artist %s'%(i,) for i in range(3000)]
+	tracks = [{'artists': rand.sample(artists, 3)} for i in range(2000)]
+	for name, merge_list in [('legacy', legacy_deep_merge_list),
+	                         ('deepmerge', deepmerge.deep_merge_list)]:
+		def run():
+			merged = {'artists': []}
+			for track in tracks:
+				merge_list(merged['artists'], track['artists'])
+			return merged
+		seconds = min(timeit.repeat(run, number=1, repeat=5))
+		print("%-10s %.3f seconds to merge %s tracks into %s artists" % \
+		      (name, seconds, len(tracks), len(run()['artists'])))
+	# merging a big parser result into the metadata of the item so far
+	big = {'artists': list(artists)}
+	update = {'artists': list(reversed(artists))}
+	for name, merge_list in [('legacy', legacy_deep_merge_list),
+	                         ('deepmerge', deepmerge.deep_merge_list)]:
+		def run():
+			merge_list(copy.copy(big['artists']), update['artists'])
+		seconds = min(timeit.repeat(run, number=1, repeat=5))
+		print("%-10s %.3f seconds to merge two lists of %s artists" % \
+		      (name, seconds, len(artists)))
+
+if __name__ == '__main__':
+	main()
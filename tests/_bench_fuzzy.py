@@ -0,0 +1,28 @@
+# -*- coding: UTF-8 -*-
+""" Compares the speed of fuzzy matching against the old way of matching
+Run with python3 -m tests._bench_fuzzy
+"""
+import random
+import timeit
+
+from tests.fuzzy import legacy_find_best, random_title
+import medialinkfs.parsers.fuzzy as fuzzy
+
+def main():
+	rand = random.Random(42)
+	# freebase results come with dozens of aliases each
+	lookups = []
+	for i in range(100):
+		needle = random_title(rand)
+		candidates = [(random_title(rand), j) for j in range(200)]
+		lookups.append((needle, candidates))
+	for name, find_best in [('difflib', legacy_find_best), ('fuzzy', fuzzy.find_best)]:
+		def run():
+			for needle, candidates in lookups:
+				find_best(needle, candidates, 0.8)
+		seconds = min(timeit.repeat(run, number=1, repeat=5))
+		print("%-8s %.3f seconds for %s lookups of %s candidates" % \
+		      (name, seconds, len(lookups), len(lookups[0][1])))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+import os
+import tempfile
+import shutil
+import unittest
+import json
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs.cache as cache
+
+base = os.path.dirname(__file__)
+
+class TestCache(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.tmpdir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def check_backend(self, backend):
+		store = cache.open_cache(self.tmpdir, backend)
+		self.assertEqual(None, store.load('test'))
+		store.save('test', {'name':'test', 'actors':['Sir George']})
+		self.assertEqual(['Sir George'], store.load('test')['actors'])
+		store.save_many({'one':{'name':'one'}, 'two':{'name':'two'}})
+		found = store.load_many(['one', 'two', 'three'])
+		self.assertEqual(['one', 'two'], sorted(found.keys()))
+		store.close()
+
+		# reopen it
+		store = cache.open_cache(self.tmpdir, backend)
+		store.prefetch(['test', 'missing'])
+		self.assertEqual(['Sir George'], store.load('test')['actors'])
+		self.assertEqual(None, store.load('missing'))
+		store.close()
+
+	def test_files(self):
+		self.check_backend('files')
+		self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, '.cache-%s'%(cache.get_cache_key('test'),))))
+
+	def test_sqlite(self):
+		self.check_backend('sqlite')
+		self.assertEqual(['metadata.sqlite'], os.listdir(self.tmpdir))
+
+	def test_sqlite_batching(self):
+		store = cache.SqliteCache(self.tmpdir, batch_size=3)
+		other = cache.SqliteCache(self.tmpdir)
+		store.save('one', {'name':'one'})
+		store.save('two', {'name':'two'})
+		self.assertEqual({'name':'one'}, store.load('one'))
+		self.assertEqual(None, other.load('one'))
+		store.save('three', {'name':'three'})
+		self.assertEqual({'name':'one'}, other.load('one'))
+		store.close()
+		other.close()
+
+	def test_abstract(self):
+		self.assertRaises(TypeError, cache.MetadataCache, self.tmpdir)
+
+	def test_unknown_backend(self):
+		self.assertRaises(cache.errors.SetError, cache.open_cache, self.tmpdir, 'tape')
+
+	def test_migrate(self):
+		old = cache.FileCache(self.tmpdir)
+		for name in ['one', 'two', 'three']:
+			old.save(name, {'name':name, 'actors':[name]})
+		store = cache.SqliteCache(self.tmpdir)
+		self.assertEqual(3, cache.migrate_file_cache(self.tmpdir, store))
+		self.assertEqual(['metadata.sqlite'], os.listdir(self.tmpdir))
+		self.assertEqual(['two'], store.load('two')['actors'])
+		store.close()
+
+	def test_migrate_failure(self):
+		old = cache.FileCache(self.tmpdir)
+		old.save('one', {'name':'one', 'actors':['one']})
+		store = cache.SqliteCache(self.tmpdir)
+		with store.db:
+			store.db.execute("CREATE TRIGGER broken BEFORE INSERT ON metadata "
+			                 "BEGIN SELECT RAISE(ABORT, 'broken'); END")
+		# nothing is stored, so the file is kept
+		self.assertEqual(0, cache.migrate_file_cache(self.tmpdir, store))
+		self.assertTrue(os.path.isfile(old.get_path('one')))
+		self.assertEqual(None, store.load('one'))
+		with store.db:
+			store.db.execute("DROP TRIGGER broken")
+		self.assertEqual(1, cache.migrate_file_cache(self.tmpdir, store))
+		self.assertFalse(os.path.isfile(old.get_path('one')))
+		self.assertEqual(['one'], store.load('one')['actors'])
+		store.close()
@@ -1,4 +1,5 @@
 # -*- coding: UTF-8 -*-
+import json
 import os
 import tempfile
 import shutil
@@ -8,8 +9,10 @@ import logging
 logging.basicConfig(level=logging.DEBUG, filename='tests.log')
 
 import medialinkfs
+import medialinkfs.cache
 import medialinkfs.organize
 import medialinkfs.parsers.dummy as dummy
+import medialinkfs.parsers.ratelimit
 
 base = os.path.dirname(__file__)
 
@@ -339,3 +342,308 @@ class TestDummy(unittest.TestCase):
 		self.assertTrue(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir George")))
 		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
 		self.assertFalse(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test2")))
+	def test_dummy_concurrency(self):
+		self.settings['concurrency'] = 4
+		for index in range(20):
+			name = 'test%s'%(index,)
+			os.mkdir(os.path.join(self.tmpdir, 'All', name))
+			dummy.data[name] = {"actors": ["Sir George", "Actor %s"%(index,)]}
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		for index in range(20):
+			name = 'test%s'%(index,)
+			self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", name)))
+			self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Actor %s"%(index,), name)))
+		self.assertFalse(os.path.isfile(os.path.join(self.settings['cacheDir'], 'progress')))
+	def test_dummy_cache_files(self):
+		self.settings['cacheBackend'] = 'files'
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		cache_files = [x for x in os.listdir(self.settings['cacheDir']) if x.startswith('.cache-')]
+		self.assertEqual(1, len(cache_files))
+
+		# delete the actors field and see if it uses cache
+		del dummy.data['test']['actors']
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+	def test_dummy_cache_parser_options(self):
+		self.settings['parsers'] = ['dummy', 'quantizer']
+		self.settings['preferCachedData'] = True
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+
+		# changing another parser's options keeps the cached dummy data
+		dummy.data['test']['actors'] = ['Sir Phil']
+		self.settings['parser_options'] = {'quantizer': {'changed': True}}
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Phil")))
+
+		# changing the dummy options reloads its data
+		self.settings['parser_options']['dummy'] = {'changed': True}
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir George")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test")))
+	def test_dummy_cache_legacy(self):
+		# an entry from before results were cached per parser
+		os.mkdir(self.settings['cacheDir'])
+		legacy = {'name': 'test', 'path': os.path.join(self.settings['sourceDir'], 'test'),
+		          'actors': ['Sir George'], 'parser_options': {'dummy': {'old': True}}}
+		cache_path = os.path.join(self.settings['cacheDir'], '.cache-%s'%(medialinkfs.cache.get_cache_key('test'),))
+		with open(cache_path, 'w') as writing:
+			writing.write(json.dumps(legacy))
+		medialinkfs.cache.migrate_file_cache(self.settings['cacheDir'], medialinkfs.cache.get_cache(self.settings))
+		medialinkfs.cache.close_cache(self.settings)
+		self.assertFalse(os.path.isfile(cache_path))
+
+		# it's still used if the parser_options are the same
+		dummy.data['test']['actors'] = ['Sir Phil']
+		self.settings['preferCachedData'] = True
+		self.settings['parser_options'] = {'dummy': {'old': True}}
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Phil")))
+
+		# and ignored once they change
+		self.settings['parser_options'] = {'dummy': {'changed': True}}
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir George")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test")))
+
+	def test_dummy_incremental(self):
+		self.settings['incremental'] = True
+		test = os.path.join(self.tmpdir, "All", "test")
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertFalse(os.path.isfile(os.path.join(self.tmpdir, "Actors", "Sir George", ".toc-test")))
+
+		# unchanged items aren't looked up again
+		dummy.data['test']['actors'] = ['Sir Phil']
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Phil")))
+
+		# changed items are relinked
+		stat = os.stat(test)
+		os.utime(test, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir George")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test")))
+
+		# new items are added, removed items are unlinked
+		os.rmdir(test)
+		os.mkdir(os.path.join(self.tmpdir, "All", "test2"))
+		dummy.data['test2'] = {'actors': ['Sir Phil', 'Sir Harry']}
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertFalse(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test2")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Harry", "test2")))
+	def test_dummy_dry_run(self):
+		medialinkfs.organize.organize_set({'dry_run': True}, self.settings)
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir George")))
+		self.assertEqual([], os.listdir(os.path.join(self.tmpdir, "Actors")))
+
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+
+		dummy.data['test']['actors'] = ['Sir Phil']
+		medialinkfs.organize.organize_set({'dry_run': True}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Phil")))
+
+	def test_dummy_resume(self):
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+
+		# pretend that a run was interrupted after organizing test
+		os.mkdir(os.path.join(self.tmpdir, "All", "test2"))
+		dummy.data['test2'] = {'actors': ['Sir Phil']}
+		dummy.data['test']['actors'] = ['Sir Harry']
+		with open(os.path.join(self.settings['cacheDir'], 'progress'), 'w') as progress:
+			progress.write("test\n")
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Harry")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test2")))
+
+	def test_dummy_retry_failed(self):
+		# a parser that crashes on test
+		dummy.data['test'] = 5
+		os.mkdir(os.path.join(self.tmpdir, "All", "test2"))
+		dummy.data['test2'] = {'actors': ['Sir Phil']}
+		statuses = []
+		# stop before the progress file is removed
+		def interrupt(options, settings, plan, journal):
+			statuses.append(journal.load())
+			raise KeyboardInterrupt
+		old_finish = medialinkfs.organize.finish_progress
+		medialinkfs.organize.finish_progress = interrupt
+		try:
+			self.assertRaises(KeyboardInterrupt, medialinkfs.organize.organize_set, {}, self.settings)
+		finally:
+			medialinkfs.organize.finish_progress = old_finish
+		self.assertEqual({'test': 'failed', 'test2': 'ok'}, statuses[0])
+
+		# resuming normally skips the failed item
+		dummy.data['test'] = {'actors': ['Sir George']}
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir George")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test2")))
+
+		# but it can be retried
+		with open(os.path.join(self.settings['cacheDir'], 'progress'), 'w') as journal:
+			journal.write("test\tfailed\ntest2\tok\n")
+		dummy.data['test2'] = {'actors': ['Sir Harry']}
+		medialinkfs.organize.organize_set({'retry_failed': True}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test2")))
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Harry")))
+
+	def test_dummy_partial_cleanup(self):
+		self.settings['incremental'] = True
+		self.settings['fullCleanupInterval'] = 3600
+		test = os.path.join(self.tmpdir, "All", "test")
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertTrue(os.path.isfile(os.path.join(self.settings['cacheDir'], 'last-cleanup')))
+
+		# a stray link is only noticed by the full cleanup
+		os.symlink(test, os.path.join(self.tmpdir, "Actors", "Sir George", "stray"))
+
+		# changed items only have their own links updated
+		dummy.data['test']['actors'] = ['Sir Phil']
+		stat = os.stat(test)
+		os.utime(test, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertFalse(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "stray")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test")))
+		self.assertEqual(set(['Sir George', 'Sir Phil']), medialinkfs.toc.load_toc(os.path.join(self.tmpdir, "Actors", ".toc.done-test")))
+		self.assertEqual(set(), medialinkfs.toc.load_toc(os.path.join(self.tmpdir, "Actors", "Sir George", ".toc.done-test")))
+
+		# removed items are unlinked
+		os.mkdir(os.path.join(self.tmpdir, "All", "test2"))
+		dummy.data['test2'] = {'actors': ['Sir Harry']}
+		os.rmdir(test)
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Phil")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Harry", "test2")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "stray")))
+
+		# until the full cleanup is asked for
+		medialinkfs.organize.organize_set({'full_cleanup': True}, self.settings)
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir George")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Harry", "test2")))
+
+	def test_dummy_partial_cleanup_dry_run(self):
+		self.settings['incremental'] = True
+		self.settings['fullCleanupInterval'] = 3600
+		medialinkfs.organize.organize_set({}, self.settings)
+
+		# a dry run doesn't record the links that it didn't make
+		os.mkdir(os.path.join(self.tmpdir, "All", "test2"))
+		dummy.data['test2'] = {'actors': ['Sir Phil']}
+		medialinkfs.organize.organize_set({'dry_run': True}, self.settings)
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Phil")))
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test2")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+
+	def test_dummy_partial_cleanup_unchanged(self):
+		self.settings['fullCleanupInterval'] = 3600
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+
+		# even without incremental, unchanged items aren't looked up again
+		dummy.data['test']['actors'] = ['Sir Phil']
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Phil")))
+
+		# an empty sourceDir doesn't remove every link
+		shutil.rmtree(self.settings['sourceDir'])
+		os.mkdir(self.settings['sourceDir'])
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+
+	def test_dummy_quota_exceeded(self):
+		for name in ['test2', 'test3']:
+			os.mkdir(os.path.join(self.tmpdir, "All", name))
+			dummy.data[name] = {'actors': ['Sir Phil']}
+		self.settings['parser_options'] = {'dummy': {'daily_quota': 3}}
+		calls = []
+		get_metadata = dummy.get_metadata
+		# two requests per item
+		def limited_get_metadata(metadata, settings={}):
+			calls.append(metadata['name'])
+			medialinkfs.parsers.ratelimit.wait('dummy', settings)
+			medialinkfs.parsers.ratelimit.wait('dummy', settings)
+			return get_metadata(metadata, settings)
+		dummy.get_metadata = limited_get_metadata
+		try:
+			medialinkfs.organize.organize_set({}, self.settings)
+		finally:
+			dummy.get_metadata = get_metadata
+			with medialinkfs.parsers.ratelimit._limiters_lock:
+				medialinkfs.parsers.ratelimit._limiters.clear()
+				medialinkfs.parsers.ratelimit._saved_usage.clear()
+		# the second item runs out of the quota, and then the
+		# parser is skipped without any crash reports
+		self.assertEqual(['test', 'test2'], calls)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Phil")))
+		self.assertFalse(os.path.isfile(os.path.join(self.settings['cacheDir'], 'failed.log')))
+
+	def test_dummy_incremental_failed(self):
+		self.settings['incremental'] = True
+		# a parser that crashes on the first run
+		get_metadata = dummy.get_metadata
+		def broken_get_metadata(metadata, settings={}):
+			raise IOError("The network is down")
+		dummy.get_metadata = broken_get_metadata
+		try:
+			medialinkfs.organize.organize_set({}, self.settings)
+		finally:
+			dummy.get_metadata = get_metadata
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir George")))
+
+		# the unchanged item is looked up again once it works
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+
+	def test_dummy_partial_cleanup_failed(self):
+		self.settings['fullCleanupInterval'] = 3600
+		medialinkfs.organize.organize_set({}, self.settings)
+
+		# a new item that fails during a partial run
+		os.mkdir(os.path.join(self.tmpdir, "All", "test2"))
+		dummy.data['test2'] = 5
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir Phil")))
+
+		# is tried again by the next one
+		dummy.data['test2'] = {'actors': ['Sir Phil']}
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test2")))
+
+	def test_dummy_cache_queries(self):
+		for index in range(30):
+			name = "item%s"%(index,)
+			os.mkdir(os.path.join(self.tmpdir, "All", name))
+			dummy.data[name] = {'actors': ['Sir Phil']}
+		medialinkfs.organize.organize_set({}, self.settings)
+
+		# the cached entries are read in batches, not one at a time
+		queries = []
+		open_cache = medialinkfs.cache.open_cache
+		def traced_open_cache(cache_dir, backend='sqlite'):
+			store = open_cache(cache_dir, backend)
+			store.db.set_trace_callback(queries.append)
+			return store
+		medialinkfs.cache.open_cache = traced_open_cache
+		try:
+			medialinkfs.organize.organize_set({}, self.settings)
+		finally:
+			medialinkfs.cache.open_cache = open_cache
+		self.assertEqual(1, len([query for query in queries if query.startswith('SELECT')]))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "item29")))
@@ -6,8 +6,11 @@ import unittest
 
 import logging
 logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+import threading
+import time
 
 import medialinkfs.parsers.freebase as api
+import medialinkfs.parsers.ratelimit
 import medialinkfs.config
 
 base = os.path.dirname(__file__)
@@ -20,6 +23,90 @@ except:
 	logging.warning("Could not load API key from config file %s, lack of API key may cause test failures"%(config_file,))
 	pass
 
+batch_response = (
+	b"--batch_abc\r\n"
+	b"Content-Type: application/http\r\n"
+	b"Content-ID: <response-q1>\r\n\r\n"
+	b"HTTP/1.1 200 OK\r\n"
+	b"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+	b'{"result": [{"name": "Gattaca"}]}\r\n'
+	b"--batch_abc\r\n"
+	b"Content-Type: application/http\r\n"
+	b"Content-ID: <response-q0>\r\n\r\n"
+	b"HTTP/1.1 404 Not Found\r\n\r\n"
+	b"--batch_abc--\r\n")
+
+class TestMQLBatch(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.send_batch = api.send_batch
+		self.batches = []
+		api.send_batch = self.fake_send_batch
+
+	def tearDown(self):
+		api.send_batch = self.send_batch
+
+	def fake_send_batch(self, batch, settings):
+		time.sleep(0.1)
+		self.batches.append(list(batch.futures.keys()))
+		for url in batch.futures.keys():
+			batch.set_result(url, {'result': [url]})
+
+	def test_encode(self):
+		urls = [api.get_mql_url([{'name~=': 'Gattaca'}], {}), api.get_mql_url([{'name~=': 'Fantasia'}], {})]
+		body = api.encode_batch(urls, 'batch_abc').decode('utf-8')
+		self.assertEqual(3, body.count('--batch_abc'))
+		self.assertTrue('Content-ID: <q1>\r\n\r\nGET /freebase/v1/mqlread?query=' in body)
+
+	def test_decode(self):
+		responses = api.decode_batch('multipart/mixed; boundary=batch_abc', batch_response)
+		self.assertEqual(404, responses[0].status)
+		self.assertEqual(200, responses[1].status)
+		self.assertEqual({'result': [{'name': 'Gattaca'}]}, responses[1].json())
+
+	def test_batch_quota(self):
+		urls = [api.get_mql_url([{'name~=': 'Fantasia'}], {}), api.get_mql_url([{'name~=': 'Gattaca'}], {})]
+		batch = api.MQLBatch()
+		futures = [batch.add(url) for url in urls]
+		send = api.httpclient.send
+		def fake_send(pool, method, path, headers, body, timeout):
+			return (200, 'OK', {'Content-Type': 'multipart/mixed; boundary=batch_abc'}, batch_response)
+		api.httpclient.send = fake_send
+		try:
+			settings = {'daily_quota': 100, 'batch_delay': 0.01}
+			self.send_batch(batch, settings)
+			limiter = medialinkfs.parsers.ratelimit.get_limiter('freebase', settings)
+			# one request with two queries in it
+			self.assertEqual(2, limiter.day_count)
+		finally:
+			api.httpclient.send = send
+			with medialinkfs.parsers.ratelimit._limiters_lock:
+				medialinkfs.parsers.ratelimit._limiters.clear()
+		self.assertEqual({'result': [{'name': 'Gattaca'}]}, futures[1].result())
+
+	def test_single(self):
+		results = api.run_mql_queries([[{'name~=': 'Gattaca'}], [{'alias~=': 'Gattaca'}]], {})
+		self.assertEqual(2, len(results))
+		self.assertEqual([results], self.batches)
+
+	def test_demux(self):
+		results = {}
+		def lookup(name):
+			results[name] = api.run_mql_queries([[{'name~=': name}], [{'alias~=': name}]], {'batch_delay': 0.5})
+		threads = [threading.Thread(target=lookup, args=(name,)) for name in ['Gattaca', 'Fantasia', 'Manwire']]
+		for thread in threads:
+			thread.start()
+			time.sleep(0.01)
+		for thread in threads:
+			thread.join()
+		# the first item is sent alone, the others wait for each other
+		self.assertEqual(2, len(self.batches))
+		self.assertEqual(6, sum([len(batch) for batch in self.batches]))
+		for name, result in results.items():
+			self.assertEqual(2, len(result))
+			for url in result:
+				self.assertTrue(api.urllib.parse.quote(name) in url)
+
 class TestFreebase(unittest.TestCase):
 	def setUp(self):
 		logging.debug("Initializing unittest %s"%(self.id(),))
@@ -0,0 +1,60 @@
+# -*- coding: UTF-8 -*-
+import os
+import difflib
+import random
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs.parsers.fuzzy as fuzzy
+
+base = os.path.dirname(__file__)
+
+def legacy_find_best(needle, candidates, threshold):
+	""" How the parsers used to pick their best match """
+	best = 0
+	bestresult = None
+	for name, result in candidates:
+		s = difflib.SequenceMatcher(None, fuzzy.squash(needle), fuzzy.squash(name))
+		score = s.ratio()
+		if score > best and score > threshold:
+			best = score
+			bestresult = result
+	return (bestresult, best)
+
+def random_title(rand):
+	words = ['the', 'final', 'fantasy', 'star', 'trek', 'wars', 'ace', 'attorney',
+	         'gyakuten', 'saiban', 'II', '4', 'ː', 'Original', 'Soundtrack', '-', '']
+	return ' '.join([rand.choice(words) for i in range(rand.randint(0, 6))])
+
+class TestFuzzy(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.rand = random.Random(42)
+
+	def test_scores(self):
+		for i in range(500):
+			needle = random_title(self.rand)
+			candidate = random_title(self.rand)
+			expected = difflib.SequenceMatcher(None, fuzzy.squash(needle), fuzzy.squash(candidate)).ratio()
+			self.assertEqual(expected, fuzzy.Matcher(needle).score(candidate))
+			score = fuzzy.Matcher(needle).score(candidate, 0.5)
+			# candidates are only skipped if they can't beat the minimum
+			if score is not None or expected > 0.5:
+				self.assertEqual(expected, score)
+
+	def test_find_best(self):
+		for i in range(200):
+			needle = random_title(self.rand)
+			candidates = [(random_title(self.rand), j) for j in range(20)]
+			for threshold in [0, 0.7, 0.8]:
+				self.assertEqual(legacy_find_best(needle, candidates, threshold),
+				                 fuzzy.find_best(needle, candidates, threshold))
+
+	def test_best_score(self):
+		names = ['Gyakuten Saiban 4', 'Ace Attorney 4', '']
+		expected = max([difflib.SequenceMatcher(None, fuzzy.squash('Gyakuten Saiban'), fuzzy.squash(x)).ratio()
+		                for x in names])
+		self.assertEqual(expected, fuzzy.best_score('Gyakuten Saiban', names))
+		self.assertEqual(0, fuzzy.best_score('Gyakuten Saiban', []))
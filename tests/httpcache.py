@@ -0,0 +1,125 @@
+# -*- coding: UTF-8 -*-
+import os
+import tempfile
+import shutil
+import threading
+import time
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs.parsers.httpcache as httpcache
+import medialinkfs.parsers.httpclient as httpclient
+
+base = os.path.dirname(__file__)
+
+class FakeClock(object):
+	def __init__(self):
+		self.now = 1000000.0
+	def __call__(self):
+		return self.now
+
+class FakeServer(object):
+	""" Answers fetches like a server whose content has an ETag """
+	def __init__(self):
+		self.body = b'{"version": 1}'
+		self.etag = '"1"'
+		self.requests = []
+		self.lock = threading.Lock()
+	def fetch(self, headers):
+		with self.lock:
+			self.requests.append(headers)
+		if headers.get('If-None-Match') == self.etag:
+			return httpclient.Response('http://test/', 304, {}, b'')
+		return httpclient.Response('http://test/', 200, {'ETag': self.etag}, self.body)
+
+class TestHTTPCache(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.tmpdir = tempfile.mkdtemp()
+		self.clock = FakeClock()
+		self.server = FakeServer()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_ttl(self):
+		cache = httpcache.ResponseCache(self.tmpdir, ttl=60, clock=self.clock)
+		self.assertEqual({'version': 1}, cache.get('http://test/', self.server.fetch).json())
+		self.assertEqual({'version': 1}, cache.get('http://test/', self.server.fetch).json())
+		self.assertEqual([{}], self.server.requests)
+		cache.close()
+
+		# the next run still uses it, until it expires
+		self.clock.now += 30
+		cache = httpcache.ResponseCache(self.tmpdir, ttl=60, clock=self.clock)
+		self.assertEqual({'version': 1}, cache.get('http://test/', self.server.fetch).json())
+		self.assertEqual(1, len(self.server.requests))
+
+		# then it is revalidated
+		self.clock.now += 60
+		self.assertEqual({'version': 1}, cache.get('http://test/', self.server.fetch).json())
+		self.assertEqual({'If-None-Match': '"1"'}, self.server.requests[-1])
+		self.clock.now += 30
+		cache.get('http://test/', self.server.fetch)
+		self.assertEqual(2, len(self.server.requests))
+
+		# and downloaded again if it changed
+		self.clock.now += 60
+		self.server.body = b'{"version": 2}'
+		self.server.etag = '"2"'
+		self.assertEqual({'version': 2}, cache.get('http://test/', self.server.fetch).json())
+		cache.close()
+
+	def test_revalidate(self):
+		cache = httpcache.ResponseCache(self.tmpdir, clock=self.clock)
+		cache.get('http://test/', self.server.fetch)
+		cache.close()
+		self.clock.now += 1
+		cache = httpcache.ResponseCache(self.tmpdir, clock=self.clock)
+		cache.revalidate = True
+		cache.get('http://test/', self.server.fetch)
+		cache.get('http://test/', self.server.fetch)
+		# checked once per run
+		self.assertEqual([{}, {'If-None-Match': '"1"'}], self.server.requests)
+		cache.close()
+
+	def test_errors(self):
+		cache = httpcache.ResponseCache(self.tmpdir, clock=self.clock)
+		missing = lambda headers: httpclient.Response('http://test/', 404, {}, b'')
+		self.assertEqual(404, cache.get('http://test/', missing).status)
+		self.assertEqual(None, cache.load('http://test/'))
+		cache.close()
+
+	def test_memory(self):
+		cache = httpcache.ResponseCache(self.tmpdir, memory_size=2, clock=self.clock)
+		for i in range(3):
+			cache.get('http://test/%s'%(i,), self.server.fetch)
+		self.assertEqual(['http://test/1', 'http://test/2'], list(cache.memory.keys()))
+		cache.load('http://test/0')
+		self.assertEqual(['http://test/2', 'http://test/0'], list(cache.memory.keys()))
+		cache.close()
+
+	def test_concurrent(self):
+		cache = httpcache.ResponseCache(self.tmpdir, clock=self.clock)
+		def slow_fetch(headers):
+			time.sleep(0.1)
+			return self.server.fetch(headers)
+		threads = [threading.Thread(target=cache.get, args=('http://test/', slow_fetch)) for i in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(1, len(self.server.requests))
+		cache.close()
+
+	def test_use_cache(self):
+		settings = {'cacheDir': self.tmpdir, 'httpCache': False}
+		self.assertEqual(None, httpcache.use_cache(settings))
+		self.assertEqual(None, httpcache.get_active())
+		settings['httpCache'] = True
+		cache = httpcache.use_cache(settings)
+		self.assertTrue(cache is httpcache.get_active())
+		httpcache.close_cache(settings)
+		self.assertEqual(None, httpcache.get_active())
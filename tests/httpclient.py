@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+import os
+import gzip
+import http.server
+import json
+import threading
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs.parsers.httpclient as httpclient
+
+base = os.path.dirname(__file__)
+
+class Handler(http.server.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		server = self.server
+		server.requests.append((self.client_address, self.path, dict(self.headers)))
+		if self.path == '/flaky' and server.failures > 0:
+			server.failures -= 1
+			return self.reply(503, b'busy')
+		if self.path == '/moved':
+			return self.reply(302, b'', {'Location': '/data'})
+		if self.path == '/drop':
+			self.close_connection = True
+		if self.path == '/missing':
+			return self.reply(404, b'missing')
+		body = json.dumps({'path': self.path}).encode('utf-8')
+		headers = {'Content-Type': 'application/json'}
+		if 'gzip' in self.headers.get('Accept-Encoding', ''):
+			body = gzip.compress(body)
+			headers['Content-Encoding'] = 'gzip'
+		self.reply(200, body, headers)
+
+	def reply(self, status, body, headers={}):
+		self.send_response(status)
+		for key, value in headers.items():
+			self.send_header(key, value)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+class TestHTTPClient(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.server.requests = []
+		self.server.failures = 0
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+		self.base = 'http://127.0.0.1:%s'%(self.server.server_address[1],)
+		self.slept = []
+
+	def tearDown(self):
+		httpclient.close_pools()
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_keepalive(self):
+		for i in range(3):
+			response = httpclient.request(self.base + '/data?i=%s'%(i,))
+			self.assertEqual({'path': '/data?i=%s'%(i,)}, response.json())
+		self.assertEqual(3, len(self.server.requests))
+		# every request came over the same connection, with gzip
+		self.assertEqual(1, len(set([r[0] for r in self.server.requests])))
+		self.assertEqual('gzip', self.server.requests[0][2]['Accept-Encoding'])
+
+	def test_retry(self):
+		self.server.failures = 2
+		response = httpclient.request(self.base + '/flaky', sleep=self.slept.append)
+		self.assertEqual(200, response.status)
+		self.assertEqual([1, 2], self.slept)
+
+		self.server.failures = 5
+		with self.assertRaises(httpclient.HTTPError) as cm:
+			httpclient.request(self.base + '/flaky', retries=1, retry_backoff=0.5, sleep=self.slept.append)
+		self.assertEqual(503, cm.exception.status)
+		self.assertEqual([1, 2, 0.5], self.slept)
+
+	def test_errors(self):
+		with self.assertRaises(httpclient.HTTPError) as cm:
+			httpclient.request(self.base + '/missing', sleep=self.slept.append)
+		self.assertEqual(404, cm.exception.status)
+		self.assertEqual([], self.slept)
+
+		response = httpclient.request(self.base + '/moved')
+		self.assertEqual({'path': '/data'}, response.json())
+
+	def test_closed_connection(self):
+		# the server hangs up after replying, without saying so
+		httpclient.request(self.base + '/drop')
+		pool = httpclient.get_pool('http', self.base[len('http://'):])
+		self.assertEqual(1, len(pool.idle))
+		response = httpclient.request(self.base + '/data', retries=0)
+		self.assertEqual(200, response.status)
+		self.assertEqual(2, len(set([r[0] for r in self.server.requests])))
@@ -48,3 +48,79 @@ class TestID3(unittest.TestCase):
 		self.assertFalse('composers' in res)
 		self.assertEqual('Combustible Edison', sorted(res['artists'])[1])
 		self.assertEqual('Album', sorted(res['albums'])[0])
+
+	def test_id3_region(self):
+		for name in ['23.synthetic.empty-extended-header.lossy.id3', '23.stagger.IPLS-frame.id3']:
+			src = os.path.join(base, 'testfiles_id3', name)
+			dst = os.path.join(self.tmpdir, 'test.mp3')
+			with open(src, 'rb') as reading:
+				tag = reading.read()
+			# the audio after the tag is never read
+			with open(dst, 'wb') as writing:
+				writing.write(tag + b'\xff\xfb' * 1000)
+			self.assertEqual(tag, id3.read_tag_region(dst))
+		with open(dst, 'wb') as writing:
+			writing.write(b'\xff\xfb' * 1000)
+		self.assertEqual(None, id3.read_tag_region(dst))
+		self.assertEqual({}, id3.load_id3(dst))
+
+	def test_id3_folder_extras(self):
+		nest = os.path.join(self.tmpdir, 'All', 'nest')
+		os.makedirs(os.path.join(nest, 'CD2'))
+		shutil.copyfile(os.path.join(base, 'testfiles_id3', '23.synthetic.empty-extended-header.lossy.id3'),
+		                os.path.join(nest, '23.mp3'))
+		shutil.copyfile(os.path.join(base, 'testfiles_id3', '23.stagger.IPLS-frame.id3'),
+		                os.path.join(nest, 'CD2', 'test.mp3'))
+		for name in ['cover.jpg', 'album.cue', 'untagged.mp3']:
+			with open(os.path.join(nest, name), 'wb') as writing:
+				writing.write(b'not a tag')
+		self.assertEqual(['23.mp3', 'test.mp3', 'untagged.mp3'],
+		                 sorted([os.path.basename(x) for x in id3.find_songs(nest)]))
+
+		res = id3.get_metadata({"path":nest})
+		self.assertEqual(2, len(res['artists']))
+		self.assertEqual(res, id3.get_metadata({"path":nest}, {'workers': 1}))
+
+	def test_accumulator(self):
+		merged = id3.TagAccumulator()
+		merged.add({'artist': 'A', 'artists': ['A', 'B'], 'track_total': 10})
+		merged.add({'artist': 'C', 'artists': ['C', 'A']})
+		self.assertEqual({'artist': 'C', 'artists': ['A', 'B', 'C'], 'track_total': 10}, merged.data)
+
+	def test_tag_cache(self):
+		nest = os.path.join(self.tmpdir, 'All', 'nest')
+		os.makedirs(nest)
+		song = os.path.join(nest, '23.mp3')
+		shutil.copyfile(os.path.join(base, 'testfiles_id3', '23.synthetic.empty-extended-header.lossy.id3'), song)
+		cache_dir = os.path.join(self.tmpdir, 'cache')
+		os.mkdir(cache_dir)
+		id3.start_set(cache_dir)
+		try:
+			res = id3.get_metadata({"path":nest})
+		finally:
+			id3.finish_set(cache_dir)
+		self.assertEqual('Combustible Edison', res['artist'])
+
+		# unchanged files aren't read again
+		read_id3 = id3.read_id3
+		id3.read_id3 = None
+		id3.start_set(cache_dir)
+		try:
+			self.assertEqual(res, id3.get_metadata({"path":nest}))
+			self.assertEqual(res, id3.get_metadata({"path":song}))
+		finally:
+			id3.read_id3 = read_id3
+			id3.finish_set(cache_dir)
+
+		# changed ones are
+		with open(song, 'r+b') as writing:
+			writing.seek(0, 2)
+			writing.write(b'\xff\xfb')
+		id3.start_set(cache_dir)
+		try:
+			tag_cache = id3._tag_cache
+			self.assertEqual({}, tag_cache.load_many({song: os.stat(song)}))
+			self.assertEqual(res, id3.get_metadata({"path":nest}))
+			self.assertEqual(1, len(tag_cache.load_many({song: os.stat(song)})))
+		finally:
+			id3.finish_set(cache_dir)
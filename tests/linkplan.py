@@ -0,0 +1,130 @@
+# -*- coding: UTF-8 -*-
+import os
+import tempfile
+import shutil
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs.linkplan as linkplan
+
+base = os.path.dirname(__file__)
+
+class TestLinkPlan(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.tmpdir = tempfile.mkdtemp()
+		self.settings = {
+			"name": "test",
+			"sourceDir": os.path.join(self.tmpdir, "All"),
+			"cacheDir": os.path.join(self.tmpdir, ".cache"),
+			"output": [{
+				"dest": os.path.join(self.tmpdir, "Actors"),
+				"groupBy": "actors"
+			}]
+		}
+		self.actors = os.path.join(self.tmpdir, "Actors")
+		os.mkdir(os.path.join(self.tmpdir, "All"))
+		os.mkdir(os.path.join(self.tmpdir, "All", "one"))
+		os.mkdir(os.path.join(self.tmpdir, "All", "two"))
+		os.mkdir(self.actors)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def make_plan(self, links):
+		plan = linkplan.LinkPlan()
+		for value, name in links:
+			plan.add(self.actors, value, name, os.path.join(self.settings['sourceDir'], name))
+		return plan
+
+	def test_reconcile(self):
+		plan = self.make_plan([('Sir George', 'one'), ('Sir George', 'two'), ('Sir Phil', 'two')])
+		self.assertEqual(3, len(plan))
+		operations = linkplan.Reconciler(self.settings).reconcile(plan)
+		self.assertEqual(5, len(operations))
+		self.assertEqual(os.path.join('..', '..', 'All', 'one'),
+		                 os.readlink(os.path.join(self.actors, 'Sir George', 'one')))
+		self.assertTrue(os.path.islink(os.path.join(self.actors, 'Sir Phil', 'two')))
+
+		# nothing changes the second time
+		operations = linkplan.Reconciler(self.settings).reconcile(plan)
+		self.assertEqual([], operations)
+
+		# only the differences are applied
+		plan = self.make_plan([('Sir George', 'one'), ('Sir Harry', 'two')])
+		operations = linkplan.Reconciler(self.settings).reconcile(plan)
+		self.assertEqual(sorted([
+			('mkdir', os.path.join(self.actors, 'Sir Harry')),
+			('link', os.path.join(self.actors, 'Sir Harry', 'two')),
+			('remove extra link', os.path.join(self.actors, 'Sir George', 'two')),
+			('remove extra dir', os.path.join(self.actors, 'Sir Phil'))]),
+			sorted(operations))
+		self.assertFalse(os.path.isdir(os.path.join(self.actors, 'Sir Phil')))
+		self.assertEqual(set(['Sir George', 'Sir Harry']),
+		                 linkplan.load_toc(os.path.join(self.actors, '.toc.done-test')))
+
+	def test_empty_plan(self):
+		plan = self.make_plan([('Sir George', 'one')])
+		linkplan.Reconciler(self.settings).reconcile(plan)
+		# an empty sourceDir leaves the output alone
+		operations = linkplan.Reconciler(self.settings).reconcile(linkplan.LinkPlan())
+		self.assertEqual([], operations)
+		self.assertTrue(os.path.islink(os.path.join(self.actors, 'Sir George', 'one')))
+		self.assertEqual(set(['Sir George']),
+		                 linkplan.load_toc(os.path.join(self.actors, '.toc.done-test')))
+
+	def test_dry_run(self):
+		plan = self.make_plan([('Sir George', 'one')])
+		operations = linkplan.Reconciler(self.settings, dry_run=True).reconcile(plan)
+		self.assertEqual([('mkdir', os.path.join(self.actors, 'Sir George')),
+		                  ('link', os.path.join(self.actors, 'Sir George', 'one'))], operations)
+		self.assertEqual([], os.listdir(self.actors))
+
+	def test_targets(self):
+		plan = linkplan.LinkPlan()
+		source = self.settings['sourceDir']
+		for destdir, value, itempath in [
+		    (self.actors, 'Sir George', os.path.join(source, 'one')),
+		    (self.actors, 'Sir Phil', os.path.join(source, 'one')),
+		    (self.tmpdir, 'All', os.path.join(source, 'one')),
+		    (self.tmpdir, 'All', source),
+		    (self.tmpdir, 'Alltogether', os.path.join(source, 'one')),
+		    (source, 'one', os.path.join(self.actors, 'two')),
+		    (self.actors, '..', os.path.join(source, 'two'))]:
+			self.assertEqual(os.path.relpath(itempath, os.path.join(destdir, value)),
+			                 plan.get_target(destdir, value, itempath))
+
+	def test_without_dir_fd(self):
+		use_dir_fd = linkplan.use_dir_fd
+		linkplan.use_dir_fd = False
+		try:
+			self.test_reconcile()
+		finally:
+			linkplan.use_dir_fd = use_dir_fd
+
+	def test_apply_links(self):
+		linkplan.Reconciler(self.settings).reconcile(self.make_plan([('Sir George', 'one')]))
+		with open(os.path.join(self.actors, 'Extra'), 'w') as extra:
+			extra.write('')
+		# only the planned group directories are read
+		scanned = []
+		scan_dir = linkplan.scan_dir
+		def tracked_scan_dir(path, *args, **kwargs):
+			scanned.append(path)
+			return scan_dir(path, *args, **kwargs)
+		linkplan.scan_dir = tracked_scan_dir
+		try:
+			operations = linkplan.apply_links(self.settings, self.make_plan([('Sir George', 'two'), ('Sir Phil', 'two')]))
+		finally:
+			linkplan.scan_dir = scan_dir
+		self.assertEqual(sorted([os.path.join(self.actors, 'Sir George'), os.path.join(self.actors, 'Sir Phil')]),
+		                 sorted(scanned))
+		self.assertEqual(sorted([
+			('link', os.path.join(self.actors, 'Sir George', 'two')),
+			('mkdir', os.path.join(self.actors, 'Sir Phil')),
+			('link', os.path.join(self.actors, 'Sir Phil', 'two'))]),
+			sorted(operations))
+		self.assertTrue(os.path.islink(os.path.join(self.actors, 'Sir George', 'one')))
+		self.assertTrue(os.path.isfile(os.path.join(self.actors, 'Extra')))
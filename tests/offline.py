@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+import os
+import tempfile
+import shutil
+import json
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs.parsers.offline as offline
+
+base = os.path.dirname(__file__)
+
+class TestOffline(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.tmpdir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		offline.finish_set(self.tmpdir)
+		shutil.rmtree(self.tmpdir)
+
+	def write_tsv(self, rows):
+		path = os.path.join(self.tmpdir, 'titles.tsv')
+		with open(path, 'w', encoding='utf-8') as output:
+			output.write('tconst\ttitleType\tprimaryTitle\toriginalTitle\tstartYear\tgenres\n')
+			for row in rows:
+				output.write('\t'.join(row) + '\n')
+		return path
+
+	def test_tsv(self):
+		path = self.write_tsv([
+			['tt0060028', 'tvSeries', 'Star Trek', 'Star Trek', '1966', 'Action,Adventure,Sci-Fi'],
+			['tt0796366', 'movie', 'Star Trek', 'Star Trek', '2009', 'Action,Adventure'],
+			['tt0245429', 'movie', 'Spirited Away', 'Sen to Chihiro no kamikakushi', '2001', 'Animation'],
+			['tt9999999', 'movie', 'Unknown', 'Unknown', '\\N', '\\N'],
+		])
+		settings = {'dataset': path}
+		offline.start_set(self.tmpdir, settings)
+		self.assertTrue(os.path.isfile(path + '.sqlite'))
+
+		res = offline.get_metadata({'path': '/Star Trek (2009)'}, settings)
+		self.assertEqual(2009, res['year'])
+		self.assertEqual(['Action', 'Adventure'], res['genres'])
+		# the first one in the dataset wins without a year
+		self.assertEqual(1966, offline.get_metadata({'path': '/Star Trek'}, settings)['year'])
+		self.assertEqual(None, offline.get_metadata({'path': '/Star Trek (1990)'}, settings))
+		# found by squashed and original titles
+		self.assertEqual(2001, offline.get_metadata({'path': '/spirited  away!'}, settings)['year'])
+		self.assertEqual(2001, offline.get_metadata({'path': '/Sen to Chihiro no Kamikakushi'}, settings)['year'])
+		self.assertEqual({}, offline.get_metadata({'path': '/Unknown'}, settings))
+		self.assertEqual(None, offline.get_metadata({'path': '/Missing'}, settings))
+
+	def test_jsonl(self):
+		path = os.path.join(self.tmpdir, 'titles.jsonl')
+		with open(path, 'w', encoding='utf-8') as output:
+			output.write(json.dumps({'Title': 'Dynomutt Dog Wonder', 'Year': '1976-1977',
+			                         'Actors': 'Frank Welker, Gary Owens', 'Director': 'Charles A. Nichols',
+			                         'Writer': ['Joe Ruby', 'Ken Spears'], 'Rated': 'N/A',
+			                         'Genre': 'Animation, Comedy'}) + '\n\n')
+		settings = {'dataset': path, 'database': os.path.join(self.tmpdir, 'titles.sqlite')}
+		res = offline.get_metadata({'path': '/Dynomutt Dog Wonder'}, settings)
+		self.assertEqual({'year': 1976, 'actors': ['Frank Welker', 'Gary Owens'],
+		                  'directors': ['Charles A. Nichols'], 'writers': ['Joe Ruby', 'Ken Spears'],
+		                  'genres': ['Animation', 'Comedy']}, res)
+
+	def test_reimport(self):
+		path = self.write_tsv([['tt1', 'movie', 'Old', 'Old', '1990', 'Drama']])
+		settings = {'dataset': path}
+		store = offline.get_store(settings)
+		self.assertTrue(store.is_current(path))
+		self.assertEqual(1990, offline.get_metadata({'path': '/Old'}, settings)['year'])
+		offline.finish_set(self.tmpdir)
+
+		# an unchanged dataset isn't imported again
+		store = offline.TitleStore(path + '.sqlite')
+		self.assertTrue(store.is_current(path))
+		store.close()
+
+		self.write_tsv([['tt2', 'movie', 'New', 'New', '2000', 'Drama']])
+		os.utime(path, ns=(0, 0))
+		self.assertEqual(None, offline.get_metadata({'path': '/Old'}, settings))
+		self.assertEqual(2000, offline.get_metadata({'path': '/New'}, settings)['year'])
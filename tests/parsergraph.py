@@ -0,0 +1,153 @@
+# -*- coding: UTF-8 -*-
+import os
+import sys
+import tempfile
+import shutil
+import threading
+import time
+import types
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs
+import medialinkfs.organize
+import medialinkfs.parsergraph as parsergraph
+
+base = os.path.dirname(__file__)
+
+def make_parser(consumes=None, produces=None):
+	parser = types.SimpleNamespace()
+	if consumes is not None:
+		parser.consumes = consumes
+	if produces is not None:
+		parser.produces = produces
+	return parser
+
+class SlowParser(object):
+	""" Sleeps while loading, remembering how many ran at once """
+	running = 0
+	most_running = 0
+	lock = threading.Lock()
+
+	def __init__(self, result, consumes=[], produces=None):
+		self.result = result
+		self.consumes = consumes
+		if produces is not None:
+			self.produces = produces
+		self.seen = None
+		self.calls = 0
+
+	def get_metadata(self, metadata, settings={}):
+		with SlowParser.lock:
+			SlowParser.running += 1
+			SlowParser.most_running = max(SlowParser.most_running, SlowParser.running)
+		time.sleep(0.1)
+		with SlowParser.lock:
+			SlowParser.running -= 1
+		self.seen = metadata
+		self.calls += 1
+		return dict(self.result)
+
+class TestParserGraph(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.tmpdir = tempfile.mkdtemp()
+		SlowParser.most_running = 0
+
+	def tearDown(self):
+		for name in ['slow_a', 'slow_b', 'slow_c']:
+			sys.modules.pop('medialinkfs.parsers.%s'%(name,), None)
+		shutil.rmtree(self.tmpdir)
+
+	def test_dependencies(self):
+		parsers = {
+			'omdbapi': make_parser([], ['year', 'actors']),
+			'freebase': make_parser([]),
+			'quantizer': make_parser(['year'], ['decade']),
+			'old': make_parser(),
+		}
+		graph = parsergraph.ParserGraph(['omdbapi', 'freebase', 'quantizer', 'old'], parsers.get)
+		self.assertEqual(set(), graph.dependencies['omdbapi'])
+		self.assertEqual(set(), graph.dependencies['freebase'])
+		# freebase doesn't say what it produces, so it may produce year
+		self.assertEqual(set(['omdbapi', 'freebase']), graph.dependencies['quantizer'])
+		self.assertEqual(set(['omdbapi', 'freebase', 'quantizer']), graph.dependencies['old'])
+		self.assertEqual(['omdbapi', 'freebase'], graph.ready(set()))
+		self.assertEqual(['freebase'], graph.ready(set(['omdbapi'])))
+		self.assertEqual(['quantizer'], graph.ready(set(['omdbapi', 'freebase'])))
+
+		parsers['freebase'] = make_parser([], ['actors'])
+		graph = parsergraph.ParserGraph(['omdbapi', 'freebase', 'quantizer'], parsers.get)
+		self.assertEqual(set(['omdbapi']), graph.dependencies['quantizer'])
+		self.assertEqual(['omdbapi'], graph.inputs('quantizer'))
+		self.assertEqual(['freebase', 'quantizer'], graph.ready(set(['omdbapi'])))
+
+	def load_metadata(self, concurrency, stop=False, groupBy=["year"]):
+		slow_a = SlowParser({'actors': ['Sir George'], 'year': 1990})
+		slow_b = SlowParser({'actors': ['Sir Phil'], 'year': 2000}, produces=['actors'])
+		slow_c = SlowParser({}, consumes=['year'])
+		slow_c.get_metadata = lambda metadata, settings={}: {'decade': str(metadata['year'])[:3]+'0s'}
+		sys.modules['medialinkfs.parsers.slow_a'] = slow_a
+		sys.modules['medialinkfs.parsers.slow_b'] = slow_b
+		sys.modules['medialinkfs.parsers.slow_c'] = slow_c
+		settings = {
+			"name": "test",
+			"parsers": ["slow_a", "slow_b", "slow_c"],
+			"parserConcurrency": concurrency,
+			"stopWhenSatisfied": stop,
+			"scanMode": "directories",
+			"sourceDir": os.path.join(self.tmpdir, "All"),
+			"cacheDir": os.path.join(self.tmpdir, ".cache"),
+			"output": [{"dest": os.path.join(self.tmpdir, "Actors"), "groupBy": "actors"},
+			           {"dest": os.path.join(self.tmpdir, "Years"), "groupBy": groupBy}]
+		}
+		os.makedirs(os.path.join(self.tmpdir, "All", "test"), exist_ok=True)
+		os.makedirs(os.path.join(self.tmpdir, "Actors"), exist_ok=True)
+		os.makedirs(os.path.join(self.tmpdir, "Years"), exist_ok=True)
+		medialinkfs.organize.prepare_for_organization(settings)
+		start = time.time()
+		metadata, status = medialinkfs.organize.load_item_metadata({}, settings, "test")
+		medialinkfs.cache.close_cache(settings)
+		self.parsers = [slow_a, slow_b, slow_c]
+		return metadata, time.time() - start
+
+	def test_concurrent(self):
+		metadata, elapsed = self.load_metadata(2)
+		self.assertEqual(2, SlowParser.most_running)
+		self.assertTrue(elapsed < 0.19)
+		# merged in the order of the set, no matter which finished first
+		self.assertEqual(['Sir George', 'Sir Phil'], metadata['actors'])
+		self.assertEqual(2000, metadata['year'])
+		# quantizer only saw the year from slow_a, which slow_b doesn't produce
+		self.assertEqual('1990s', metadata['decade'])
+
+	def test_sequential(self):
+		metadata, elapsed = self.load_metadata(1)
+		self.assertEqual(1, SlowParser.most_running)
+		self.assertEqual(['Sir George', 'Sir Phil'], metadata['actors'])
+		self.assertEqual('1990s', metadata['decade'])
+
+	def test_stop_when_satisfied(self):
+		for concurrency in [1, 2]:
+			metadata, elapsed = self.load_metadata(concurrency, True)
+			# slow_a already found the actors and year
+			self.assertEqual(['Sir George'], metadata['actors'])
+			self.assertEqual(1990, metadata['year'])
+			self.assertEqual([1, 0], [parser.calls for parser in self.parsers[:2]])
+			self.assertFalse('decade' in metadata)
+
+		# keeps going until something finds the decade
+		for concurrency in [1, 2]:
+			metadata, elapsed = self.load_metadata(concurrency, True, ["year", "decade"])
+			self.assertEqual(['Sir George', 'Sir Phil'], metadata['actors'])
+			self.assertEqual('1990s', metadata['decade'])
+			self.assertEqual([1, 1], [parser.calls for parser in self.parsers[:2]])
+
+		settings = {"output": [{"dest": "/tmp", "groupBy": ["actors", "year"]},
+		                       {"dest": "/tmp", "groupBy": "actors"}]}
+		self.assertEqual(['actors', 'year'], medialinkfs.organize.get_required_keys(settings))
+		self.assertFalse(medialinkfs.organize.has_value({'year': None}, 'year'))
+		self.assertFalse(medialinkfs.organize.has_value({'actors': []}, 'actors'))
+		self.assertTrue(medialinkfs.organize.has_value({'year': 0}, 'year'))
@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+import os
+import tempfile
+import shutil
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs.progress as progress
+
+base = os.path.dirname(__file__)
+
+class FakeClock(object):
+	def __init__(self):
+		self.now = 1000.0
+	def __call__(self):
+		return self.now
+
+class TestProgress(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.tmpdir = tempfile.mkdtemp()
+		self.filename = os.path.join(self.tmpdir, 'progress')
+		self.clock = FakeClock()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_batches(self):
+		journal = progress.ProgressJournal(self.filename, batch_size=3, interval=60, clock=self.clock)
+		journal.record('a')
+		journal.record('b', progress.UNKNOWN)
+		self.assertFalse(os.path.isfile(self.filename))
+		journal.record('c', progress.FAILED)
+		self.assertEqual({'a': 'ok', 'b': 'unknown', 'c': 'failed'}, journal.load())
+
+		# a slow trickle of items is still saved after the interval
+		journal.record('d')
+		self.assertEqual(3, len(journal.load()))
+		self.clock.now += 60
+		journal.record('e')
+		self.assertEqual(5, len(journal.load()))
+
+	def test_item_durability(self):
+		journal = progress.ProgressJournal(self.filename, batch_size=50, durability='item', clock=self.clock)
+		journal.record('a')
+		self.assertEqual({'a': 'ok'}, journal.load())
+
+	def test_close(self):
+		journal = progress.ProgressJournal(self.filename, durability='none', clock=self.clock)
+		journal.record('a', progress.FAILED)
+		journal.close()
+		self.assertEqual({'a': 'failed'}, journal.load())
+		# retried items are recorded again, and the last status wins
+		journal.record('a')
+		journal.close()
+		self.assertEqual({'a': 'ok'}, journal.load())
+		journal.remove()
+		self.assertFalse(os.path.isfile(self.filename))
+		self.assertEqual({}, journal.load())
+
+	def test_old_format(self):
+		with open(self.filename, 'w') as old:
+			old.write("a\n\nb c\n")
+		journal = progress.ProgressJournal(self.filename)
+		self.assertEqual({'a': 'ok', 'b c': 'ok'}, journal.load())
+
+	def test_tab_in_name(self):
+		journal = progress.ProgressJournal(self.filename)
+		journal.record("a\tb", 'failed')
+		journal.close()
+		with open(self.filename, 'a') as old:
+			old.write("c\td\n")
+		self.assertEqual({'a\tb': 'failed', 'c\td': 'ok'}, journal.load())
+
+	def test_worst_status(self):
+		self.assertEqual('ok', progress.worst_status([]))
+		self.assertEqual('unknown', progress.worst_status(['ok', 'unknown', 'ok']))
+		self.assertEqual('failed', progress.worst_status(['failed', 'unknown']))
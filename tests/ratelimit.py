@@ -0,0 +1,132 @@
+# -*- coding: UTF-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs.errors
+import medialinkfs.parsers.ratelimit as ratelimit
+
+base = os.path.dirname(__file__)
+
+class FakeClock(object):
+	def __init__(self):
+		self.now = 1000000.0
+		self.slept = []
+		self.lock = threading.Lock()
+	def time(self):
+		with self.lock:
+			return self.now
+	def sleep(self, delay):
+		with self.lock:
+			self.slept.append(delay)
+
+class TestRateLimit(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.clock = FakeClock()
+
+	def test_unlimited(self):
+		bucket = ratelimit.TokenBucket(clock=self.clock.time, sleep=self.clock.sleep)
+		for i in range(100):
+			bucket.acquire()
+		self.assertEqual(0, len(self.clock.slept))
+
+	def test_rate(self):
+		bucket = ratelimit.TokenBucket(0.5, 1, clock=self.clock.time, sleep=self.clock.sleep)
+		bucket.acquire()
+		self.assertEqual(0, len(self.clock.slept))
+		bucket.acquire()
+		self.assertEqual([2.0], self.clock.slept)
+		# the second call reserved the next slot, so the third waits longer
+		bucket.acquire()
+		self.assertEqual([2.0, 4.0], self.clock.slept)
+		# after enough time passes, no more waiting
+		self.clock.now += 100
+		self.clock.slept = []
+		bucket.acquire()
+		self.assertEqual(0, len(self.clock.slept))
+
+	def test_burst(self):
+		bucket = ratelimit.TokenBucket(1, 3, clock=self.clock.time, sleep=self.clock.sleep)
+		for i in range(3):
+			bucket.acquire()
+		self.assertEqual(0, len(self.clock.slept))
+		bucket.acquire()
+		self.assertEqual([1.0], self.clock.slept)
+
+	def test_threads(self):
+		bucket = ratelimit.TokenBucket(10, 1, clock=self.clock.time, sleep=self.clock.sleep)
+		threads = [threading.Thread(target=bucket.acquire) for i in range(10)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		# every caller got a distinct slot
+		self.assertEqual([round(0.1 * i, 5) for i in range(1, 10)],
+		                 sorted([round(x, 5) for x in self.clock.slept]))
+
+	def test_daily_quota(self):
+		bucket = ratelimit.TokenBucket(daily_quota=2, clock=self.clock.time, sleep=self.clock.sleep)
+		bucket.acquire()
+		self.assertFalse(bucket.is_exhausted())
+		bucket.acquire()
+		self.assertTrue(bucket.is_exhausted())
+		self.assertRaises(medialinkfs.errors.QuotaExceeded, bucket.acquire)
+		self.assertTrue(bucket.should_warn())
+		self.assertFalse(bucket.should_warn())
+		self.clock.now += 86400
+		self.assertFalse(bucket.is_exhausted())
+		bucket.acquire()
+
+	def test_daily_quota_count(self):
+		bucket = ratelimit.TokenBucket(daily_quota=5, clock=self.clock.time, sleep=self.clock.sleep)
+		bucket.acquire(3)
+		self.assertEqual(3, bucket.day_count)
+		# a batch that doesn't fit isn't sent at all
+		self.assertRaises(medialinkfs.errors.QuotaExceeded, bucket.acquire, 3)
+		self.assertEqual(3, bucket.day_count)
+		bucket.acquire(2)
+		self.assertTrue(bucket.is_exhausted())
+
+	def test_saved_usage(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			limiter = ratelimit.get_limiter('freebase', {'daily_quota': 3})
+			limiter.clock = self.clock.time
+			limiter.acquire()
+			limiter.acquire()
+			ratelimit.save_usage(tmpdir)
+			self.assertTrue(os.path.isfile(os.path.join(tmpdir, 'ratelimit.json')))
+			# the next run on the same day starts from the saved count
+			with ratelimit._limiters_lock:
+				ratelimit._limiters.clear()
+				ratelimit._saved_usage.clear()
+			ratelimit.load_usage(tmpdir)
+			limiter = ratelimit.get_limiter('freebase', {'daily_quota': 3})
+			limiter.clock = self.clock.time
+			limiter.acquire()
+			self.assertRaises(medialinkfs.errors.QuotaExceeded, limiter.acquire)
+			# and the day after starts over
+			self.clock.now += 86400
+			limiter.acquire()
+		finally:
+			with ratelimit._limiters_lock:
+				ratelimit._limiters.clear()
+				ratelimit._saved_usage.clear()
+			shutil.rmtree(tmpdir)
+
+	def test_get_limiter(self):
+		limiter = ratelimit.get_limiter('mymovieapi', {})
+		self.assertEqual(0.5, limiter.rate)
+		self.assertTrue(limiter is ratelimit.get_limiter('mymovieapi', {'type': 'movie'}))
+		changed = ratelimit.get_limiter('mymovieapi', {'rate_limit': 2, 'burst': 4})
+		self.assertFalse(limiter is changed)
+		self.assertEqual(2, changed.rate)
+		self.assertEqual(4, changed.burst)
+		self.assertEqual(None, ratelimit.get_limiter('omdbapi', {}).rate)
+		self.assertEqual(100000, ratelimit.get_limiter('freebase', {}).daily_quota)
@@ -0,0 +1,113 @@
+# -*- coding: UTF-8 -*-
+import os
+import re
+import tempfile
+import shutil
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs
+import medialinkfs.organize
+import medialinkfs.scanner as scanner
+import medialinkfs.parsers.dummy as dummy
+
+base = os.path.dirname(__file__)
+
+class TestScanner(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.tmpdir = tempfile.mkdtemp()
+		self.settings = {
+			"name": "test",
+			"scanMode": "toplevel",
+			"sourceDir": self.tmpdir,
+			"cacheDir": os.path.join(self.tmpdir, ".cache"),
+			"output": [{"dest": os.path.join(self.tmpdir, "Actors"), "groupBy": "actors"}]
+		}
+		for name in ['b dir', 'a dir', '.cache', 'Actors']:
+			os.mkdir(os.path.join(self.tmpdir, name))
+		for name in ['d file', 'c file']:
+			with open(os.path.join(self.tmpdir, name), 'w'):
+				pass
+		os.symlink(os.path.join(self.tmpdir, 'a dir'), os.path.join(self.tmpdir, 'e link'))
+		self.omitted_dirs = medialinkfs.organize.generate_omitted_dirs(self.settings)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def scan(self, **settings):
+		self.settings.update(settings)
+		return list(scanner.scan_items(self.settings, None, self.omitted_dirs))
+
+	def test_modes(self):
+		self.assertEqual(['a dir', 'b dir', 'c file', 'd file', 'e link'], self.scan())
+		# links to directories count as directories, like os.path.isdir
+		self.assertEqual(['a dir', 'b dir', 'e link'], self.scan(scanMode='directories'))
+		self.assertEqual(['c file', 'd file'], self.scan(scanMode='files'))
+		regex = re.compile('dir$')
+		self.settings['scanMode'] = 'toplevel'
+		self.assertEqual(['a dir', 'b dir'], list(scanner.scan_items(self.settings, regex, self.omitted_dirs)))
+
+	def test_order(self):
+		streamed = self.scan(scanOrder='directory')
+		self.assertEqual(['a dir', 'b dir', 'c file', 'd file', 'e link'], sorted(streamed))
+		self.assertEqual(sorted(streamed), self.scan(scanOrder='sorted'))
+		self.assertEqual(sorted(streamed), self.scan(scanOrder='shuffled'))
+
+class TestRecursive(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		dummy.data = {"Album": {"actors": ["Sir George"]},
+		              "Single.mp3": {"actors": ["Sir Phil"]}}
+		self.tmpdir = tempfile.mkdtemp()
+		self.settings = {
+			"name": "test",
+			"parsers": ["dummy"],
+			"scanMode": "recursive",
+			"sourceDir": os.path.join(self.tmpdir, "All"),
+			"cacheDir": os.path.join(self.tmpdir, "All", ".cache"),
+			"output": [{"dest": os.path.join(self.tmpdir, "All", "Actors"), "groupBy": "actors"}]
+		}
+		for path in ['Artist/Album/Disc 1', 'Artist/Album/Scans', 'Other/Album', 'Other/Empty', 'Actors/Sir Phil']:
+			os.makedirs(os.path.join(self.tmpdir, "All", path))
+		for path in ['Artist/Album/Disc 1/01.mp3', 'Artist/Album/Scans/cover.jpg', 'Artist/Album/02.flac',
+		             'Other/Album/01.MP3', 'Other/notes.txt', 'Single.mp3', 'Actors/Sir Phil/03.mp3']:
+			with open(os.path.join(self.tmpdir, "All", path), 'w'):
+				pass
+		self.omitted_dirs = medialinkfs.organize.generate_omitted_dirs(self.settings)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def scan(self, **settings):
+		settings.update(self.settings)
+		return list(scanner.scan_items(settings, None, self.omitted_dirs))
+
+	def test_rules(self):
+		# the output dir is pruned, even though it has an mp3 in it
+		self.assertEqual(['Artist/Album', 'Other/Album', 'Single.mp3'], self.scan())
+		self.assertEqual(['Single.mp3'], self.scan(scanDepth=1))
+		self.assertEqual(['Artist/Album/Disc 1', 'Other/Album', 'Single.mp3'],
+		                 self.scan(itemExtensions=['.MP3']))
+		self.assertEqual(['Artist/Album', 'Other/Album', 'Other/Empty', 'Other/notes.txt'],
+		                 self.scan(itemRule='depth', scanDepth=2))
+		self.assertEqual(['Other/notes.txt', 'Single.mp3'], self.scan(itemRule='files', scanDepth=2))
+
+	def test_wanted(self):
+		wanted = lambda name: medialinkfs.organize.is_wanted_item(self.settings, name, None, self.omitted_dirs)
+		self.assertTrue(wanted('Artist/Album'))
+		self.assertTrue(wanted('Single.mp3'))
+		self.assertFalse(wanted('Artist'))
+		self.assertFalse(wanted('Actors'))
+		self.assertEqual(['Artist/Album'], list(scanner.walk_items(self.settings, None, self.omitted_dirs, 'Artist')))
+		self.assertEqual([], list(scanner.walk_items(self.settings, None, self.omitted_dirs, 'Artist/Missing')))
+
+	def test_organize(self):
+		medialinkfs.organize.organize_set({}, self.settings)
+		link = os.path.join(self.tmpdir, "All", "Actors", "Sir George", "Artist／Album")
+		self.assertTrue(os.path.islink(link))
+		self.assertEqual(os.path.join(self.tmpdir, "All", "Artist", "Album"), os.path.realpath(link))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "All", "Actors", "Sir Phil", "Single.mp3")))
+		self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, "All", "Actors", "Sir Phil", "03.mp3")))
@@ -0,0 +1,61 @@
+# -*- coding: UTF-8 -*-
+import os
+import tempfile
+import shutil
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs.toc as toc
+
+base = os.path.dirname(__file__)
+
+class TestToc(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.tmpdir = tempfile.mkdtemp()
+		self.filename = os.path.join(self.tmpdir, '.toc.done-test')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_buffered(self):
+		writer = toc.TocWriter('test')
+		writer.add(self.tmpdir, 'Sir George')
+		writer.add(self.tmpdir, 'Sir Phil')
+		writer.add(self.tmpdir, 'Sir George')
+		self.assertFalse(os.path.isfile(self.filename))
+		writer.flush()
+		with open(self.filename) as written:
+			self.assertEqual("Sir George\nSir Phil\n", written.read())
+		self.assertEqual(['.toc.done-test'], os.listdir(self.tmpdir))
+
+		# changes are applied on top of the existing file
+		writer.remove(self.tmpdir, 'Sir Phil')
+		writer.add(self.tmpdir, 'Sir Harry')
+		writer.flush()
+		self.assertEqual(set(['Sir George', 'Sir Harry']), toc.load_toc(self.filename))
+
+	def test_unchanged(self):
+		writer = toc.TocWriter('test')
+		writer.set(self.tmpdir, ['one', 'two'])
+		writer.flush()
+		inode = os.stat(self.filename).st_ino
+		writer.set(self.tmpdir, ['two', 'one'])
+		writer.flush()
+		self.assertEqual(inode, os.stat(self.filename).st_ino)
+
+	def test_old_tocs(self):
+		for name in ['.toc-test', '.toc.old-test', '.toc-other']:
+			open(os.path.join(self.tmpdir, name), 'w').close()
+		writer = toc.TocWriter('test')
+		writer.set(self.tmpdir, ['one'])
+		writer.flush()
+		self.assertEqual(['.toc-other', '.toc.done-test'], sorted(os.listdir(self.tmpdir)))
+
+	def test_dry_run(self):
+		writer = toc.TocWriter('test', dry_run=True)
+		writer.set(self.tmpdir, ['one'])
+		writer.flush()
+		self.assertEqual([], os.listdir(self.tmpdir))
@@ -79,3 +79,15 @@ class TestUtils(unittest.TestCase):
 		self.assertTrue('one' in meta['actors'])
 		self.assertTrue('two' in meta['actors'])
 		self.assertTrue('three' in meta['actors'])
+
+	def test_deep_merge_list_order(self):
+		meta = {"actors":["one","two"]}
+		new = {"actors":["three","two","four","three"]}
+		deepmerge.deep_merge(meta, new)
+		self.assertEqual(["one","two","three","four"], meta['actors'])
+
+	def test_deep_merge_list_unhashable(self):
+		meta = {"actors":[{"name":"one"}, "two"]}
+		new = {"actors":[{"name":"one"}, ["two"], "two", {"name":"three"}, ["two"]]}
+		deepmerge.deep_merge(meta, new)
+		self.assertEqual([{"name":"one"}, "two", ["two"], {"name":"three"}], meta['actors'])
@@ -6,11 +6,65 @@ import unittest
 
 import logging
 logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+import threading
 
 import medialinkfs.parsers.vgmdb as vgmdb
 
 base = os.path.dirname(__file__)
 
+# a small series of products, which link back to each other
+pages = {
+	'product/1': {'franchises': [{'link': 'product/10'}], 'products': [{'link': 'product/2'}, {'link': 'product/3'}]},
+	'product/2': {'franchises': [{'link': 'product/11'}], 'products': [{'link': 'product/1'}]},
+	'product/3': {'franchises': [{'link': 'product/10'}], 'products': [{'link': 'product/2'}, {'names': {}}]},
+	'product/10': {'name': 'Ace Attorney'},
+	'product/11': {'name': 'Professor Layton'}
+}
+
+class FakeLoader(object):
+	def __init__(self):
+		self.loaded = []
+		self.lock = threading.Lock()
+	def __call__(self, link, settings={}):
+		with self.lock:
+			self.loaded.append(link)
+		return pages[link]
+
+class TestFranchiseResolver(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		self.tmpdir = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmpdir, 'vgmdb-franchises.json')
+		self.loader = FakeLoader()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_resolve(self):
+		resolver = vgmdb.FranchiseResolver(self.path, load=self.loader)
+		self.assertEqual(['Ace Attorney', 'Professor Layton'], resolver.resolve(['product/1']))
+		self.assertEqual(5, len(self.loader.loaded))
+		self.assertEqual(5, len(set(self.loader.loaded)))
+		# the results are remembered for the run
+		self.assertEqual(['Professor Layton', 'Ace Attorney'], resolver.resolve(['product/2']))
+		self.assertEqual(5, len(self.loader.loaded))
+		resolver.save_file()
+
+		# and between runs
+		resolver = vgmdb.FranchiseResolver(self.path, load=self.loader)
+		self.assertEqual(['Ace Attorney', 'Professor Layton'], resolver.resolve(['product/3']))
+		self.assertEqual(5, len(self.loader.loaded))
+
+		# until they expire
+		resolver = vgmdb.FranchiseResolver(self.path, ttl=0, load=self.loader)
+		self.assertEqual(['Ace Attorney', 'Professor Layton'], resolver.resolve(['product/3']))
+		self.assertEqual(10, len(self.loader.loaded))
+
+	def test_serial(self):
+		resolver = vgmdb.FranchiseResolver(workers=1, load=self.loader)
+		self.assertEqual(['Professor Layton', 'Ace Attorney'], resolver.resolve(['product/2', 'product/1']))
+		self.assertEqual(['product/2', 'product/1', 'product/11', 'product/10', 'product/3'], self.loader.loaded)
+
 class TestVGMDB(unittest.TestCase):
 	def setUp(self):
 		logging.debug("Initializing unittest %s"%(self.id(),))
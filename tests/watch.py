@@ -0,0 +1,122 @@
+# -*- coding: UTF-8 -*-
+import os
+import tempfile
+import shutil
+import time
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs
+import medialinkfs.organize
+import medialinkfs.toc as toc
+import medialinkfs.watch as watch
+import medialinkfs.parsers.dummy as dummy
+
+base = os.path.dirname(__file__)
+
+class TestWatch(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		dummy.data = {"test": {
+		  "actors": ["Sir George"]
+		}}
+		self.tmpdir = tempfile.mkdtemp()
+		self.settings = {
+			"name": "test",
+			"parsers": ["dummy"],
+			"scanMode": "directories",
+			"sourceDir": os.path.join(self.tmpdir, "All"),
+			"cacheDir": os.path.join(self.tmpdir, ".cache"),
+			"watchDelay": 0.2,
+			"output": [{
+				"dest": os.path.join(self.tmpdir, "Actors"),
+				"groupBy": "actors"
+			}]
+		}
+		os.mkdir(os.path.join(self.tmpdir, "All"))
+		os.mkdir(os.path.join(self.tmpdir, "Actors"))
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_batcher(self):
+		batcher = watch.EventBatcher(5)
+		batcher.touch('one', 100)
+		batcher.touch('two', 101)
+		batcher.touch('one', 103)
+		self.assertEqual([], batcher.ready(104))
+		self.assertEqual(['two'], batcher.ready(106))
+		self.assertEqual([], batcher.ready(107))
+		self.assertEqual(['one'], batcher.ready(108))
+		self.assertEqual(0, batcher.pending())
+
+	def wait_for(self, inotify, watcher, check):
+		deadline = time.time() + 5
+		while time.time() < deadline:
+			for wd, mask, cookie, name in inotify.read_events(timeout=0.1):
+				watcher.handle_event(wd, mask, name, time.time())
+			watcher.process_ready(time.time())
+			if check():
+				return
+		self.fail("Timed out waiting for changes")
+
+	@unittest.skipUnless(watch.available(), "inotify is not available")
+	def test_watch(self):
+		settings = watch.prepare_watch_settings(self.settings)
+		medialinkfs.organize.organize_set({}, settings)
+		inotify = watch.Inotify()
+		watcher = watch.SetWatcher({}, settings, inotify)
+		link = os.path.join(self.tmpdir, "Actors", "Sir George", "test")
+		try:
+			# copy in an item with a few files, it gets organized once
+			loaded = []
+			def get_metadata(metadata, settings={}):
+				loaded.append(metadata['name'])
+				return dict(dummy.data[metadata['name']])
+			original = dummy.get_metadata
+			dummy.get_metadata = get_metadata
+			try:
+				os.mkdir(os.path.join(self.tmpdir, "All", "test"))
+				for index in range(10):
+					with open(os.path.join(self.tmpdir, "All", "test", "%s.mp3"%(index,)), 'w') as output:
+						output.write("test\n")
+				self.wait_for(inotify, watcher, lambda: os.path.islink(link))
+			finally:
+				dummy.get_metadata = original
+			self.assertEqual(['test'], loaded)
+			self.assertEqual(set(['test']), toc.load_toc(os.path.join(self.tmpdir, "Actors", "Sir George", ".toc.done-test")))
+			self.assertEqual(set(['Sir George']), toc.load_toc(os.path.join(self.tmpdir, "Actors", ".toc.done-test")))
+
+			# removing it removes the links
+			shutil.rmtree(os.path.join(self.tmpdir, "All", "test"))
+			self.wait_for(inotify, watcher, lambda: not os.path.islink(link))
+			self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir George")))
+			self.assertEqual(set(), toc.load_toc(os.path.join(self.tmpdir, "Actors", ".toc.done-test")))
+		finally:
+			watcher.close()
+			inotify.close()
+
+	@unittest.skipUnless(watch.available(), "inotify is not available")
+	def test_watch_recursive(self):
+		self.settings['scanMode'] = 'recursive'
+		dummy.data = {"Album": {"actors": ["Sir George"]}}
+		settings = watch.prepare_watch_settings(self.settings)
+		medialinkfs.organize.organize_set({}, settings)
+		inotify = watch.Inotify()
+		watcher = watch.SetWatcher({}, settings, inotify)
+		link = os.path.join(self.tmpdir, "Actors", "Sir George", "Artist／Album")
+		try:
+			os.makedirs(os.path.join(self.tmpdir, "All", "Artist", "Album"))
+			with open(os.path.join(self.tmpdir, "All", "Artist", "Album", "01.mp3"), 'w') as output:
+				output.write("test\n")
+			self.wait_for(inotify, watcher, lambda: os.path.islink(link))
+			self.assertEqual(set(['Artist／Album']), toc.load_toc(os.path.join(self.tmpdir, "Actors", "Sir George", ".toc.done-test")))
+
+			shutil.rmtree(os.path.join(self.tmpdir, "All", "Artist"))
+			self.wait_for(inotify, watcher, lambda: not os.path.islink(link))
+			self.assertFalse(os.path.isdir(os.path.join(self.tmpdir, "Actors", "Sir George")))
+		finally:
+			watcher.close()
+			inotify.close()
@@ -0,0 +1,88 @@
+# -*- coding: UTF-8 -*-
+import os
+import tempfile
+import shutil
+import unittest
+
+import logging
+logging.basicConfig(level=logging.DEBUG, filename='tests.log')
+
+import medialinkfs
+import medialinkfs.organize
+import medialinkfs.workers as workers
+import medialinkfs.parsers.dummy as dummy
+
+base = os.path.dirname(__file__)
+
+class TestWorkers(unittest.TestCase):
+	def setUp(self):
+		logging.debug("Initializing unittest %s"%(self.id(),))
+		dummy.data = {"test": {"actors": ["Sir George"]},
+		              "test2": {"actors": ["Sir Phil"]}}
+		self.get_metadata = dummy.get_metadata
+		def get_metadata(metadata, settings={}):
+			ret = self.get_metadata(metadata, settings)
+			if ret is not None:
+				ret['pids'] = [str(os.getpid())]
+			return ret
+		dummy.get_metadata = get_metadata
+		dummy.workload = 'cpu'
+		self.tmpdir = tempfile.mkdtemp()
+		self.settings = {
+			"name": "test",
+			"parsers": ["dummy"],
+			"processes": 2,
+			"scanMode": "directories",
+			"sourceDir": os.path.join(self.tmpdir, "All"),
+			"cacheDir": os.path.join(self.tmpdir, ".cache"),
+			"output": [{
+				"dest": os.path.join(self.tmpdir, "Actors"),
+				"groupBy": "actors"
+			}, {
+				"dest": os.path.join(self.tmpdir, "Pids"),
+				"groupBy": "pids"
+			}]
+		}
+		os.mkdir(os.path.join(self.tmpdir, "All"))
+		os.mkdir(os.path.join(self.tmpdir, "All", 'test'))
+		os.mkdir(os.path.join(self.tmpdir, "All", 'test2'))
+		os.mkdir(os.path.join(self.tmpdir, "Actors"))
+		os.mkdir(os.path.join(self.tmpdir, "Pids"))
+
+	def tearDown(self):
+		dummy.get_metadata = self.get_metadata
+		del dummy.workload
+		shutil.rmtree(self.tmpdir)
+
+	def list_pids(self):
+		path = os.path.join(self.tmpdir, "Pids")
+		return [name for name in os.listdir(path) if name[0] != '.']
+
+	def test_is_cpu_bound(self):
+		self.assertTrue(workers.is_cpu_bound(dummy))
+		del dummy.workload
+		self.assertFalse(workers.is_cpu_bound(dummy))
+		dummy.workload = 'io'
+
+	def test_processes(self):
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir George", "test")))
+		self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "Actors", "Sir Phil", "test2")))
+		pids = self.list_pids()
+		self.assertTrue(len(pids) > 0)
+		self.assertFalse(str(os.getpid()) in pids)
+		# the pool is stopped along with the set
+		self.assertEqual(None, workers.get_pool(self.settings))
+
+	def test_io_parsers(self):
+		# io parsers stay in the organizing process
+		dummy.workload = 'io'
+		self.assertEqual(None, workers.start_pool(self.settings))
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertEqual([str(os.getpid())], self.list_pids())
+
+	def test_disabled(self):
+		del self.settings['processes']
+		self.assertEqual(None, workers.start_pool(self.settings))
+		medialinkfs.organize.organize_set({}, self.settings)
+		self.assertEqual([str(os.getpid())], self.list_pids())